@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+
+
+class CatalogTrackFilter(BaseModel):
+    tag_id: int
+    rule: str = Field("include", pattern="^(include|exclude)$")
+
+
+class CatalogIn(BaseModel):
+    id: int | None = None
+    user_id: int | None = None
+    name: str
+    track_filters: list[CatalogTrackFilter] = []
+    tag_ids: list[int] = []
+
+
+class CatalogOut(CatalogIn):
+    track_count: int = 0
+    completed_count: int = 0
@@ -0,0 +1,39 @@
+from typing import Annotated, Literal
+
+from pydantic import BaseModel, Field
+
+from backend.app.models.web.track import TrackIn
+
+"""
+The records of a library export (see services/library_backup.py), one per line of the file.
+"kind" says which record a line is, so a whole chunk of lines can be validated in one call.
+"""
+
+
+class LibraryMeta(BaseModel):
+    kind: Literal["meta"]
+    format: str
+    version: int
+    exported_at: str | None = None
+
+
+class LibraryTag(BaseModel):
+    kind: Literal["tag"]
+    id: int  # the tag's id in the exported database, only used to link the records
+    name: str
+    type: str
+    parent: int | None = None
+    locked: bool = False
+
+
+class LibraryTrack(TrackIn):
+    kind: Literal["track"]
+    user_id: int | None = None
+    tags: tuple[
+        int, ...
+    ] = ()  # ids of tag records (a tuple, so the default isn't copied)
+
+
+LibraryRecord = Annotated[
+    LibraryMeta | LibraryTag | LibraryTrack, Field(discriminator="kind")
+]
@@ -18,3 +18,57 @@ class TagIn(BaseModel):
 
 class TagOut(TagIn):
     pass
+
+
+class TrackTagBulk(BaseModel):
+    track_ids: list[int]
+    tag_ids: list[int]
+
+
+class TagTreeNode(BaseModel):
+    """A tag in a nested import, with the tags under it."""
+
+    temp_id: str | int | None = None
+    name: str
+    type: str
+    locked: bool = False
+    children: list["TagTreeNode"] = []
+
+
+class TagImportItem(BaseModel):
+    """
+    A tag in a flat import. parent is the temp_id of another imported tag,
+    parent_id the id of one of the user's existing tags.
+    """
+
+    temp_id: str | int
+    name: str
+    type: str
+    locked: bool = False
+    parent: str | int | None = None
+    parent_id: int | None = None
+
+
+class TagImport(BaseModel):
+    parent_id: int | None = None
+    tree: list[TagTreeNode] = []
+    tags: list[TagImportItem] = []
+
+
+class TagMove(BaseModel):
+    tag_id: int
+    parent: int | None = None  # None makes it a top-level tag
+
+
+class TagMoveBulk(BaseModel):
+    moves: list[TagMove]
+
+
+class TagCopy(BaseModel):
+    tag_id: int
+    parent: int | None = None
+
+
+class TagCopyBulk(BaseModel):
+    copies: list[TagCopy]
+    tracks: bool = True  # copy the tracks each tag is on too
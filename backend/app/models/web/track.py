@@ -18,4 +18,9 @@ class TrackIn(BaseModel):
 
 
 class TrackOut(TrackIn):
-    pass
+    id: int | None = None
+
+
+class SpotifySync(BaseModel):
+    access_token: str
+    full: bool = False
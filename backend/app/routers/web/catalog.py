@@ -0,0 +1,218 @@
+from fastapi import APIRouter, HTTPException, Query, Depends
+from backend.app.models.web.catalog import CatalogIn, CatalogOut
+from backend.app.services import catalogs
+from backend.app.services.jobs import accepted, submit_db_job
+from backend.app.services.track_rows import TRACK_SELECT, tracks_json
+from backend.app.services.track_tags import UnknownTagsError, check_tags
+from backend.async_database import db
+from backend.auth import get_current_user
+
+router = APIRouter()
+
+
+"""
+Catalogs are queues of tracks to work through, built from tag filters.
+See services/catalogs.py for how the list of tracks is chosen and kept up to date.
+"""
+
+
+def get_catalog_row(cursor, catalog_id: int, user_id):
+    cursor.execute(
+        "SELECT id, name FROM catalog WHERE id = ? AND user_id = ?",
+        (catalog_id, user_id),
+    )
+    catalog = cursor.fetchone()
+    if catalog is None:
+        raise HTTPException(status_code=404, detail="Catalog not found")
+    return catalog
+
+
+def catalog_out(cursor, catalog_id: int, name: str, user_id) -> CatalogOut:
+    cursor.execute(
+        "SELECT tag_id, rule FROM catalog_track_filter WHERE catalog_id = ?",
+        (catalog_id,),
+    )
+    track_filters = [{"tag_id": row[0], "rule": row[1]} for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT tag_id FROM catalog_tag_filter WHERE catalog_id = ?", (catalog_id,)
+    )
+    tag_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        """
+        SELECT COUNT(*), COALESCE(SUM(completed), 0) FROM catalog_track_log
+        WHERE catalog_id = ?
+        """,
+        (catalog_id,),
+    )
+    track_count, completed_count = cursor.fetchone()
+    return CatalogOut(
+        id=catalog_id,
+        user_id=user_id,
+        name=name,
+        track_filters=track_filters,
+        tag_ids=tag_ids,
+        track_count=track_count,
+        completed_count=completed_count,
+    )
+
+
+@router.post("/")
+async def create_catalog(
+    catalog: CatalogIn,
+    user_id: str = Depends(get_current_user),
+):
+    def insert(conn):
+        cursor = conn.cursor()
+        tag_ids = [f.tag_id for f in catalog.track_filters] + catalog.tag_ids
+
+        try:
+            cursor.execute("BEGIN")
+            if tag_ids:
+                check_tags(cursor, user_id, list(dict.fromkeys(tag_ids)))
+
+            cursor.execute(
+                "INSERT INTO catalog (user_id, name) VALUES (?, ?)",
+                (user_id, catalog.name),
+            )
+            catalog_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO catalog_track_filter (catalog_id, tag_id, rule) VALUES (?, ?, ?)",
+                [(catalog_id, f.tag_id, f.rule) for f in catalog.track_filters],
+            )
+            cursor.executemany(
+                "INSERT INTO catalog_tag_filter (catalog_id, tag_id) VALUES (?, ?)",
+                [(catalog_id, tag_id) for tag_id in catalog.tag_ids],
+            )
+            catalogs.materialize(cursor, user_id, catalog_id)
+            conn.commit()
+        except UnknownTagsError as e:
+            conn.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail={"error": "Tags not found", "tag_ids": e.tag_ids},
+            )
+
+        return catalog_out(cursor, catalog_id, catalog.name, user_id)
+
+    return await db.write(insert)
+
+
+@router.get("/catalogs")
+async def get_catalogs(user_id: str = Depends(get_current_user)):
+    def read(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM catalog WHERE user_id = ?", (user_id,))
+        return [
+            catalog_out(cursor, row[0], row[1], user_id) for row in cursor.fetchall()
+        ]
+
+    return await db.read(read)
+
+
+"""
+Rebuilds the catalog's track list from its filters, starting over (every track is uncompleted again).
+Changes to tracks and tags already update catalogs on their own, this is for starting fresh.
+background=true rebuilds it in a background job (see GET /jobs/{id}), rebuilds asked for while
+one is waiting to run are done once.
+"""
+
+
+def run_materialize(conn, user_id, catalog_id: int) -> CatalogOut:
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    catalog = get_catalog_row(cursor, catalog_id, user_id)
+    catalogs.materialize(cursor, user_id, catalog_id)
+    conn.commit()
+    return catalog_out(cursor, catalog_id, catalog[1], user_id)
+
+
+@router.post("/{catalog_id}/materialize")
+async def materialize_catalog(
+    catalog_id: int,
+    background: bool = Query(False),
+    user_id: str = Depends(get_current_user),
+):
+    if background:
+        await db.read(lambda conn: get_catalog_row(conn.cursor(), catalog_id, user_id))
+        job = submit_db_job(
+            "materialize",
+            user_id,
+            lambda conn, job: run_materialize(conn, user_id, catalog_id).model_dump(),
+            coalesce_key=("materialize", catalog_id),
+        )
+        return accepted(job)
+
+    return await db.write(run_materialize, user_id, catalog_id)
+
+
+@router.get("/{catalog_id}/next")
+async def get_next_track(
+    catalog_id: int,
+    user_id: str = Depends(get_current_user),
+):
+    def read(conn):
+        cursor = conn.cursor()
+        get_catalog_row(cursor, catalog_id, user_id)
+
+        entry = catalogs.next_track(cursor, catalog_id)
+        if entry is None:
+            return {"catalog_index": None, "track": None}
+
+        cursor.execute(TRACK_SELECT + " WHERE id = ?", (entry[0],))
+        return {
+            "catalog_index": entry[1],
+            "track": tracks_json(cursor, cursor.fetchall())[0],
+        }
+
+    return await db.read(read)
+
+
+@router.post("/{catalog_id}/tracks/{track_id}/complete")
+async def complete_track(
+    catalog_id: int,
+    track_id: int,
+    completed: bool = Query(True),
+    user_id: str = Depends(get_current_user),
+):
+    def update(conn):
+        cursor = conn.cursor()
+        get_catalog_row(cursor, catalog_id, user_id)
+
+        cursor.execute(
+            """
+            UPDATE catalog_track_log SET completed = ?
+            WHERE catalog_id = ? AND track_id = ?
+            """,
+            (completed, catalog_id, track_id),
+        )
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Track not in catalog")
+        conn.commit()
+
+        return {"catalog_id": catalog_id, "track_id": track_id, "completed": completed}
+
+    return await db.write(update)
+
+
+@router.delete("/{catalog_id}")
+async def delete_catalog(
+    catalog_id: int,
+    user_id: str = Depends(get_current_user),
+):
+    def delete(conn):
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        get_catalog_row(cursor, catalog_id, user_id)
+
+        for table in (
+            "catalog_track_log",
+            "catalog_track_filter",
+            "catalog_tag_filter",
+        ):
+            cursor.execute(f"DELETE FROM {table} WHERE catalog_id = ?", (catalog_id,))
+        cursor.execute("DELETE FROM catalog WHERE id = ?", (catalog_id,))
+        conn.commit()
+
+        return {"message": "Catalog deleted", "catalog_id": catalog_id}
+
+    return await db.write(delete)
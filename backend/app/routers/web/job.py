@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException, Depends
+from backend.app.services.jobs import queue
+from backend.auth import get_current_user
+
+router = APIRouter()
+
+
+"""
+Status of background jobs (syncs, bulk tagging, catalog rebuilds started with background=true).
+Poll GET /jobs/{id} until status is "done" (the result is in "result") or "failed" (see "error").
+"""
+
+
+@router.get("/")
+def get_jobs(user_id: str = Depends(get_current_user)):
+    return [job.to_dict() for job in queue.for_user(user_id)]
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str, user_id: str = Depends(get_current_user)):
+    job = queue.get(job_id)
+    if job is None or job.user_id != str(user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
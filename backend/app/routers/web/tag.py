@@ -1,6 +1,25 @@
-from fastapi import APIRouter, HTTPException, Header, Depends
-from backend.app.models.web.tag import TagIn, TagOut
-from backend.database import get_connection
+import json
+from fastapi import APIRouter, HTTPException, Header, Depends, Query, Response
+from backend.app.models.web.tag import (
+    TagCopyBulk,
+    TagImport,
+    TagIn,
+    TagMoveBulk,
+    TagOut,
+    TrackTagBulk,
+)
+from backend.app.services import catalogs, library_stats, tag_batch, tag_tree
+from backend.app.services.jobs import accepted, submit_db_job
+from backend.app.services.tag_import import TagImportError, insert_tags, plan_import
+from backend.app.services.track_tags import (
+    UnknownTagsError,
+    apply_tags,
+    check_tags,
+    remove_tags,
+)
+from backend.app.services.tag_hierarchy import build_tags_hierarchy, hierarchy_cache
+from backend.app.services.user_cache import etag_matches
+from backend.async_database import db
 from backend.auth import get_current_user
 
 
@@ -14,48 +33,104 @@ API calls related to the user must go through the auth process with get_current_
 
 
 @router.post("/")
-def create_tag(tag: TagIn, user_id: str = Depends(get_current_user)):
+async def create_tag(
+    tag: TagIn,
+    user_id: str = Depends(get_current_user),
+):
+    def insert(conn):
+
+        cursor = conn.cursor()
+        parent = tag_tree.stored_parent(tag.parent)
+
+        # the parent has to be one of the user's own tags, or the closure would link across users
+        if parent is not None:
+            cursor.execute(
+                "SELECT 1 FROM tag WHERE id = ? AND user_id = ?", (parent, user_id)
+            )
+            if cursor.fetchone() is None:
+                raise HTTPException(status_code=404, detail="Parent tag not found")
+
+        cursor.execute(
+            """
+            INSERT INTO tag (user_id, name, type, parent, locked) VALUES (?, ?, ?, ?, ?)
+                """,
+            (user_id, tag.name, tag.type, parent, tag.locked),
+        )
+        tag_id = cursor.lastrowid
+        tag_tree.add_tag(cursor, tag_id, parent)
 
-    conn = get_connection()
-    cursor = conn.cursor()
+        conn.commit()
+        hierarchy_cache.invalidate(user_id)
+        library_stats.invalidate(user_id)
 
-    cursor.execute(
-        """
-        INSERT INTO tag (user_id, name, type, parent, locked) VALUES (?, ?, ?, ?, ?)
-            """,
-        (user_id, tag.name, tag.type, tag.parent, tag.locked),
-    )
+        return TagOut(
+            id=tag_id,
+            user_id=tag.user_id,
+            name=tag.name,
+            type=tag.type,
+            parent=parent,
+            locked=tag.locked,
+        )
 
-    conn.commit()
-    conn.close()
+    return await db.write(insert)
 
-    return TagOut(
-        id=cursor.lastrowid,
-        user_id=tag.user_id,
-        name=tag.name,
-        type=tag.type,
-        parent=tag.parent,
-        locked=tag.locked,
-    )
 
+"""
+Creates a whole tree of tags in one request and one transaction, see services/tag_import.py.
+The answer maps the client's temp ids to the new tag ids.
+"""
 
-@router.get("/")
-def get_tag(tag: TagIn, user_id: str = Depends(get_current_user)):
-    conn = get_connection()
-    cursor = conn.cursor()
 
-    cursor.execute(
-        """
-        SELECT id, name, type, locked FROM tag WHERE user_id = ? AND id = ?
-        """,
-        (user_id, tag.id),
-    )
+@router.post("/import")
+async def import_tags(
+    body: TagImport,
+    user_id: str = Depends(get_current_user),
+):
+    try:
+        planned = plan_import(body)
+    except TagImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def insert(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            # the parents outside the import have to be the user's own tags
+            existing = {tag.parent_id for tag in planned if tag.parent_id is not None}
+            if existing:
+                check_tags(cursor, user_id, sorted(existing))
+            ids = insert_tags(cursor, user_id, planned)
+        except UnknownTagsError as e:
+            conn.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail={"error": "Parent tags not found", "tag_ids": e.tag_ids},
+            )
+        conn.commit()
+        hierarchy_cache.invalidate(user_id)
+        library_stats.invalidate(user_id)
+        return {"created": len(ids), "ids": ids}
+
+    return await db.write(insert)
 
-    # only one song has this ID, so we're fetching index 0 of size 1
-    tag_data = cursor.fetchone()
 
-    conn.commit()
-    conn.close()
+@router.get("/")
+async def get_tag(
+    tag: TagIn,
+    user_id: str = Depends(get_current_user),
+):
+    def read(conn):
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, name, type, locked FROM tag WHERE user_id = ? AND id = ?
+            """,
+            (user_id, tag.id),
+        )
+        # only one song has this ID, so we're fetching index 0 of size 1
+        return cursor.fetchone()
+
+    tag_data = await db.read(read)
     return (
         TagOut(
             id=tag.id,
@@ -71,20 +146,14 @@ def get_tag(tag: TagIn, user_id: str = Depends(get_current_user)):
 
 
 @router.get("/tags")
-def get_tags(user_id: str = Depends(get_current_user)):
-
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT id, name, type, parent, locked FROM tag WHERE user_id = ?
-        """,
-        (user_id,),
+async def get_tags(user_id: str = Depends(get_current_user)):
+    tags = await db.read(
+        lambda conn: conn.execute(
+            "SELECT id, name, type, parent, locked FROM tag WHERE user_id = ?",
+            (user_id,),
+        ).fetchall()
     )
-    tags = cursor.fetchall()
 
-    conn.close()
     return [
         TagOut(
             id=tag[0],
@@ -99,135 +168,241 @@ def get_tags(user_id: str = Depends(get_current_user)):
 
 
 @router.get("/tags_hierarchy")
-def get_tags_hierarchy(user_id: str = Depends(get_current_user)):
-    conn = get_connection()
-    cursor = conn.cursor()
+async def get_tags_hierarchy(
+    if_none_match: str | None = Header(None),
+    user_id: str = Depends(get_current_user),
+):
+    cached = hierarchy_cache.get(user_id)
+    if cached is None:
+        token = hierarchy_cache.start_build(user_id)
+        tree = await db.read(lambda conn: build_tags_hierarchy(conn.cursor(), user_id))
+        body = json.dumps(tree, separators=(",", ":")).encode()
+        cached = (hierarchy_cache.put(user_id, body, token), body)
+
+    version, body = cached
+    etag = f'"{version}"'
+    # no-cache lets the browser keep the tree, but it has to check the ETag every time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-    cursor.execute(
-        """
-        SELECT id, name, type, parent, locked FROM tag WHERE user_id = ?
-        """,
-        (user_id,),
-    )
-    tags = cursor.fetchall()
-    conn.close()
-
-    tags = [
-        {
-            "id": tag[0],
-            "name": tag[1],
-            "type": tag[2],
-            "parent": tag[3],
-            "locked": tag[4],
-            "user_id": user_id,
-        }
-        for tag in tags
-    ]
 
-    tag_map = {tag["id"]: {**tag, "children": []} for tag in tags}
-    root_children = []
+"""
+Bulk tagging: apply or remove a set of tags on a set of tracks in one request and one transaction.
+Applying a tag a track already has does nothing, so the counts are the rows that actually changed.
+background=true runs it as a background job and answers 202 with a job id (see GET /jobs/{id}).
+"""
 
-    for tag in tags:
-        parent_id = tag["parent"]
-        if parent_id is None:
-            root_children.append(tag_map[tag["id"]])
-        else:
-            if parent_id in tag_map:
-                tag_map[parent_id]["children"].append(tag_map[tag["id"]])
-            else:
-                root_children.append(tag_map[tag["id"]])
 
-    root_tag = {
-        "id": 0,
-        "name": "Root",
-        "type": "group",
-        "parent": None,
-        "locked": False,
-        "user_id": user_id,
-        "children": root_children,
-    }
+def run_bulk_apply(conn, user_id, body: TrackTagBulk) -> dict:
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        applied = apply_tags(cursor, user_id, body.track_ids, body.tag_ids)
+        catalogs.refresh(cursor, user_id, track_ids=body.track_ids)
+        conn.commit()
+    except UnknownTagsError as e:
+        conn.rollback()
+        raise HTTPException(
+            status_code=404, detail={"error": "Tags not found", "tag_ids": e.tag_ids}
+        )
+    library_stats.invalidate(user_id)
+
+    return {"applied": applied, "total": sum(applied.values())}
+
+
+@router.post("/bulk-apply")
+async def bulk_apply_tags(
+    body: TrackTagBulk,
+    background: bool = Query(False),
+    user_id: str = Depends(get_current_user),
+):
+    if background:
+        job = submit_db_job(
+            "bulk-apply",
+            user_id,
+            lambda conn, job: run_bulk_apply(conn, user_id, body),
+        )
+        return accepted(job)
 
-    return root_tag
+    return await db.write(run_bulk_apply, user_id, body)
 
 
-@router.delete("/{tag_id}")
-def delete_tag(tag_id: int, user_id: str = Depends(get_current_user)):
-    conn = get_connection()
+def run_bulk_remove(conn, user_id, body: TrackTagBulk) -> dict:
     cursor = conn.cursor()
-
     try:
-        # 1) Make sure the tag exists for this user and collect root+descendants
-        cte_collect = """
-        WITH RECURSIVE descendants(id, locked) AS (
-            SELECT id, locked FROM tag WHERE id = ? AND user_id = ?
-            UNION ALL
-            SELECT t.id, t.locked
-            FROM tag t
-            JOIN descendants d ON t.parent = d.id
-            WHERE t.user_id = ?
+        cursor.execute("BEGIN")
+        removed = remove_tags(cursor, user_id, body.track_ids, body.tag_ids)
+        catalogs.refresh(cursor, user_id, track_ids=body.track_ids)
+        conn.commit()
+    except UnknownTagsError as e:
+        conn.rollback()
+        raise HTTPException(
+            status_code=404, detail={"error": "Tags not found", "tag_ids": e.tag_ids}
         )
-        SELECT id FROM descendants;
-        """
-        cursor.execute(cte_collect, (tag_id, user_id, user_id))
-        rows = cursor.fetchall()
-        if not rows:
-            conn.close()
-            raise HTTPException(status_code=404, detail="Tag not found")
-
-        ids_to_delete = [r[0] for r in rows]
-
-        # 2) Check whether any of the (root + descendants) are locked
-        cte_check_locked = """
-        WITH RECURSIVE descendants(id, locked) AS (
-            SELECT id, locked FROM tag WHERE id = ? AND user_id = ?
-            UNION ALL
-            SELECT t.id, t.locked
-            FROM tag t
-            JOIN descendants d ON t.parent = d.id
-            WHERE t.user_id = ?
+    library_stats.invalidate(user_id)
+
+    return {"removed": removed, "total": sum(removed.values())}
+
+
+@router.post("/bulk-remove")
+async def bulk_remove_tags(
+    body: TrackTagBulk,
+    background: bool = Query(False),
+    user_id: str = Depends(get_current_user),
+):
+    if background:
+        job = submit_db_job(
+            "bulk-remove",
+            user_id,
+            lambda conn, job: run_bulk_remove(conn, user_id, body),
         )
-        SELECT id FROM descendants WHERE locked = 1;
-        """
-        cursor.execute(cte_check_locked, (tag_id, user_id, user_id))
-        locked = cursor.fetchall()
-        if locked:
-            locked_ids = [r[0] for r in locked]
-            conn.close()
+        return accepted(job)
+
+    return await db.write(run_bulk_remove, user_id, body)
+
+
+"""
+Moving and copying tags, many at once, see services/tag_batch.py.
+Catalogs filter on whole subtrees, so they're refreshed after the tree changes.
+"""
+
+
+@router.post("/move")
+async def move_tags(
+    body: TagMoveBulk,
+    user_id: str = Depends(get_current_user),
+):
+    def move(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            moved = tag_batch.move_tags(cursor, user_id, body.moves)
+            if moved:
+                catalogs.refresh(cursor, user_id)
+            conn.commit()
+        except tag_batch.TagBatchError as e:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+        except UnknownTagsError as e:
+            conn.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail={"error": "Tags not found", "tag_ids": e.tag_ids},
+            )
+        except tag_batch.LockedTagsError as e:
+            conn.rollback()
             raise HTTPException(
                 status_code=403,
                 detail={
-                    "error": "One or more tags are locked and cannot be deleted",
-                    "locked_ids": locked_ids,
+                    "error": "Locked tags, or tags above a locked tag, cannot be moved",
+                    "locked_ids": e.tag_ids,
                 },
             )
+        if moved:
+            hierarchy_cache.invalidate(user_id)
+            library_stats.invalidate(user_id)
+        return {"moved": len(moved), "moved_ids": moved}
+
+    return await db.write(move)
+
+
+@router.post("/copy")
+async def copy_tags(
+    body: TagCopyBulk,
+    user_id: str = Depends(get_current_user),
+):
+    def copy(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            result = tag_batch.copy_tags(cursor, user_id, body.copies, body.tracks)
+            if result["created"]:
+                catalogs.refresh(cursor, user_id)
+            conn.commit()
+        except tag_batch.TagBatchError as e:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+        except UnknownTagsError as e:
+            conn.rollback()
+            raise HTTPException(
+                status_code=404,
+                detail={"error": "Tags not found", "tag_ids": e.tag_ids},
+            )
+        hierarchy_cache.invalidate(user_id)
+        library_stats.invalidate(user_id)
+        return result
 
-        # 3) Delete all collected IDs in a transaction
-        cursor.execute("BEGIN")
-        cte_delete = """
-        WITH RECURSIVE descendants(id) AS (
-            SELECT id FROM tag WHERE id = ? AND user_id = ?
-            UNION ALL
-            SELECT t.id
-            FROM tag t
-            JOIN descendants d ON t.parent = d.id
-            WHERE t.user_id = ?
-        )
-        DELETE FROM tag WHERE id IN (SELECT id FROM descendants);
-        """
-        cursor.execute(cte_delete, (tag_id, user_id, user_id))
-        conn.commit()
+    return await db.write(copy)
 
-        return {
-            "message": "Tags deleted",
-            "deleted_count": len(ids_to_delete),
-            "deleted_ids": ids_to_delete,
-        }
 
-    except HTTPException:
-        # re-raise known HTTP errors
-        raise
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+@router.delete("/{tag_id}")
+async def delete_tag(
+    tag_id: int,
+    user_id: str = Depends(get_current_user),
+):
+    def delete(conn):
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("BEGIN")
+
+            # 1) Make sure the tag exists for this user and collect root+descendants,
+            #    with their locked flags, in one lookup on the closure table
+            rows = tag_tree.subtree(cursor, user_id, tag_id)
+            if not rows:
+                raise HTTPException(status_code=404, detail="Tag not found")
+
+            ids_to_delete = [r[0] for r in rows]
+
+            # 2) Check whether any of the (root + descendants) are locked
+            locked_ids = [r[0] for r in rows if r[1]]
+            if locked_ids:
+                raise HTTPException(
+                    status_code=403,
+                    detail={
+                        "error": "One or more tags are locked and cannot be deleted",
+                        "locked_ids": locked_ids,
+                    },
+                )
+
+            # 3) Catalogs can't lose a track filter to a delete
+            try:
+                catalogs.delete_tag_filters(cursor, ids_to_delete)
+            except catalogs.FilterTagsError as e:
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        "error": "One or more tags are used by catalog filters",
+                        "catalog_ids": e.catalog_ids,
+                    },
+                )
+
+            # 4) Delete all collected IDs in the same transaction
+            # the tags' track associations go first, they reference the tags
+            delete_rows = [(deleted_id,) for deleted_id in ids_to_delete]
+            cursor.executemany("DELETE FROM track_tag WHERE tag_id = ?", delete_rows)
+            # tag_closure rows go with the tags (ON DELETE CASCADE)
+            cursor.executemany("DELETE FROM tag WHERE id = ?", delete_rows)
+            # catalogs filtering on an ancestor of these tags now match fewer tracks
+            catalogs.refresh(cursor, user_id)
+            conn.commit()
+            hierarchy_cache.invalidate(user_id)
+            library_stats.invalidate(user_id)
+
+            return {
+                "message": "Tags deleted",
+                "deleted_count": len(ids_to_delete),
+                "deleted_ids": ids_to_delete,
+            }
+
+        except HTTPException:
+            # re-raise known HTTP errors
+            conn.rollback()
+            raise
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await db.write(delete)
@@ -1,6 +1,55 @@
-from fastapi import APIRouter, Header, Body, HTTPException, Query, Depends
-from backend.app.models.web.track import TrackIn, TrackOut
-from backend.database import get_connection
+import asyncio
+import base64
+import json
+
+from fastapi import (
+    APIRouter,
+    Header,
+    Body,
+    HTTPException,
+    Query,
+    Depends,
+    Request,
+    Response,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from backend.app.models.web.track import (
+    SpotifySync,
+    TrackIn,
+    TrackOut,
+)
+from backend.app.services import library_stats, track_index, track_search
+from backend.app.services.fast_json import FastJSONResponse, json_list_response
+from backend.app.services.jobs import accepted, queue, submit_db_job
+from backend.app.services.spotify_library import SpotifyError, saved_track_pages
+from backend.app.services.user_cache import etag_matches
+from backend.app.services.tag_expression import ExpressionError, compile_expression
+from backend.app.services.track_rows import (
+    TRACK_FIELDS,
+    TRACK_OUT_FIELDS,
+    TRACK_SELECT,
+    albums_for,
+    rows_to_json,
+    tracks_by_id,
+    tracks_json,
+)
+from backend.app.services.track_sync import (
+    delete_unseen,
+    prune_to_keys,
+    record_sync,
+    sync_state,
+    empty_counts,
+    end_seen_keys,
+    library_matches,
+    mark_seen,
+    start_seen_keys,
+    sync_library,
+    tracks_changed,
+    upsert_tracks,
+)
+from backend.async_database import db
 from typing import Optional
 from backend.auth import get_current_user
 
@@ -8,68 +57,50 @@ router = APIRouter()
 
 
 @router.post("/")
-def create_track(track: TrackIn, user_id: str = Depends(get_current_user)):
-    conn = get_connection()
-    cursor = conn.cursor()
+async def create_track(
+    track: TrackIn,
+    user_id: str = Depends(get_current_user),
+):
+    def insert(conn):
+        cursor = conn.cursor()
 
-    cursor.execute(
-        """
-        INSERT INTO track (
-            user_id, added_at, name, artists, album, album_id,
-            duration_ms, explicit, popularity, track_number,
-            release_date, image, spotify_id
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            track.user_id,
-            track.added_at,
-            track.name,
-            track.artists,
-            track.album,
-            track.album_id,
-            track.duration_ms,
-            track.explicit,
-            track.popularity,
-            track.track_number,
-            track.release_date,
-            track.image,
-            track.spotify_id,
-        ),
-    )
+        # the same write as a sync, which also fills in the album and artist tables
+        counts = empty_counts()
+        upsert_tracks(cursor, track.user_id, [track], counts)
 
-    conn.commit()
-    conn.close()
-
-    return TrackOut(
-        user_id=track.user_id,
-        added_at=track.added_at,
-        name=track.name,
-        artists=track.artists,
-        album=track.album,
-        album_id=track.album_id,
-        duration_ms=track.duration_ms,
-        explicit=track.explicit,
-        popularity=track.popularity,
-        track_number=track.track_number,
-        release_date=track.release_date,
-        image=track.image,
-        spotify_id=track.spotify_id,
-    )
+        conn.commit()
+        tracks_changed(user_id, counts["albums_updated"] > 0)
 
+        return TrackOut(
+            user_id=track.user_id,
+            added_at=track.added_at,
+            name=track.name,
+            artists=track.artists,
+            album=track.album,
+            album_id=track.album_id,
+            duration_ms=track.duration_ms,
+            explicit=track.explicit,
+            popularity=track.popularity,
+            track_number=track.track_number,
+            release_date=track.release_date,
+            image=track.image,
+            spotify_id=track.spotify_id,
+        )
 
-@router.get("/")
-def get_track(track: TrackIn, user_id: str = Depends(get_current_user)):
-    conn = get_connection()
-    cursor = conn.cursor()
+    return await db.write(insert)
 
-    cursor.execute(
-        "SELECT id, name FROM track WHERE user_id = ? AND added_at = ?",
-        (track.user_id, track.added_at),
-    )
-    track_data = cursor.fetchone()
 
-    conn.commit()
-    conn.close()
+@router.get("/")
+async def get_track(
+    track: TrackIn,
+    user_id: str = Depends(get_current_user),
+):
+    track_data = await db.read(
+        lambda conn: conn.execute(
+            "SELECT id, name FROM track WHERE user_id = ? AND added_at = ?",
+            (track.user_id, track.added_at),
+        ).fetchone()
+    )
 
     return (
         TrackOut(
@@ -96,154 +127,670 @@ def get_track(track: TrackIn, user_id: str = Depends(get_current_user)):
 This function has a couple of parameters to function as a pagination and sorting mechanism.
 sort_by and order use regex to limit the options available to the user.
 Query and Optional are used to make the parameters optional, giving a default or specific options.
+
+There are two ways to page through the tracks:
+- start/end (the original way) returns a plain list. The slicing is done by SQLite with
+  LIMIT/OFFSET, so only the requested rows are read into Python.
+- limit/cursor returns {"tracks": [...], "next_cursor": "..."}. The cursor remembers the
+  sort value and id of the last row sent, so the next page starts with an index seek
+  (WHERE (sort_col, id) > (?, ?)) instead of skipping over every earlier row.
+  Page 100 costs the same as page 1. Pass next_cursor back until it comes back as null.
 """
 
+# index of the sort column in a TRACK_SELECT row, used to build the next cursor
+SORT_COLUMN_INDEX = {"added_at": 10, "name": 2}
+
+
+def parse_fields(fields: str | None) -> tuple[str, ...]:
+    names = tuple(dict.fromkeys(name.strip() for name in (fields or "").split(",")))
+    names = tuple(name for name in names if name)
+    if not names:
+        return TRACK_OUT_FIELDS
+    unknown = [name for name in names if name not in TRACK_OUT_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    return names
+
+
+def encode_cursor(sort_by: str, order: str, value, track_id: int) -> str:
+    raw = json.dumps([sort_by, order, value, track_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str, str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_by, order, value, track_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # a cursor comes from the client, anything else in it would reach the query as is
+    if (
+        not isinstance(sort_by, str)
+        or sort_by not in SORT_COLUMN_INDEX
+        or order not in ("asc", "desc")
+        or not (value is None or isinstance(value, (str, int, float)))
+        or type(track_id) is not int
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_by, order, value, track_id
+
+
+def fetch_track_page(
+    cursor,
+    user_id,
+    sort_by: str,
+    order: str,
+    limit: int,
+    after: str | None,
+    where: tuple[str, list] | None = None,
+    fields=TRACK_OUT_FIELDS,
+) -> dict:
+    """
+    Keyset (seek) pagination: ORDER BY sort_col, id and continue after the last row seen.
+    id breaks ties between tracks with the same name, so no row is skipped or repeated.
+    where is an optional extra (condition, params) on the track table.
+    """
+    if after is not None:
+        sort_by, order, last_value, last_id = decode_cursor(after)
+
+    comparison = "<" if order == "desc" else ">"
+    query = TRACK_SELECT + " WHERE user_id = ?"
+    params: list = [user_id]
+    if where is not None:
+        query += f" AND {where[0]}"
+        params += where[1]
+    if after is not None:
+        query += f" AND ({sort_by}, id) {comparison} (?, ?)"
+        params += [last_value, last_id]
+    query += f" ORDER BY {sort_by} {order.upper()}, id {order.upper()} LIMIT ?"
+    # one extra row tells us whether there is another page without a COUNT(*)
+    params.append(limit + 1)
+
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            sort_by, order, last[SORT_COLUMN_INDEX[sort_by]], last[0]
+        )
+
+    return {"tracks": tracks_json(cursor, rows, fields), "next_cursor": next_cursor}
+
 
 @router.get("/tracks")
-def get_tracks(
+async def get_tracks(
     start: Optional[int] = Query(None, ge=0),
     end: Optional[int] = Query(None, ge=0),
     sort_by: Optional[str] = Query(None, regex="^(added_at|name)$"),
     order: Optional[str] = Query("desc", regex="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
     user_id: str = Depends(get_current_user),
 ):
-    conn = get_connection()
-    cursor = conn.cursor()
+    names = parse_fields(fields)
 
-    # Base query
-    query = """
-        SELECT id, user_id, name, artists, album, album_id, duration_ms,
-               explicit, popularity, track_number, release_date, added_at,
-                image, spotify_id  FROM track WHERE user_id = ?
-    """
-    params = [user_id]
+    def read(conn):
+        db_cursor = conn.cursor()
 
-    # Add sorting
-    if sort_by:
-        query += f" ORDER BY {sort_by} {order.upper()}"  # type: ignore
+        # Cursor mode, used when the client asks for limit or passes a cursor back
+        if limit is not None or cursor is not None:
+            return fetch_track_page(
+                db_cursor,
+                user_id,
+                sort_by or "added_at",
+                order or "desc",
+                limit or 50,
+                cursor,
+                fields=names,
+            )
 
-    cursor.execute(query, params)
-    all_data = cursor.fetchall()
+        # Base query
+        query = TRACK_SELECT + " WHERE user_id = ?"
+        params: list = [user_id]
 
-    # Bounds checking
-    total_len = len(all_data)
-    if start is None:
-        start = 0
-    if end is None or end > total_len:
-        end = total_len
+        # Add sorting
+        if sort_by:
+            query += f" ORDER BY {sort_by} {order.upper()}, id {order.upper()}"  # type: ignore
 
-    sliced_data = all_data[start:end]
+        # Bounds checking, done by SQLite so only the requested slice is read
+        offset = start or 0
+        if end is not None and end <= offset:
+            return [], {}
+        query += " LIMIT ? OFFSET ?"
+        params += [-1 if end is None else end - offset, offset]
 
-    conn.close()
+        db_cursor.execute(query, params)
+        sliced_data = db_cursor.fetchall()
 
-    return [
-        TrackOut(
-            user_id=row[1],
-            name=row[2],
-            artists=row[3],
-            album=row[4],
-            album_id=row[5],
-            duration_ms=row[6],
-            explicit=row[7],
-            popularity=row[8],
-            track_number=row[9],
-            release_date=row[10],
-            added_at=row[11],
-            image=row[12],
-            spotify_id=row[13],
+        return sliced_data, albums_for(db_cursor, sliced_data, names)
+
+    result = await db.read(read)
+    if isinstance(result, dict):
+        return FastJSONResponse(result)
+
+    # the whole library can be asked for at once, so the list is encoded while it's sent
+    rows, albums = result
+    return json_list_response(rows, lambda chunk: rows_to_json(chunk, albums, names))
+
+
+"""
+Library statistics (see services/library_stats.py), cached per user until the next track or tag
+write. Like /tag/tags_hierarchy, the response has an ETag, so polling with If-None-Match
+costs a 304 and no database work until something changed.
+"""
+
+
+@router.get("/stats")
+async def get_stats(
+    if_none_match: str | None = Header(None),
+    user_id: str = Depends(get_current_user),
+):
+    cached = library_stats.stats_cache.get(user_id)
+    if cached is None:
+        token = library_stats.stats_cache.start_build(user_id)
+        stats = await db.read(
+            lambda conn: library_stats.compute_stats(conn.cursor(), user_id)
+        )
+        body = json.dumps(stats, separators=(",", ":")).encode()
+        cached = (library_stats.stats_cache.put(user_id, body, token), body)
+
+    version, body = cached
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/tracks/count")
+async def get_track_count(user_id: str = Depends(get_current_user)):
+    cached = library_stats.stats_cache.get(user_id)
+    if cached is not None:
+        return {"total_count": json.loads(cached[1])["total_count"]}
+
+    def count(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM track WHERE user_id = ?", (user_id,))
+        return cursor.fetchone()[0]
+
+    return {"total_count": await db.read(count)}
+
+
+"""
+Search by name, artists and album, best matches first (see services/track_search.py).
+Every word typed matches as a prefix, so results show up while the user is still typing.
+Pages are requested with offset, and next_offset is null on the last one.
+"""
+
+
+@router.get("/search")
+async def search_tracks(
+    q: str = Query(..., max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    fields: Optional[str] = Query(None),
+    user_id: str = Depends(get_current_user),
+):
+    select = ", ".join(f"t.{field}" for field in TRACK_FIELDS)
+    names = parse_fields(fields)
+
+    def read(conn):
+        cursor = conn.cursor()
+        rows = track_search.search(cursor, user_id, q, select, limit, offset)
+        return {
+            "tracks": tracks_json(cursor, rows[:limit], names),
+            "next_offset": offset + limit if len(rows) > limit else None,
+        }
+
+    return FastJSONResponse(await db.read(read))
+
+
+"""
+Browsing the library by popularity, duration or release year, with range filters and facet counts
+(how many of the matching tracks each artist, album, year... has), for filter sidebars.
+Sorting, filtering and counting run on the in-memory track index (see services/track_index.py),
+only the page of tracks returned is read from the database.
+"""
+
+
+@router.get("/index")
+async def browse_tracks(
+    sort_by: str = Query(
+        "added_at", pattern="^(added_at|popularity|duration_ms|year)$"
+    ),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    min_duration_ms: Optional[int] = Query(None, ge=0),
+    max_duration_ms: Optional[int] = Query(None, ge=0),
+    min_popularity: Optional[int] = Query(None, ge=0, le=100),
+    max_popularity: Optional[int] = Query(None, ge=0, le=100),
+    min_year: Optional[int] = Query(None),
+    max_year: Optional[int] = Query(None),
+    explicit: Optional[bool] = Query(None),
+    artist: Optional[str] = Query(None),
+    album_id: Optional[str] = Query(None),
+    facets: str = Query("", pattern="^((artist|album|year|explicit)(,|$))*$"),
+    facet_limit: int = Query(20, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=1000),
+    fields: Optional[str] = Query(None),
+    user_id: str = Depends(get_current_user),
+):
+    names = parse_fields(fields)
+
+    def read(conn):
+        cursor = conn.cursor()
+        index = track_index.get_index(cursor, user_id)
+        positions = index.select(
+            {
+                "duration_ms": (min_duration_ms, max_duration_ms),
+                "popularity": (min_popularity, max_popularity),
+                "year": (min_year, max_year),
+            },
+            explicit=explicit,
+            artist=artist,
+            album_id=album_id,
+        )
+        facet_names = [name for name in facets.split(",") if name]
+        counts = index.facets(positions, facet_names, facet_limit)
+        positions = index.sort(positions, sort_by, order == "desc")
+        page = positions[offset : offset + limit]
+        return {
+            "total": len(positions),
+            "tracks": tracks_by_id(cursor, [index.ids[i] for i in page], names),
+            "facets": counts,
+        }
+
+    return FastJSONResponse(await db.read(read))
+
+
+@router.get("/index/stats")
+async def get_index_stats(user_id: str = Depends(get_current_user)):
+    return await db.read(lambda conn: track_index.stats(conn.cursor(), user_id))
+
+
+"""
+Filters tracks by a tag expression like (rock OR jazz) AND NOT live, where every tag also matches
+its descendants. See services/tag_expression.py for the syntax.
+The expression becomes one SQL condition, and results are paged with the same cursors as /tracks.
+"""
+
+
+@router.get("/filter")
+async def filter_tracks(
+    expr: str = Query(..., min_length=1, max_length=2000),
+    sort_by: Optional[str] = Query("added_at", pattern="^(added_at|name)$"),
+    order: Optional[str] = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    user_id: str = Depends(get_current_user),
+):
+    names = parse_fields(fields)
+
+    def read(conn):
+        db_cursor = conn.cursor()
+        try:
+            where = compile_expression(db_cursor, user_id, expr)
+        except ExpressionError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        return fetch_track_page(
+            db_cursor,
+            user_id,
+            sort_by or "added_at",
+            order or "desc",
+            limit,
+            cursor,
+            where,
+            names,
         )
-        for row in sliced_data
-    ]
+
+    return FastJSONResponse(await db.read(read))
 
 
 """
 Body is a list of TrackIn objects, and it's passed in the request body.
 You use body when you want to send more complex data structures in the request.
+
+mode=full (the default): the list is the user's whole library. Only the difference with what's
+stored is written (see services/track_sync.py), so a sync where a few tracks changed only writes
+a few rows, and tracks keep their ids between syncs.
+
+mode=delta: the list only has the tracks saved since the last sync (newer than the watermark from
+GET /sync-state). They're upserted and nothing is deleted. Pass total (the library size Spotify
+reports) and the response says whether removals need checking (reconcile_needed), with
+POST /sync-tracks/removals or a full sync. That check compares against the last full sync, so pass
+total on full syncs too (see library_matches in services/track_sync.py).
+A full sync is also due every week (full_sync_due).
+
+The response counts what changed. With background=true the sync runs as a background job instead
+(see services/jobs.py): the answer is 202 with a job id, and GET /jobs/{id} has the counts once it's
+done. A user's syncs never run at the same time, a sync sent while one is running waits for it.
+"""
+
+
+@router.get("/sync-state")
+async def get_sync_state(user_id: str = Depends(get_current_user)):
+    return await db.read(lambda conn: sync_state(conn.cursor(), user_id))
+
+
+def run_sync(conn, user_id, tracks: list[TrackIn], mode: str, total, job=None) -> dict:
+    cursor = conn.cursor()
+
+    try:
+        # IMMEDIATE: a full sync reads the stored library to decide what to delete,
+        # nothing may be written between that read and the deletes
+        cursor.execute("BEGIN IMMEDIATE")
+        if job:
+            job.update(stage="writing", tracks=len(tracks))
+        if mode == "full":
+            counts = sync_library(cursor, user_id, tracks)
+        else:
+            counts = empty_counts()
+            upsert_tracks(cursor, user_id, tracks, counts)
+        record_sync(cursor, user_id, full=mode == "full", total=total)
+    except Exception as e:
+        conn.rollback()  # this will undo any changes made to the database
+        raise HTTPException(status_code=500, detail=str(e))
+
+    conn.commit()
+    tracks_changed(user_id, counts["albums_updated"] > 0)
+
+    if mode == "delta":
+        state = sync_state(cursor, user_id)
+        counts["reconcile_needed"] = total is not None and not library_matches(
+            state, total
+        )
+        counts["full_sync_due"] = state["full_sync_due"]
+
+    return counts
+
+
 """
+The body of /sync-tracks can be the whole library, so it isn't declared as a list[TrackIn]
+parameter: FastAPI would parse it with the json module and then validate the parsed lists and dicts,
+on the event loop. tracks_body validates the raw bytes in one call instead (Pydantic parses them
+itself, roughly twice as fast), on a worker thread, and answers invalid bodies with the same 422.
+"""
+
+track_list = TypeAdapter(list[TrackIn])
+
+
+async def tracks_body(request: Request) -> list[TrackIn]:
+    body = await request.body()
+    try:
+        return await run_in_threadpool(track_list.validate_json, body)
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+        for error in errors:
+            error["loc"] = ("body", *error["loc"])
+        raise RequestValidationError(errors)
+
+
+TRACK_LIST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "array",
+                    "items": {"$ref": "#/components/schemas/TrackIn"},
+                }
+            }
+        },
+    }
+}
 
 
-@router.post("/sync-tracks")
+@router.post("/sync-tracks", openapi_extra=TRACK_LIST_BODY)
 async def sync_tracks(
-    tracks: list[TrackIn] = Body(...), user_id: str = Depends(get_current_user)
+    tracks: list[TrackIn] = Depends(tracks_body),
+    mode: str = Query("full", pattern="^(full|delta)$"),
+    total: Optional[int] = Query(None, ge=0),
+    background: bool = Query(False),
+    user_id: str = Depends(get_current_user),
 ):
-    conn = get_connection()
+    if background:
+        job = submit_db_job(
+            "sync-tracks",
+            user_id,
+            lambda conn, job: run_sync(conn, user_id, tracks, mode, total, job),
+            coalesce_key=("sync-tracks", str(user_id)),
+        )
+        return accepted(job)
+
+    return await db.write(run_sync, user_id, tracks, mode, total)
+
+
+"""
+The cheaper removal check for delta syncs: the body is the added_at of every track still in the
+library (strings only, not whole tracks), and stored tracks that aren't in it are deleted.
+"""
+
+
+def run_removals(conn, user_id, added_at: list[str]) -> dict:
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    deleted = prune_to_keys(cursor, user_id, added_at)
+    conn.commit()
+    tracks_changed(user_id)
+    return {"deleted": deleted}
+
+
+@router.post("/sync-tracks/removals")
+async def sync_removals(
+    added_at: list[str] = Body(...),
+    user_id: str = Depends(get_current_user),
+):
+    return await db.write(run_removals, user_id, added_at)
+
+
+"""
+The writes of a streaming sync, each one queued for the writer on its own (see async_database.py).
+Other requests' writes can run between two chunks, while the next chunk is still arriving.
+sync_id is set when stored tracks missing from the stream are deleted at the end.
+"""
+
+
+def start_stream(conn) -> int:
+    return start_seen_keys(conn.cursor())
+
+
+def write_chunk(conn, user_id, chunk: list[TrackIn], counts: dict, sync_id=None):
     cursor = conn.cursor()
+    albums_updated = counts["albums_updated"]
+    upsert_tracks(cursor, user_id, chunk, counts)
+    if sync_id is not None:
+        mark_seen(cursor, sync_id, [track.added_at for track in chunk])
+    conn.commit()
+    tracks_changed(user_id, counts["albums_updated"] > albums_updated)
+    counts["received"] += len(chunk)
+
+
+def finish_stream(conn, user_id, counts: dict, sync_id=None, total=None) -> None:
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    if sync_id is not None:
+        counts["deleted"] = delete_unseen(cursor, user_id, sync_id)
+    record_sync(cursor, user_id, full=sync_id is not None, total=total)
+    conn.commit()
+    tracks_changed(user_id)
+
+
+def end_stream(conn, sync_id: int) -> None:
+    end_seen_keys(conn.cursor(), sync_id)
+    conn.commit()
+
+
+"""
+Streaming version of sync-tracks for very large libraries.
+The body is newline-delimited JSON (one TrackIn object per line) and is read from the request
+as it arrives. Tracks are validated and written STREAM_CHUNK_SIZE at a time, each chunk in its
+own transaction, so the whole library is never held in memory at once.
+
+With prune=true (the default) the stream is the whole library, and stored tracks that weren't in
+it are deleted at the end. If a line fails to validate, the chunks before it stay written and
+nothing is pruned; sending the stream again picks up where it left off.
+"""
+
+STREAM_CHUNK_SIZE = 500
+MAX_LINE_BYTES = 1 << 20
+
+
+@router.post("/sync-tracks/stream")
+async def sync_tracks_stream(
+    request: Request,
+    prune: bool = Query(True),
+    user_id: str = Depends(get_current_user),
+):
+    counts = empty_counts()
+    counts["received"] = 0
+    sync_id = await db.write(start_stream) if prune else None
 
     try:
-        # first, remove all current tracks for the user
-        # tracks that will have been deleted from the user's library must be removed here
-        cursor.execute("DELETE FROM track WHERE user_id = ?", (user_id,))
-        for track in tracks:
-            cursor.execute(
-                """
-                INSERT INTO track (
-                    user_id, added_at, name, artists, album, album_id,
-                    duration_ms, explicit, popularity, track_number,
-                    release_date, image, spotify_id
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(user_id, added_at) DO UPDATE SET
-                    name = excluded.name,
-                    artists = excluded.artists,
-                    album = excluded.album,
-                    album_id = excluded.album_id,
-                    duration_ms = excluded.duration_ms,
-                    explicit = excluded.explicit,
-                    popularity = excluded.popularity,
-                    track_number = excluded.track_number,
-                    release_date = excluded.release_date,
-                    image = excluded.image,
-                    spotify_id = excluded.spotify_id
-                """,
-                (
-                    track.user_id,
-                    track.added_at,
-                    track.name,
-                    track.artists,
-                    track.album,
-                    track.album_id,
-                    track.duration_ms,
-                    track.explicit,
-                    track.popularity,
-                    track.track_number,
-                    track.release_date,
-                    track.image,
-                    track.spotify_id,
-                ),
-            )
+        chunk: list[TrackIn] = []
+        buffer = b""
+        line_number = 0
+        async for data in request.stream():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            if len(buffer) > MAX_LINE_BYTES:
+                raise HTTPException(
+                    status_code=413, detail=f"Line {line_number + 1} is too long"
+                )
+            for line in lines:
+                line_number += 1
+                if not line.strip():
+                    continue
+                try:
+                    chunk.append(TrackIn.model_validate_json(line))
+                except ValidationError as e:
+                    raise HTTPException(
+                        status_code=422,
+                        detail={"line": line_number, "errors": e.errors()},
+                    )
+                if len(chunk) >= STREAM_CHUNK_SIZE:
+                    await db.write(write_chunk, user_id, chunk, counts, sync_id)
+                    chunk = []
+
+        if buffer.strip():
+            line_number += 1
+            try:
+                chunk.append(TrackIn.model_validate_json(buffer))
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=422, detail={"line": line_number, "errors": e.errors()}
+                )
+        if chunk:
+            await db.write(write_chunk, user_id, chunk, counts, sync_id)
 
-        cursor.execute(
-            """
-            SELECT id, user_id, name, artists, album, album_id, duration_ms,
-                explicit, popularity, track_number, release_date, added_at,
-                image, spotify_id  FROM track WHERE user_id = ?
-        """,
-            (user_id,),
+        await db.write(finish_stream, user_id, counts, sync_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if sync_id is not None:
+            await db.write(end_stream, sync_id)
+
+    return counts
+
+
+"""
+Syncs straight from Spotify: the server fetches the saved tracks itself (several pages at a time,
+see services/spotify_library.py) and writes each page as it arrives, so the browser only sends
+its Spotify access token.
+
+By default only tracks newer than the watermark are fetched. If the library size Spotify reports
+then doesn't add up with what's stored (tracks were removed, see library_matches in
+services/track_sync.py), or a full sync is due, it falls back to a full sync: the whole library is fetched and tracks removed on Spotify are deleted here too.
+full=true asks for a full sync directly. background=true works like it does for /sync-tracks.
+"""
+
+
+async def fetch_into_library(
+    user_id, access_token: str, full: bool, counts: dict, job=None
+) -> int:
+    """Fetches and writes one pass over the library. Returns the total Spotify reports."""
+    meta: dict = {}
+    if full:
+        stop_at = None
+        sync_id = await db.write(start_stream)
+    else:
+        state = await db.read(lambda conn: sync_state(conn.cursor(), user_id))
+        stop_at = state["watermark"]
+        sync_id = None
+    try:
+        async for page in saved_track_pages(access_token, user_id, stop_at, meta=meta):
+            counts["pages"] += 1
+            if page:
+                await db.write(write_chunk, user_id, page, counts, sync_id)
+            if job:
+                job.update(**counts, mode="full" if full else "delta")
+        await db.write(finish_stream, user_id, counts, sync_id, meta.get("total"))
+    finally:
+        if sync_id is not None:
+            await db.write(end_stream, sync_id)
+    return meta.get("total", 0)
+
+
+def spotify_counts() -> dict:
+    counts = empty_counts()
+    counts["received"] = 0
+    counts["pages"] = 0
+    return counts
+
+
+async def run_spotify_sync(user_id, access_token: str, full: bool, job=None) -> dict:
+    counts = spotify_counts()
+
+    def read_state(conn):
+        return sync_state(conn.cursor(), user_id)
+
+    state = await db.read(read_state)
+    full = full or state["full_sync_due"] or state["skipped_items"] is None
+    try:
+        total = await fetch_into_library(user_id, access_token, full, counts, job)
+        if not full and not library_matches(await db.read(read_state), total):
+            # something was removed on Spotify, which only a full pass can see.
+            # The answer is the full pass's counts, the delta's tracks are in it anyway
+            full = True
+            counts = spotify_counts()
+            await fetch_into_library(user_id, access_token, full, counts, job)
+    except SpotifyError as e:
+        raise HTTPException(
+            status_code=502,
+            detail={"error": e.message, "spotify_status": e.status_code},
         )
-        track_data = cursor.fetchall()
     except Exception as e:
-        conn.rollback()  # this will undo any changes made to the database
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
-    conn.commit()
-    conn.close()
+    counts["mode"] = "full" if full else "delta"
+    return counts
 
-    return [
-        TrackOut(
-            user_id=row[1],
-            name=row[2],
-            artists=row[3],
-            album=row[4],
-            album_id=row[5],
-            duration_ms=row[6],
-            explicit=row[7],
-            popularity=row[8],
-            track_number=row[9],
-            release_date=row[10],
-            added_at=row[11],
-            image=row[12],
-            spotify_id=row[13],
+
+@router.post("/sync-spotify")
+async def sync_spotify(
+    body: SpotifySync,
+    background: bool = Query(False),
+    user_id: str = Depends(get_current_user),
+):
+    if background:
+        # the job runs on a worker thread, with its own event loop for the HTTP requests
+        job = queue.submit(
+            "sync-spotify",
+            user_id,
+            lambda job: asyncio.run(
+                run_spotify_sync(user_id, body.access_token, body.full, job)
+            ),
+            coalesce_key=("sync-spotify", str(user_id)),
         )
-        for row in track_data
-        if row is not None
-    ]
+        return accepted(job)
+
+    return await run_spotify_sync(user_id, body.access_token, body.full)
@@ -1,21 +1,34 @@
+import tempfile
 from fastapi import APIRouter, HTTPException, Request, Header, Depends
+from fastapi.responses import StreamingResponse
 
 from backend.app.models.web.user import SpotifyLogin
-from backend.database import get_connection
-from backend.auth import create_access_token, get_current_user  # type: ignore
+from backend.app.services.tag_hierarchy import hierarchy_cache
+from backend.app.services.track_sync import tracks_changed
+from backend.app.services.library_backup import (
+    LibraryImport,
+    LibraryImportError,
+    RecordError,
+    export_library,
+)
+from backend.async_database import db
+from backend.auth import (
+    UserContext,
+    create_access_token,
+    get_current_user as current_user_id,
+    get_user_context,
+)
 
 router = APIRouter()
 
 
 @router.get("/users")
-def get_users():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id, spotify_id, date_created FROM user")
-    users = cursor.fetchall()
-
-    conn.close()
+async def get_users():
+    users = await db.read(
+        lambda conn: conn.execute(
+            "SELECT id, spotify_id, date_created FROM user"
+        ).fetchall()
+    )
 
     return [
         {"id": user[0], "spotify_id": user[1], "date_created": user[2]}
@@ -24,23 +37,10 @@ def get_users():
 
 
 @router.get("/current")
-def get_current_user(user_id: str = Depends(get_current_user)):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, spotify_id, date_created FROM user WHERE id = ?",
-        (user_id,),
-    )
-    user = cursor.fetchone()
-    conn.close()
-    if user:
-        return {
-            "user": {
-                "id": user[0],
-                "spotify_id": user[1],
-                "date_created": user[2],
-            }
-        }
+async def get_current_user(user: UserContext = Depends(get_user_context)):
+    row = await user.row()
+    if row:
+        return {"user": row}
     raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -50,23 +50,101 @@ Creates a new user if they don't exist, and returns a JWT for the app to authent
 
 
 @router.post("/spotify-login")
-def spotify_login(data: dict):
+async def spotify_login(data: dict):
     spotify_id = data.get("spotify_id")
 
-    conn = get_connection()
-    cursor = conn.cursor()
+    # on the writer, so two logins of a new user can't both insert it
+    def find_or_create(conn):
+        cursor = conn.cursor()
 
-    cursor.execute("SELECT id FROM user WHERE spotify_id = ?", (spotify_id,))
-    result = cursor.fetchone()
+        cursor.execute("SELECT id FROM user WHERE spotify_id = ?", (spotify_id,))
+        result = cursor.fetchone()
 
-    if result:
-        user_id = result[0]
-    else:
+        if result:
+            return result[0]
         cursor.execute("INSERT INTO user (spotify_id) VALUES (?)", (spotify_id,))
         conn.commit()
-        user_id = cursor.lastrowid
+        return cursor.lastrowid
+
+    user_id = await db.write(find_or_create)
 
-    conn.close()
     # Return JWT for your app
     token = create_access_token({"user_id": user_id})
     return {"app_access_token": token, "user_id": user_id}
+
+
+"""
+Backup and restore of the user's library (tracks, tags and their links) as one gzipped NDJSON
+file, see services/library_backup.py for the format. Both directions stream, so a big library
+never has to fit in memory. scripts/library.py does the same from the command line.
+
+The export is written to a temporary file first and sent from there. Reading the library takes
+a pooled connection (its read transaction is the snapshot), and that way it's given back as soon
+as the file is written, not after a slow client has downloaded it, or never if it disconnects.
+"""
+
+EXPORT_READ_SIZE = 1 << 16
+
+
+def write_export(conn, user_id):
+    file = tempfile.TemporaryFile()
+    try:
+        for data in export_library(conn, user_id):
+            file.write(data)
+    except BaseException:
+        file.close()
+        raise
+    return file
+
+
+@router.get("/export")
+async def export_user_library(user_id: str = Depends(current_user_id)):
+    file = await db.read(write_export, user_id)
+    size = file.tell()
+    file.seek(0)
+
+    def stream():
+        try:
+            while data := file.read(EXPORT_READ_SIZE):
+                yield data
+        finally:
+            file.close()
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition": 'attachment; filename="library.ndjson.gz"',
+            "Content-Length": str(size),
+        },
+    )
+
+
+@router.post("/import")
+async def import_user_library(
+    request: Request,
+    user_id: str = Depends(current_user_id),
+):
+    importer = LibraryImport(user_id)
+
+    async def write(batch):
+        albums_updated = importer.counts["albums_updated"]
+        await db.write(importer.write, batch)
+        if batch[0] == "tags":
+            hierarchy_cache.invalidate(user_id)
+        tracks_changed(user_id, importer.counts["albums_updated"] > albums_updated)
+
+    try:
+        async for data in request.stream():
+            for batch in importer.feed(data):
+                await write(batch)
+        for batch in importer.finish():
+            await write(batch)
+    except RecordError as e:
+        raise HTTPException(
+            status_code=422, detail={"line": e.line, "errors": e.errors}
+        )
+    except LibraryImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return importer.counts
@@ -0,0 +1,125 @@
+from backend.app.models.web.track import TrackIn
+
+"""
+The album and artist tables (see migration_8_album_artist_tables in database.py).
+A track stores album_ref, the id of its row in album, instead of the album's Spotify id, name and
+cover image, and track_artist lists its artists. Both are filled in by the sync path, a batch of
+tracks at a time: each distinct album or artist in the batch is written once, with executemany.
+"""
+
+# SQLite allows 32766 parameters per statement, stay well below it
+IN_BATCH_SIZE = 500
+
+
+def lookup_ids(cursor, table: str, key: str, values: list[str]) -> dict:
+    """Maps each value of the key column to the row id, in batches."""
+    ids = {}
+    for i in range(0, len(values), IN_BATCH_SIZE):
+        batch = values[i : i + IN_BATCH_SIZE]
+        cursor.execute(
+            f"SELECT {key}, id FROM {table} WHERE {key} IN ({', '.join('?' for _ in batch)})",
+            batch,
+        )
+        ids.update(cursor.fetchall())
+    return ids
+
+
+def stored_albums(cursor, album_ids: list[str]) -> dict:
+    """Maps each stored album's Spotify id to (album_ref, name, image), in batches."""
+    albums = {}
+    for i in range(0, len(album_ids), IN_BATCH_SIZE):
+        batch = album_ids[i : i + IN_BATCH_SIZE]
+        cursor.execute(
+            f"SELECT spotify_id, id, name, image FROM album WHERE spotify_id IN ({', '.join('?' for _ in batch)})",
+            batch,
+        )
+        for row in cursor.fetchall():
+            albums[row[0]] = row[1:]
+    return albums
+
+
+def upsert_albums(cursor, tracks: list[TrackIn]) -> tuple[dict, set]:
+    """
+    Writes the albums of the tracks, returns ({album_id: album_ref}, album_refs that changed).
+    An album row is the same Spotify data for every user with a track on it, so when a sync
+    brings a new name or cover image it's updated, for all of them.
+    Albums that are stored and unchanged aren't written at all.
+    """
+    albums = {
+        track.album_id: (track.album_id, track.album, track.image or "")
+        for track in tracks
+    }
+    stored = stored_albums(cursor, list(albums))
+    changed = {
+        ref
+        for album_id, (ref, name, image) in stored.items()
+        if (name, image) != albums[album_id][1:]
+    }
+    cursor.executemany(
+        """
+        INSERT INTO album (spotify_id, name, image) VALUES (?, ?, ?)
+        ON CONFLICT (spotify_id) DO UPDATE SET name = excluded.name, image = excluded.image
+        WHERE name IS NOT excluded.name OR image IS NOT excluded.image
+        """,
+        [
+            values
+            for album_id, values in albums.items()
+            if album_id not in stored or stored[album_id][0] in changed
+        ],
+    )
+    refs = {album_id: row[0] for album_id, row in stored.items()}
+    refs.update(
+        lookup_ids(
+            cursor, "album", "spotify_id", [a for a in albums if a not in stored]
+        )
+    )
+    return refs, changed
+
+
+def split_artists(artists: str) -> list[str]:
+    """The artist names in a track's artists text, which the frontend joins with ", "."""
+    return [name for name in artists.split(", ") if name]
+
+
+def set_track_artists(cursor, tracks: list[tuple[int, str]], replace: bool) -> None:
+    """
+    Writes the track_artist rows for (track_id, artists text) pairs.
+    replace=True first removes the rows the tracks had (for tracks whose artists changed).
+    """
+    if not tracks:
+        return
+    if replace:
+        cursor.executemany(
+            "DELETE FROM track_artist WHERE track_id = ?",
+            [(track_id,) for track_id, _ in tracks],
+        )
+    names = list(
+        dict.fromkeys(name for _, artists in tracks for name in split_artists(artists))
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO artist (name) VALUES (?)", [(name,) for name in names]
+    )
+    artist_ids = lookup_ids(cursor, "artist", "name", names)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO track_artist (track_id, position, artist_id) VALUES (?, ?, ?)",
+        [
+            (track_id, position, artist_ids[name])
+            for track_id, artists in tracks
+            for position, name in enumerate(split_artists(artists))
+        ],
+    )
+
+
+def album_details(cursor, album_refs) -> dict:
+    """{album_ref: (spotify_id, name, image)} for the given album rows."""
+    refs = [ref for ref in set(album_refs) if ref is not None]
+    details = {}
+    for i in range(0, len(refs), IN_BATCH_SIZE):
+        batch = refs[i : i + IN_BATCH_SIZE]
+        cursor.execute(
+            f"SELECT id, spotify_id, name, image FROM album WHERE id IN ({', '.join('?' for _ in batch)})",
+            batch,
+        )
+        for row in cursor.fetchall():
+            details[row[0]] = row[1:]
+    return details
@@ -0,0 +1,178 @@
+"""
+A catalog is an ordered queue of tracks to work through, for example "tag every rock track".
+Which tracks are in it is decided by its filters:
+
+- catalog_track_filter rows with rule "include": a track has to be in the subtree of at least
+  one of these tags (no include filters means every track is included)
+- catalog_track_filter rows with rule "exclude": a track in the subtree of any of these is left out
+- catalog_tag_filter rows are the tags the catalog is for (offered while working through it),
+  they don't change which tracks are in it
+
+A tag that a catalog_track_filter uses can't be deleted (see delete_tag_filters).
+
+The list itself is materialized into catalog_track_log, with a position (catalog_index) and a
+completed flag per track. Building it is one INSERT ... SELECT. After that it's kept up to date
+incrementally by refresh(): tracks that stopped matching are removed, new matches are appended
+at the end, and every other row (with its position and completed flag) is left alone.
+"""
+
+# true for the tracks (aliased t) that belong in catalog :catalog_id
+MEMBERSHIP = """
+    (
+        NOT EXISTS (
+            SELECT 1 FROM catalog_track_filter
+            WHERE catalog_id = :catalog_id AND rule = 'include'
+        )
+        OR t.id IN (
+            SELECT tt.track_id FROM catalog_track_filter f
+            JOIN tag_closure c ON c.ancestor = f.tag_id
+            JOIN track_tag tt ON tt.tag_id = c.descendant
+            WHERE f.catalog_id = :catalog_id AND f.rule = 'include'
+        )
+    )
+    AND t.id NOT IN (
+        SELECT tt.track_id FROM catalog_track_filter f
+        JOIN tag_closure c ON c.ancestor = f.tag_id
+        JOIN track_tag tt ON tt.tag_id = c.descendant
+        WHERE f.catalog_id = :catalog_id AND f.rule = 'exclude'
+    )
+"""
+
+ORDER = "ORDER BY t.added_at DESC, t.id DESC"
+
+
+def materialize(cursor, user_id, catalog_id: int) -> int:
+    """Rebuilds the catalog's list from scratch (progress is reset). Returns its length."""
+    cursor.execute("DELETE FROM catalog_track_log WHERE catalog_id = ?", (catalog_id,))
+    cursor.execute(
+        f"""
+        INSERT INTO catalog_track_log (catalog_id, track_id, catalog_index, completed)
+        SELECT :catalog_id, t.id, ROW_NUMBER() OVER ({ORDER}), FALSE
+        FROM track t
+        WHERE t.user_id = :user_id AND {MEMBERSHIP}
+        """,
+        {"catalog_id": catalog_id, "user_id": user_id},
+    )
+    return cursor.rowcount
+
+
+def refresh(
+    cursor,
+    user_id,
+    catalog_ids: list[int] | None = None,
+    track_ids: list[int] | None = None,
+    after_track_id: int | None = None,
+) -> dict:
+    """
+    Brings materialized catalogs up to date after tracks or tags changed.
+    - catalog_ids: only these catalogs (default: all of the user's catalogs)
+    - track_ids: only these tracks changed (like after bulk tagging)
+    - after_track_id: only tracks with a larger id are new (like after a sync)
+    Returns {catalog_id: {"added": n, "removed": n}}.
+    """
+    if catalog_ids is None:
+        cursor.execute("SELECT id FROM catalog WHERE user_id = ?", (user_id,))
+        catalog_ids = [row[0] for row in cursor.fetchall()]
+    if not catalog_ids:
+        return {}
+
+    limit_tracks = ""
+    params: dict = {"user_id": user_id}
+    if track_ids is not None:
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS refresh_track (id INTEGER PRIMARY KEY)"
+        )
+        cursor.execute("DELETE FROM refresh_track")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO refresh_track (id) VALUES (?)",
+            [(track_id,) for track_id in track_ids],
+        )
+        limit_tracks += " AND t.id IN (SELECT id FROM refresh_track)"
+    if after_track_id is not None:
+        limit_tracks += " AND t.id > :after_track_id"
+        params["after_track_id"] = after_track_id
+
+    changes = {}
+    for catalog_id in catalog_ids:
+        params["catalog_id"] = catalog_id
+        cursor.execute(
+            f"""
+            DELETE FROM catalog_track_log
+            WHERE catalog_id = :catalog_id AND track_id IN (
+                SELECT t.id FROM track t
+                WHERE t.user_id = :user_id {limit_tracks} AND NOT ({MEMBERSHIP})
+            )
+            """,
+            params,
+        )
+        removed = cursor.rowcount
+        cursor.execute(
+            f"""
+            INSERT INTO catalog_track_log (catalog_id, track_id, catalog_index, completed)
+            SELECT
+                :catalog_id,
+                t.id,
+                (
+                    SELECT COALESCE(MAX(catalog_index), 0) FROM catalog_track_log
+                    WHERE catalog_id = :catalog_id
+                ) + ROW_NUMBER() OVER ({ORDER}),
+                FALSE
+            FROM track t
+            WHERE t.user_id = :user_id {limit_tracks} AND {MEMBERSHIP}
+            AND t.id NOT IN (
+                SELECT track_id FROM catalog_track_log WHERE catalog_id = :catalog_id
+            )
+            """,
+            params,
+        )
+        changes[catalog_id] = {"added": cursor.rowcount, "removed": removed}
+
+    if track_ids is not None:
+        cursor.execute("DELETE FROM refresh_track")
+    return changes
+
+
+def next_track(cursor, catalog_id: int):
+    """
+    The first uncompleted track in the catalog, found with the
+    (catalog_id, completed, catalog_index) index without looking at the rest of the list.
+    """
+    cursor.execute(
+        """
+        SELECT track_id, catalog_index FROM catalog_track_log
+        WHERE catalog_id = ? AND completed = FALSE
+        ORDER BY catalog_index
+        LIMIT 1
+        """,
+        (catalog_id,),
+    )
+    return cursor.fetchone()
+
+
+class FilterTagsError(Exception):
+    def __init__(self, catalog_ids: list[int]):
+        super().__init__(f"Catalogs filtering on these tags: {catalog_ids}")
+        self.catalog_ids = catalog_ids
+
+
+def delete_tag_filters(cursor, tag_ids: list[int]) -> None:
+    """
+    Removes the catalog_tag_filter rows of tags that are being deleted. Raises FilterTagsError
+    when a catalog's track filters use one of the tags: dropping an include filter would turn
+    the catalog into the whole library, so the filter has to be changed first.
+    """
+    placeholders = ", ".join("?" for _ in tag_ids)
+    cursor.execute(
+        f"""
+        SELECT DISTINCT catalog_id FROM catalog_track_filter
+        WHERE tag_id IN ({placeholders}) ORDER BY catalog_id
+        """,
+        tag_ids,
+    )
+    catalog_ids = [row[0] for row in cursor.fetchall()]
+    if catalog_ids:
+        raise FilterTagsError(catalog_ids)
+    cursor.executemany(
+        "DELETE FROM catalog_tag_filter WHERE tag_id = ?",
+        [(tag_id,) for tag_id in tag_ids],
+    )
@@ -0,0 +1,186 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from backend.async_database import db
+
+"""
+A small background job queue for the slow operations (syncs, bulk tagging, catalog rebuilds).
+The endpoint submits a job and answers right away with its id, a worker thread runs it,
+and GET /jobs/{id} reports its status, progress, counts and timings.
+
+Jobs with the same coalesce key (like "sync-tracks" for one user) never run at the same time.
+A key belongs to one kind of job, as the pending job's payload is swapped for the new one.
+While one is running, the newest request waits as the one pending job, and any later request
+replaces its payload instead of queueing another. Two syncs sent back to back run as one.
+
+Finished jobs are kept (the last MAX_FINISHED of them) so their results can still be read.
+Jobs live in this server process only, and are lost on restart.
+"""
+
+WORKERS = 2
+MAX_FINISHED = 1000
+
+
+class Job:
+    def __init__(self, kind: str, user_id, coalesce_key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = str(user_id)
+        self.coalesce_key = coalesce_key
+        self.status = "queued"
+        self.progress: dict = {}
+        self.result = None
+        self.error: str | None = None
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.coalesced = 0
+        self._run = None
+        self._lock = threading.Lock()
+
+    def update(self, **progress) -> None:
+        """Called by the running job to report progress (any JSON values)."""
+        with self._lock:
+            self.progress.update(progress)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            now = time.time()
+            started = self.started_at or now
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "coalesced_requests": self.coalesced,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "queued_ms": round((started - self.created_at) * 1000, 1),
+                "running_ms": (
+                    round(((self.finished_at or now) - self.started_at) * 1000, 1)
+                    if self.started_at
+                    else None
+                ),
+            }
+
+
+class JobQueue:
+    def __init__(self, workers: int = WORKERS, max_finished: int = MAX_FINISHED):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._running: dict = {}
+        self._pending: dict = {}
+        self._max_finished = max_finished
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, user_id, run, coalesce_key=None) -> Job:
+        """
+        Queues run(job), to be called on a worker thread. Its return value becomes the result.
+        With a coalesce_key, returns the already pending job for that key (now with this run).
+        """
+        with self._lock:
+            if coalesce_key is not None:
+                pending = self._pending.get(coalesce_key)
+                if pending is not None:
+                    pending._run = run
+                    pending.coalesced += 1
+                    return pending
+
+            job = Job(kind, user_id, coalesce_key)
+            job._run = run
+            self._jobs[job.id] = job
+            self._trim()
+
+            if coalesce_key is not None:
+                self._pending[coalesce_key] = job
+                if coalesce_key in self._running:
+                    # starts when the running one finishes
+                    return job
+            self._executor.submit(self._execute, job)
+            return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def for_user(self, user_id) -> list[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.user_id == str(user_id)]
+
+    def _execute(self, job: Job) -> None:
+        with self._lock:
+            key = job.coalesce_key
+            if key is not None:
+                self._pending.pop(key, None)
+                self._running[key] = job
+            run = job._run
+        with job._lock:
+            job.status = "running"
+            job.started_at = time.time()
+
+        try:
+            result = run(job)
+            with job._lock:
+                job.result = result
+                job.status = "done"
+        except HTTPException as e:
+            # the same errors the endpoint would have answered with
+            with job._lock:
+                job.error = e.detail
+                job.status = "failed"
+        except Exception as e:
+            traceback.print_exc()
+            with job._lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            with job._lock:
+                job.finished_at = time.time()
+                job._run = None
+
+        with self._lock:
+            if key is not None:
+                self._running.pop(key, None)
+                waiting = self._pending.get(key)
+                if waiting is not None:
+                    self._executor.submit(self._execute, waiting)
+
+    def _trim(self) -> None:
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in ("done", "failed")
+        ]
+        for job_id in finished[: max(len(finished) - self._max_finished, 0)]:
+            del self._jobs[job_id]
+
+
+queue = JobQueue()
+
+
+def submit_db_job(kind: str, user_id, work, coalesce_key=None) -> Job:
+    """Submits work(conn, job), a write that's run by the database writer (async_database.py)."""
+    return queue.submit(
+        kind, user_id, lambda job: db.write_blocking(work, job), coalesce_key
+    )
+
+
+def accepted(job: Job) -> JSONResponse:
+    """The 202 answer for an endpoint that started a background job."""
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job.id, "status": job.status},
+        headers={"Location": f"/jobs/{job.id}"},
+    )
@@ -0,0 +1,356 @@
+import zlib
+from datetime import datetime, timezone
+
+from pydantic import TypeAdapter, ValidationError
+
+from backend.app.models.web.library import (
+    LibraryMeta,
+    LibraryRecord,
+    LibraryTag,
+    LibraryTrack,
+)
+from backend.app.services import catalogs
+from backend.app.services.fast_json import dumps
+from backend.app.services.tag_import import PlannedTag, insert_tags
+from backend.app.services.track_sync import empty_counts, stored_tracks, upsert_tracks
+
+"""
+Backing up a user's library (tracks, tags and which tracks have which tags) to one file,
+and reading it back, for GET /user/export, POST /user/import and scripts/library.py.
+
+The file is gzipped newline-delimited JSON, one record per line (see models/web/library.py):
+
+    {"kind":"meta","format":"spotify-toolbox-library","version":1,"exported_at":"..."}
+    {"kind":"tag","id":12,"name":"Rock","type":"genre","parent":null,"locked":false}
+    {"kind":"tag","id":13,"name":"Punk","type":"genre","parent":12,"locked":false}
+    {"kind":"track","added_at":"...","name":"...",...,"tags":[13]}
+
+Tags come before tracks, parents before their children, and tracks name their tags by the tag
+record's id. Both sides stream: the export reads the tracks with one cursor, EXPORT_BATCH_SIZE
+rows at a time, inside one read transaction (so it's a consistent snapshot), and compresses as it
+goes. The import decompresses and validates the lines IMPORT_CHUNK_SIZE at a time and writes each
+chunk through the same upsert as a sync (services/track_sync.py). Neither holds the whole
+library in memory.
+
+Importing adds to the library, nothing is deleted. A tag with the same name and type under the
+same parent as an existing tag is merged into it, and tracks are matched by added_at like a sync,
+so importing the same file twice changes nothing the second time.
+"""
+
+FORMAT = "spotify-toolbox-library"
+VERSION = 1
+
+EXPORT_BATCH_SIZE = 1000
+# zlib's fastest level: the file is about a third bigger than with the default 6, written 3x faster
+EXPORT_COMPRESS_LEVEL = 1
+IMPORT_CHUNK_SIZE = 5000
+MAX_LINE_BYTES = 1 << 20
+
+# a parent that isn't the user's own tag (the shared root, see tag_tree.ROOT_TAG_ID)
+# is exported as null, the tag is top-level
+EXPORT_TAGS = """
+    SELECT t.id, t.name, t.type, p.id, t.locked FROM tag t
+    LEFT JOIN tag p ON p.id = t.parent AND p.user_id = t.user_id
+    JOIN tag_closure c ON c.descendant = t.id
+    WHERE t.user_id = ? GROUP BY t.id ORDER BY MAX(c.depth), t.id
+"""
+
+EXPORT_TRACKS = """
+    SELECT t.added_at, t.name, t.artists, al.name, al.spotify_id, t.duration_ms, t.explicit,
+        t.popularity, t.track_number, t.release_date, al.image, t.spotify_id,
+        (SELECT group_concat(tt.tag_id) FROM track_tag tt WHERE tt.track_id = t.id)
+    FROM track t LEFT JOIN album al ON al.id = t.album_ref
+    WHERE t.user_id = ? ORDER BY t.added_at
+"""
+
+
+class LibraryImportError(ValueError):
+    pass
+
+
+class RecordError(LibraryImportError):
+    """A line that isn't a valid record."""
+
+    def __init__(self, line: int, errors: list):
+        super().__init__(f"Line {line} is not a valid record: {errors}")
+        self.line = line
+        self.errors = errors
+
+
+def export_records(cursor, user_id):
+    """The records of the user's library, in lists of up to EXPORT_BATCH_SIZE."""
+    yield [
+        {
+            "kind": "meta",
+            "format": FORMAT,
+            "version": VERSION,
+            "exported_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+    ]
+
+    cursor.execute(EXPORT_TAGS, (user_id,))
+    yield [
+        {
+            "kind": "tag",
+            "id": tag_id,
+            "name": name,
+            "type": type,
+            "parent": parent,
+            "locked": bool(locked),
+        }
+        for tag_id, name, type, parent, locked in cursor.fetchall()
+    ]
+
+    cursor.execute(EXPORT_TRACKS, (user_id,))
+    while rows := cursor.fetchmany(EXPORT_BATCH_SIZE):
+        records = []
+        for row in rows:
+            record = {
+                "kind": "track",
+                "added_at": row[0],
+                "name": row[1],
+                "artists": row[2],
+                "album": row[3] or "",
+                "album_id": row[4] or "",
+                "duration_ms": row[5],
+                "explicit": bool(row[6]),
+                "popularity": row[7],
+                "track_number": row[8],
+                "release_date": row[9],
+                "image": row[10] or None,
+                "spotify_id": row[11],
+            }
+            if row[12]:
+                record["tags"] = [int(tag_id) for tag_id in row[12].split(",")]
+            records.append(record)
+        yield records
+
+
+def export_library(conn, user_id):
+    """The user's library as the pieces of a gzipped NDJSON file, read in one transaction."""
+    compressor = zlib.compressobj(EXPORT_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        for records in export_records(cursor, user_id):
+            if not records:
+                continue
+            data = compressor.compress(b"\n".join(map(dumps, records)) + b"\n")
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        conn.rollback()
+
+
+def import_tags(cursor, user_id, tags: list[LibraryTag], counts: dict) -> dict:
+    """Finds or creates the file's tags, returns {id in the file: id here}."""
+    cursor.execute(
+        "SELECT id, parent, name, type FROM tag WHERE user_id = ?", (user_id,)
+    )
+    existing = {
+        (parent, name, type): tag_id for tag_id, parent, name, type in cursor.fetchall()
+    }
+
+    # a parent that isn't in the file (the root, in older exports) makes a top-level tag
+    file_ids = {tag.id for tag in tags}
+    tag_ids: dict[int, int] = {}
+    created: set[int] = set()
+    planned = []
+    for tag in tags:
+        if tag.id in tag_ids or tag.id in created:
+            raise LibraryImportError(f"Duplicate tag id {tag.id}")
+        if tag.parent in created:
+            # under a new tag, so it's new too
+            parent, parent_id = str(tag.parent), None
+        elif tag.parent not in file_ids or tag.parent in tag_ids:
+            parent, parent_id = None, tag_ids.get(tag.parent)
+            found = existing.get((parent_id, tag.name, tag.type))
+            if found is not None:
+                tag_ids[tag.id] = found
+                continue
+        else:
+            raise LibraryImportError(
+                f"Tag {tag.id} comes before its parent {tag.parent}"
+            )
+        created.add(tag.id)
+        planned.append(
+            PlannedTag(str(tag.id), tag.name, tag.type, tag.locked, parent, parent_id)
+        )
+
+    new_ids = insert_tags(cursor, user_id, planned)
+    tag_ids.update((int(temp_id), tag_id) for temp_id, tag_id in new_ids.items())
+    counts["tags_created"] += len(new_ids)
+    counts["tags_merged"] += len(tags) - len(new_ids)
+    return tag_ids
+
+
+def import_tracks(
+    cursor, user_id, tracks: list[LibraryTrack], tag_ids: dict, counts: dict
+) -> None:
+    upsert_tracks(cursor, user_id, tracks, counts)
+    tagged = [(track.added_at, tag) for track in tracks for tag in track.tags]
+    if not tagged:
+        return
+    track_ids = {
+        added_at: row[0]
+        for added_at, row in stored_tracks(
+            cursor, user_id, list({added_at for added_at, _ in tagged})
+        ).items()
+    }
+    cursor.executemany(
+        """
+        INSERT INTO track_tag (track_id, tag_id, is_tagged) VALUES (?, ?, TRUE)
+        ON CONFLICT(track_id, tag_id) DO NOTHING
+        """,
+        [(track_ids[added_at], tag_ids[tag]) for added_at, tag in tagged],
+    )
+    counts["track_tags"] += cursor.rowcount
+    catalogs.refresh(cursor, user_id, track_ids=sorted(set(track_ids.values())))
+
+
+record_list = TypeAdapter(list[LibraryRecord])
+record = TypeAdapter(LibraryRecord)
+
+
+class LibraryImport:
+    """
+    Reads an export as it arrives and hands out the writes to make, in order:
+
+        importer = LibraryImport(user_id)
+        for data in pieces_of_the_file:
+            for batch in importer.feed(data):
+                importer.write(conn, batch)
+        for batch in importer.finish():
+            importer.write(conn, batch)
+
+    Each write is one transaction. The generators pause at every batch, so a batch is written
+    before the next one is parsed (the tracks need the tags' new ids). Raises LibraryImportError
+    on a broken file, with the batches before it already written.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.counts = empty_counts()
+        del self.counts["deleted"]
+        self.counts.update(tags_created=0, tags_merged=0, track_tags=0)
+
+        self._decompressor = None
+        self._started = False
+        self._buffer = b""
+        self._lines: list[bytes] = []
+        self._line_number = 0  # lines parsed so far
+
+        self._meta: LibraryMeta | None = None
+        self._tags: list[LibraryTag] = []
+        self._tag_file_ids: set[int] = set()
+        self._tag_ids: dict | None = None  # set once the tags are written
+        self._tracks: list[LibraryTrack] = []
+
+    def feed(self, data: bytes):
+        if not self._started:
+            self._started = True
+            # a plain (not gzipped) NDJSON file works too
+            if data[:2] == b"\x1f\x8b":
+                self._decompressor = zlib.decompressobj(31)
+        for text in self._inflate(data):
+            self._buffer += text
+            *lines, self._buffer = self._buffer.split(b"\n")
+            if len(self._buffer) > MAX_LINE_BYTES:
+                raise LibraryImportError(
+                    f"Line {self._line_number + len(self._lines) + len(lines) + 1} is too long"
+                )
+            self._lines += lines
+            if len(self._lines) >= IMPORT_CHUNK_SIZE:
+                yield from self._parse()
+
+    def finish(self):
+        if self._decompressor is not None and not self._decompressor.eof:
+            raise LibraryImportError("The file ends early (incomplete gzip data)")
+        if self._buffer.strip():
+            self._lines.append(self._buffer)
+        self._buffer = b""
+        yield from self._parse()
+        if self._meta is None:
+            raise LibraryImportError("Not a library export")
+        if self._tag_ids is None:
+            yield ("tags", self._tags)
+        if self._tracks:
+            yield ("tracks", self._tracks)
+            self._tracks = []
+
+    def write(self, conn, batch) -> None:
+        kind, records = batch
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        if kind == "tags":
+            self._tag_ids = import_tags(cursor, self.user_id, records, self.counts)
+        else:
+            import_tracks(cursor, self.user_id, records, self._tag_ids, self.counts)
+        conn.commit()
+
+    def _inflate(self, data: bytes):
+        if self._decompressor is None:
+            yield data
+            return
+        # at most MAX_LINE_BYTES at a time, so a small piece of gzip can't blow up in memory
+        while data:
+            yield self._decompressor.decompress(data, MAX_LINE_BYTES)
+            data = self._decompressor.unconsumed_tail
+
+    def _parse(self):
+        numbered = [
+            (self._line_number + i + 1, line)
+            for i, line in enumerate(self._lines)
+            if line.strip()
+        ]
+        self._line_number += len(self._lines)
+        self._lines = []
+        if not numbered:
+            return
+        try:
+            # the whole chunk as one JSON array, one validation call instead of one per line
+            records = record_list.validate_json(
+                b"[" + b",".join(line for _, line in numbered) + b"]"
+            )
+        except ValidationError:
+            # find the first bad line, to say which one it is
+            for line_number, line in numbered:
+                try:
+                    record.validate_json(line)
+                except ValidationError as e:
+                    raise RecordError(
+                        line_number, e.errors(include_url=False, include_input=False)
+                    )
+            raise
+
+        for (line_number, _), item in zip(numbered, records):
+            if self._meta is None:
+                if not isinstance(item, LibraryMeta) or item.format != FORMAT:
+                    raise LibraryImportError("Not a library export")
+                if item.version > VERSION:
+                    raise LibraryImportError(
+                        f"The file is version {item.version}, this server reads up to {VERSION}"
+                    )
+                self._meta = item
+            elif isinstance(item, LibraryTag):
+                if self._tag_ids is not None:
+                    raise LibraryImportError(
+                        f"Line {line_number}: tags have to come before the tracks"
+                    )
+                self._tags.append(item)
+                self._tag_file_ids.add(item.id)
+            elif isinstance(item, LibraryTrack):
+                if self._tag_ids is None:
+                    yield ("tags", self._tags)
+                unknown = [tag for tag in item.tags if tag not in self._tag_file_ids]
+                if unknown:
+                    raise LibraryImportError(
+                        f"Line {line_number}: unknown tags {unknown}"
+                    )
+                self._tracks.append(item)
+                if len(self._tracks) >= IMPORT_CHUNK_SIZE:
+                    yield ("tracks", self._tracks)
+                    self._tracks = []
+            else:
+                raise LibraryImportError(f"Line {line_number}: a second meta record")
@@ -0,0 +1,113 @@
+from backend.app.services.user_cache import UserCache
+
+"""
+Library statistics for dashboards: totals, top artists and albums, releases per year and
+how many tracks each tag has. Every number is one aggregate query, so nothing but the results
+leaves SQLite.
+
+Stats only change when the user's tracks or tags change, so they're cached per user
+(see services/user_cache.py). The sync and tag write paths call invalidate(user_id).
+"""
+
+TOP_COUNT = 10
+
+# counted by id first, so only the top rows are joined to their names
+ARTIST_COUNTS = """
+    SELECT a.name, top.tracks FROM (
+        SELECT ta.artist_id, COUNT(*) AS tracks FROM track t
+        JOIN track_artist ta ON ta.track_id = t.id
+        WHERE t.user_id = :user_id
+        GROUP BY ta.artist_id
+        ORDER BY tracks DESC, ta.artist_id
+        LIMIT :top
+    ) top
+    JOIN artist a ON a.id = top.artist_id
+    ORDER BY top.tracks DESC, a.name
+"""
+
+ALBUM_COUNTS = """
+    SELECT al.spotify_id, al.name, top.tracks FROM (
+        SELECT album_ref, COUNT(*) AS tracks FROM track
+        WHERE user_id = :user_id
+        GROUP BY album_ref
+        ORDER BY tracks DESC, album_ref
+        LIMIT :top
+    ) top
+    JOIN album al ON al.id = top.album_ref
+    ORDER BY top.tracks DESC, al.spotify_id
+"""
+
+YEAR_COUNTS = """
+    SELECT substr(release_date, 1, 4) AS year, COUNT(*) FROM track
+    WHERE user_id = :user_id
+    GROUP BY year
+    ORDER BY year
+"""
+
+# direct: tracks tagged with the tag itself, total: with the tag or any tag below it
+TAG_COUNTS = """
+    SELECT
+        t.id,
+        t.name,
+        (SELECT COUNT(*) FROM track_tag WHERE tag_id = t.id),
+        (
+            SELECT COUNT(DISTINCT tt.track_id) FROM tag_closure c
+            JOIN track_tag tt ON tt.tag_id = c.descendant
+            WHERE c.ancestor = t.id
+        )
+    FROM tag t
+    WHERE t.user_id = :user_id
+    ORDER BY t.id
+"""
+
+
+def compute_stats(cursor, user_id, top: int = TOP_COUNT) -> dict:
+    params = {"user_id": user_id, "top": top}
+    cursor.execute(
+        """
+        SELECT COUNT(*), COALESCE(SUM(duration_ms), 0), COALESCE(AVG(explicit), 0)
+        FROM track WHERE user_id = :user_id
+        """,
+        params,
+    )
+    total_count, total_duration_ms, explicit_ratio = cursor.fetchone()
+
+    cursor.execute(ARTIST_COUNTS, params)
+    top_artists = [{"artist": row[0], "tracks": row[1]} for row in cursor.fetchall()]
+
+    cursor.execute(ALBUM_COUNTS, params)
+    top_albums = [
+        {"album_id": row[0], "album": row[1], "tracks": row[2]}
+        for row in cursor.fetchall()
+    ]
+
+    cursor.execute(YEAR_COUNTS, params)
+    # releases with an unknown date ("" or "0000") are counted together under null
+    years: dict = {}
+    for year, tracks in cursor.fetchall():
+        key = int(year) if year.isascii() and year.isdigit() and int(year) else None
+        years[key] = years.get(key, 0) + tracks
+    release_years = [{"year": year, "tracks": tracks} for year, tracks in years.items()]
+
+    cursor.execute(TAG_COUNTS, params)
+    tags = [
+        {"id": row[0], "name": row[1], "direct": row[2], "total": row[3]}
+        for row in cursor.fetchall()
+    ]
+
+    return {
+        "total_count": total_count,
+        "total_duration_ms": total_duration_ms,
+        "explicit_ratio": round(explicit_ratio, 4),
+        "top_artists": top_artists,
+        "top_albums": top_albums,
+        "release_years": release_years,
+        "tags": tags,
+    }
+
+
+stats_cache = UserCache(max_users=256)
+
+
+def invalidate(user_id) -> None:
+    stats_cache.invalidate(user_id)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import random
+
+import httpx
+
+from backend.app.models.web.track import TrackIn
+
+"""
+Fetches a user's saved tracks from Spotify on the server, instead of the browser walking
+/v1/me/tracks one page after another and uploading the result.
+
+- pages are requested several at a time (MAX_CONCURRENCY) over one pooled HTTP client
+- 429 responses wait for the Retry-After Spotify sends, 5xx responses back off exponentially
+- Spotify lists saved tracks newest first, so with a stop_at timestamp (the newest added_at already
+  stored) fetching stops at the first page that reaches it, and only the new tracks are returned
+
+SPOTIFY_API_BASE can point at another server, like backend/scripts/fake_spotify.py for testing.
+"""
+
+SPOTIFY_API_BASE = os.environ.get("SPOTIFY_API_BASE", "https://api.spotify.com/v1")
+PAGE_SIZE = 50  # Spotify API max limit per request
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 5
+MAX_RETRY_AFTER = 30
+
+
+class SpotifyError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Spotify returned {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def transform_saved_track(item: dict, user_id) -> TrackIn:
+    """The same conversion as transformSpotifyTrack in the frontend."""
+    track = item["track"]
+    images = track["album"].get("images") or []
+    return TrackIn(
+        user_id=user_id,
+        name=track["name"],
+        artists=", ".join(artist["name"] for artist in track["artists"]),
+        album=track["album"]["name"],
+        album_id=track["album"]["id"],
+        duration_ms=track["duration_ms"],
+        explicit=track["explicit"],
+        popularity=track["popularity"],
+        track_number=track["track_number"],
+        release_date=track["album"]["release_date"],
+        added_at=item["added_at"],
+        image=images[0]["url"] if images else None,
+        spotify_id=track["id"],
+    )
+
+
+async def fetch_page(client: httpx.AsyncClient, offset: int) -> dict:
+    for attempt in range(MAX_RETRIES + 1):
+        response = await client.get(
+            "/me/tracks", params={"limit": PAGE_SIZE, "offset": offset}
+        )
+        if response.status_code == 200:
+            return response.json()
+
+        retryable = response.status_code == 429 or response.status_code >= 500
+        if not retryable or attempt == MAX_RETRIES:
+            try:
+                message = response.json()["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            raise SpotifyError(response.status_code, message)
+
+        retry_after = response.headers.get("Retry-After")
+        if response.status_code == 429 and retry_after and retry_after.isdigit():
+            delay = min(int(retry_after), MAX_RETRY_AFTER)
+        else:
+            delay = min(2**attempt, MAX_RETRY_AFTER) * (0.5 + random.random() / 2)
+        await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def page_tracks(items: list[dict], user_id) -> list[TrackIn]:
+    # local files and tracks no longer available come back without an id, they're skipped
+    return [
+        transform_saved_track(item, user_id)
+        for item in items
+        if item.get("track") and item["track"].get("id")
+    ]
+
+
+def new_items(page: dict, stop_at: str | None) -> tuple[list[dict], bool]:
+    """The page's items newer than stop_at, and whether stop_at was reached."""
+    items = page.get("items") or []
+    if stop_at is None:
+        return items, False
+    newer = [item for item in items if item["added_at"] > stop_at]
+    return newer, len(newer) < len(items)
+
+
+async def saved_track_pages(
+    access_token: str,
+    user_id,
+    stop_at: str | None = None,
+    concurrency: int = MAX_CONCURRENCY,
+    transport: httpx.AsyncBaseTransport | None = None,
+    meta: dict | None = None,
+):
+    """
+    Yields the user's saved tracks as lists of TrackIn, one list per page, newest first.
+    The first page tells how many there are, then the rest are fetched `concurrency` at a time.
+    meta, if given, gets the library size Spotify reports as meta["total"].
+    """
+    async with httpx.AsyncClient(
+        base_url=SPOTIFY_API_BASE,
+        headers={"Authorization": f"Bearer {access_token}"},
+        timeout=httpx.Timeout(30),
+        limits=httpx.Limits(max_connections=concurrency),
+        transport=transport,
+    ) as client:
+        first = await fetch_page(client, 0)
+        items, reached = new_items(first, stop_at)
+        yield page_tracks(items, user_id)
+
+        total = first.get("total") or 0
+        if meta is not None:
+            meta["total"] = total
+        offsets = range(PAGE_SIZE, total, PAGE_SIZE)
+        position = 0
+        while not reached and position < len(offsets):
+            window = offsets[position : position + concurrency]
+            position += concurrency
+            pages = await asyncio.gather(*(fetch_page(client, o) for o in window))
+            for page in pages:
+                items, reached = new_items(page, stop_at)
+                yield page_tracks(items, user_id)
+                if reached:
+                    break
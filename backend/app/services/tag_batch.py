@@ -0,0 +1,168 @@
+from backend.app.models.web.tag import TagCopy, TagMove
+from backend.app.services import tag_tree
+from backend.app.services.tag_import import MAX_IMPORT_TAGS, PlannedTag, insert_tags
+from backend.app.services.track_tags import UnknownTagsError, check_tags
+
+"""
+Reorganizing the tag tree: moving (reparenting) and copying many tags in one transaction,
+without deleting and recreating subtrees (which would lose the tags' tracks).
+
+Moves are checked all together before anything changes. The user's tags are read with one
+query, the moves are applied to that {tag: parent} map in memory, and then:
+- every moved tag has to reach the top without coming back to itself (no cycles), which is one
+  walk up the new tree from each moved tag, stopping at tags already known to be fine
+- no locked tag may be moved, or be under a moved tag: a walk up the old tree from each locked tag
+This is linear in the size of the tree, however many tags are moved. Then the closure table is
+updated by detaching every moved subtree and attaching each one under its new parent. Every
+attach is valid at the time it runs, because the final tree has no cycle.
+
+A copy duplicates a tag and its whole subtree (names, types, locked flags) under a new parent,
+and with tracks=true also the track_tag rows of every copied tag. All the subtrees are read with
+one query on tag_closure and written like an import (see services/tag_import.py).
+"""
+
+
+class TagBatchError(ValueError):
+    pass
+
+
+class LockedTagsError(Exception):
+    def __init__(self, tag_ids: list[int]):
+        super().__init__(f"Locked tags: {tag_ids}")
+        self.tag_ids = tag_ids
+
+
+def move_tags(cursor, user_id, moves: list[TagMove]) -> list[int]:
+    """
+    Applies the moves and returns the ids of the tags whose parent changed.
+    Raises TagBatchError, UnknownTagsError or LockedTagsError before changing anything.
+    """
+    targets: dict[int, int | None] = {}
+    for move in moves:
+        if move.tag_id in targets:
+            raise TagBatchError(f"Tag {move.tag_id} is moved more than once")
+        targets[move.tag_id] = tag_tree.stored_parent(move.parent)
+
+    cursor.execute("SELECT id, parent, locked FROM tag WHERE user_id = ?", (user_id,))
+    parents: dict[int, int | None] = {}
+    locked = []
+    for tag_id, parent, is_locked in cursor.fetchall():
+        parents[tag_id] = parent
+        if is_locked:
+            locked.append(tag_id)
+
+    missing = {tag_id for tag_id in targets if tag_id not in parents}
+    missing |= {p for p in targets.values() if p is not None and p not in parents}
+    if missing:
+        raise UnknownTagsError(sorted(missing))
+
+    # a locked tag can't change place in the tree, so neither it nor its ancestors can move
+    blocked = set()
+    for tag_id in locked:
+        node = tag_id
+        while node is not None:
+            if node in targets:
+                blocked.add(node)
+            node = parents.get(node)
+    if blocked:
+        raise LockedTagsError(sorted(blocked))
+
+    new_parents = {**parents, **targets}
+    reaches_top: set[int] = set()
+    for tag_id in targets:
+        path = []
+        node = tag_id
+        while node is not None and node not in reaches_top:
+            if node in path:
+                raise TagBatchError(f"Moving tag {tag_id} would make a cycle")
+            path.append(node)
+            node = new_parents.get(node)
+        reaches_top.update(path)
+
+    moved = [tag_id for tag_id, parent in targets.items() if parents[tag_id] != parent]
+    for tag_id in moved:
+        tag_tree.detach_subtree(cursor, tag_id)
+    for tag_id in moved:
+        tag_tree.attach_subtree(cursor, tag_id, targets[tag_id])
+    return moved
+
+
+def copy_tags(cursor, user_id, copies: list[TagCopy], tracks: bool) -> dict:
+    """
+    Copies each tag's subtree under its new parent. Returns the new ids of each copy
+    ({source id: new id}) and the number of track_tag rows copied.
+    """
+    copies = [
+        copy.model_copy(update={"parent": tag_tree.stored_parent(copy.parent)})
+        for copy in copies
+    ]
+    sources = sorted({copy.tag_id for copy in copies})
+    if not sources:
+        return {"copies": [], "created": 0, "track_tags": 0}
+    cursor.execute(
+        f"""
+        SELECT c.ancestor, t.id, t.name, t.type, t.parent, t.locked FROM tag_closure c
+        JOIN tag t ON t.id = c.descendant
+        WHERE c.ancestor IN ({", ".join("?" for _ in sources)}) AND t.user_id = ?
+        ORDER BY c.ancestor, c.depth
+        """,
+        (*sources, user_id),
+    )
+    subtrees: dict[int, list] = {}
+    for row in cursor.fetchall():
+        subtrees.setdefault(row[0], []).append(row[1:])
+    missing = {tag_id for tag_id in sources if tag_id not in subtrees}
+    if missing:
+        raise UnknownTagsError(sorted(missing))
+    parents = sorted({copy.parent for copy in copies if copy.parent is not None})
+    if parents:
+        check_tags(cursor, user_id, parents)
+
+    if sum(len(subtrees[copy.tag_id]) for copy in copies) > MAX_IMPORT_TAGS:
+        raise TagBatchError(f"At most {MAX_IMPORT_TAGS} tags can be copied at once")
+
+    # each copy's tags get the temp id "<copy>:<source tag>", and are ordered parents first
+    planned = []
+    for i, copy in enumerate(copies):
+        for tag_id, name, type, parent, is_locked in subtrees[copy.tag_id]:
+            top = tag_id == copy.tag_id
+            planned.append(
+                PlannedTag(
+                    f"{i}:{tag_id}",
+                    name,
+                    type,
+                    bool(is_locked),
+                    None if top else f"{i}:{parent}",
+                    copy.parent if top else None,
+                )
+            )
+    ids = insert_tags(cursor, user_id, planned)
+    # {source id: new id} of each copy
+    copied = [
+        {row[0]: ids[f"{i}:{row[0]}"] for row in subtrees[copy.tag_id]}
+        for i, copy in enumerate(copies)
+    ]
+
+    track_tags = 0
+    if tracks:
+        cursor.executemany(
+            """
+            INSERT INTO track_tag (track_id, tag_id, is_tagged)
+            SELECT track_id, ?, is_tagged FROM track_tag WHERE tag_id = ?
+            """,
+            [
+                (new_id, old_id)
+                for new_ids in copied
+                for old_id, new_id in new_ids.items()
+            ],
+        )
+        track_tags = cursor.rowcount
+
+    return {
+        "copies": [
+            {"tag_id": copy.tag_id, "parent": copy.parent, "ids": new_ids}
+            for copy, new_ids in zip(copies, copied)
+        ],
+        "created": len(ids),
+        "track_tags": track_tags,
+    }
@@ -0,0 +1,165 @@
+import re
+
+"""
+Tag expressions filter tracks with boolean rules over tag names, for example:
+    (rock OR jazz) AND NOT live
+    "hip hop" AND NOT remix
+
+- AND, OR and NOT (any case) combine rules, NOT binds tightest and OR loosest
+- parentheses group rules
+- names with spaces or parentheses go in double quotes
+- a tag matches its whole subtree, so "rock" also matches tracks tagged "punk rock" under it
+
+The expression is parsed into a small tree, then compiled into ONE SQL condition on the track
+table, so SQLite does the matching with the track_tag indexes instead of Python looping over tracks.
+"""
+
+MAX_TOKENS = 200
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def tokenize(expression: str) -> list[tuple[str, str]]:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ExpressionError(f"Unexpected character at {position}")
+        position = match.end()
+        opening, closing, quoted, word = match.groups()
+        if opening:
+            tokens.append(("(", opening))
+        elif closing:
+            tokens.append((")", closing))
+        elif quoted is not None:
+            tokens.append(("name", quoted))
+        elif word.upper() in ("AND", "OR", "NOT"):
+            tokens.append((word.upper(), word))
+        else:
+            tokens.append(("name", word))
+    if len(tokens) > MAX_TOKENS:
+        raise ExpressionError(f"Expressions are limited to {MAX_TOKENS} tokens")
+    return tokens
+
+
+class Parser:
+    """
+    Recursive descent parser for:
+        expression := term (OR term)*
+        term       := factor (AND factor)*
+        factor     := NOT factor | "(" expression ")" | name
+    """
+
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> str | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def take(self, kind: str) -> str:
+        if self.peek() != kind:
+            found = self.peek() or "end of expression"
+            raise ExpressionError(f"Expected {kind}, found {found}")
+        value = self.tokens[self.position][1]
+        self.position += 1
+        return value
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("Empty expression")
+        node = self.expression()
+        if self.peek() is not None:
+            raise ExpressionError(f"Unexpected {self.peek()}")
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek() == "OR":
+            self.take("OR")
+            node = ("or", node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() == "AND":
+            self.take("AND")
+            node = ("and", node, self.factor())
+        return node
+
+    def factor(self):
+        if self.peek() == "NOT":
+            self.take("NOT")
+            return ("not", self.factor())
+        if self.peek() == "(":
+            self.take("(")
+            node = self.expression()
+            self.take(")")
+            return node
+        return ("tag", self.take("name"))
+
+
+def parse(expression: str):
+    return Parser(tokenize(expression)).parse()
+
+
+def tag_names(node) -> set[str]:
+    if node[0] == "tag":
+        return {node[1].lower()}
+    return set().union(*(tag_names(child) for child in node[1:]))
+
+
+def named_tag_ids(cursor, user_id, names: set[str]) -> dict[str, list[int]]:
+    """Maps each (lowercased) tag name to the ids of the user's tags with that name."""
+    cursor.execute(
+        f"""
+        SELECT id, lower(name) FROM tag
+        WHERE user_id = ? AND lower(name) IN ({", ".join("?" for _ in names)})
+        """,
+        (user_id, *names),
+    )
+    named: dict[str, list[int]] = {}
+    for tag_id, name in cursor.fetchall():
+        named.setdefault(name, []).append(tag_id)
+
+    missing = sorted(names - set(named))
+    if missing:
+        raise ExpressionError(f"Unknown tags: {', '.join(missing)}")
+    return named
+
+
+def compile_node(node, named: dict[str, list[int]]) -> tuple[str, list]:
+    kind = node[0]
+    if kind == "tag":
+        # the tag's whole subtree comes from the closure table
+        ids = named[node[1].lower()]
+        return (
+            "id IN (SELECT tt.track_id FROM tag_closure c"
+            " JOIN track_tag tt ON tt.tag_id = c.descendant"
+            f" WHERE c.ancestor IN ({', '.join('?' for _ in ids)}))",
+            list(ids),
+        )
+    if kind == "not":
+        sql, params = compile_node(node[1], named)
+        return f"NOT ({sql})", params
+    left_sql, left_params = compile_node(node[1], named)
+    right_sql, right_params = compile_node(node[2], named)
+    return f"({left_sql} {kind.upper()} {right_sql})", left_params + right_params
+
+
+def compile_expression(cursor, user_id, expression: str) -> tuple[str, list]:
+    """
+    Returns a SQL condition on the track table (and its parameters) that is true for the
+    tracks matching the expression.
+    """
+    node = parse(expression)
+    named = named_tag_ids(cursor, user_id, tag_names(node))
+    return compile_node(node, named)
@@ -0,0 +1,64 @@
+from backend.app.services.user_cache import UserCache
+
+"""
+The tag tree only changes when the user creates or deletes tags, so the built and serialized tree
+is cached per user (see services/user_cache.py), and the tag writes invalidate it.
+Each version of the tree has an ETag. A client that sends it back in If-None-Match gets
+304 Not Modified without any database or JSON work. Browsers do this on their own.
+"""
+
+hierarchy_cache = UserCache(max_users=256)
+
+
+def build_tags_hierarchy(cursor, user_id) -> dict:
+    # the closure gives each tag's depth (its farthest ancestor), so ordering by it
+    # puts every parent before its children
+    cursor.execute(
+        """
+        SELECT t.id, t.name, t.type, t.parent, t.locked, MAX(c.depth) AS depth
+        FROM tag t
+        JOIN tag_closure c ON c.descendant = t.id
+        WHERE t.user_id = ?
+        GROUP BY t.id
+        ORDER BY depth, t.id
+        """,
+        (user_id,),
+    )
+    tags = cursor.fetchall()
+
+    tags = [
+        {
+            "id": tag[0],
+            "name": tag[1],
+            "type": tag[2],
+            "parent": tag[3],
+            "locked": tag[4],
+            "user_id": user_id,
+        }
+        for tag in tags
+    ]
+
+    # parents come first, so one pass is enough: a tag's parent node already exists
+    tag_map = {}
+    root_children = []
+
+    for tag in tags:
+        node = {**tag, "children": []}
+        tag_map[tag["id"]] = node
+        parent = tag_map.get(tag["parent"])
+        if parent is None:
+            root_children.append(node)
+        else:
+            parent["children"].append(node)
+
+    root_tag = {
+        "id": 0,
+        "name": "Root",
+        "type": "group",
+        "parent": None,
+        "locked": False,
+        "user_id": user_id,
+        "children": root_children,
+    }
+
+    return root_tag
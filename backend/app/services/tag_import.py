@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+
+from backend.app.models.web.tag import TagImport
+from backend.app.services import tag_tree
+
+"""
+Importing a whole tag tree (like a genre taxonomy) in one request and one transaction,
+instead of one POST /tag/ per tag.
+
+The body has the tags either nested (tree: each tag with its children) or as a flat list
+(tags: each tag with a temp_id, and parent set to the temp_id of its parent), or both.
+Temp ids are the client's names for the new tags: the answer maps each of them to the real id.
+Nested tags without a temp_id get their position as one: "0" is the first top-level tag,
+"0.2" its third child, and so on. Temp ids are compared as strings, so 1 and "1" are the same.
+
+Top-level tags go under the body's parent_id (an existing tag, or the root when it's null),
+and a flat tag can also name an existing parent of its own with parent_id.
+
+The tags are checked first (unknown or duplicate temp ids, cycles, size), then written with
+executemany: the tags, their parents, and their tag_closure rows (see services/tag_tree.py).
+"""
+
+MAX_IMPORT_TAGS = 10_000
+
+
+class TagImportError(ValueError):
+    pass
+
+
+@dataclass
+class PlannedTag:
+    temp_id: str
+    name: str
+    type: str
+    locked: bool
+    parent: str | None  # temp_id of a new tag
+    parent_id: int | None  # id of an existing tag
+
+
+def flatten(body: TagImport) -> list[PlannedTag]:
+    tags = []
+    # (node, temp id it gets by default, temp id of its parent), without recursion
+    # so very deep trees don't hit Python's recursion limit
+    stack = [(node, str(i), None) for i, node in reversed(list(enumerate(body.tree)))]
+    while stack:
+        node, path, parent = stack.pop()
+        temp_id = path if node.temp_id is None else str(node.temp_id)
+        tags.append(
+            PlannedTag(
+                temp_id,
+                node.name,
+                node.type,
+                node.locked,
+                parent,
+                tag_tree.stored_parent(body.parent_id) if parent is None else None,
+            )
+        )
+        for i in reversed(range(len(node.children))):
+            stack.append((node.children[i], f"{path}.{i}", temp_id))
+
+    for item in body.tags:
+        if item.parent is not None and item.parent_id is not None:
+            raise TagImportError(
+                f"Tag {item.temp_id} has both a parent and a parent_id"
+            )
+        parent_id = item.parent_id
+        if item.parent is None and parent_id is None:
+            parent_id = body.parent_id
+        parent_id = tag_tree.stored_parent(parent_id)
+        parent = None if item.parent is None else str(item.parent)
+        tags.append(
+            PlannedTag(
+                str(item.temp_id), item.name, item.type, item.locked, parent, parent_id
+            )
+        )
+    return tags
+
+
+def plan_import(body: TagImport) -> list[PlannedTag]:
+    """The tags to create, every parent before its children. Raises TagImportError."""
+    tags = flatten(body)
+    if len(tags) > MAX_IMPORT_TAGS:
+        raise TagImportError(f"At most {MAX_IMPORT_TAGS} tags can be imported at once")
+
+    by_temp_id: dict[str, PlannedTag] = {}
+    for tag in tags:
+        if tag.temp_id in by_temp_id:
+            raise TagImportError(f"Duplicate temp_id: {tag.temp_id}")
+        by_temp_id[tag.temp_id] = tag
+
+    children: dict[str | None, list[PlannedTag]] = {}
+    for tag in tags:
+        if tag.parent is not None and tag.parent not in by_temp_id:
+            raise TagImportError(f"Unknown parent {tag.parent} of tag {tag.temp_id}")
+        children.setdefault(tag.parent, []).append(tag)
+
+    # breadth first from the tags whose parent isn't new, so parents come first;
+    # tags that are never reached are in a cycle
+    ordered = list(children.get(None, []))
+    i = 0
+    while i < len(ordered):
+        ordered += children.get(ordered[i].temp_id, [])
+        i += 1
+    if len(ordered) < len(tags):
+        reached = {tag.temp_id for tag in ordered}
+        cycle = [tag.temp_id for tag in tags if tag.temp_id not in reached]
+        raise TagImportError(f"Tags in (or under) a cycle: {', '.join(cycle[:20])}")
+    return ordered
+
+
+def insert_tags(cursor, user_id, tags: list[PlannedTag]) -> dict[str, int]:
+    """Writes planned tags (parents first) and returns {temp_id: id}. Needs the write lock."""
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM tag")
+    last_id = cursor.fetchone()[0]
+    cursor.executemany(
+        "INSERT INTO tag (user_id, name, type, parent, locked) VALUES (?, ?, ?, NULL, ?)",
+        [(user_id, tag.name, tag.type, tag.locked) for tag in tags],
+    )
+    # ids are handed out in increasing order, and nothing else writes during the transaction
+    cursor.execute(
+        "SELECT id FROM tag WHERE id > ? AND user_id = ? ORDER BY id",
+        (last_id, user_id),
+    )
+    ids = {tag.temp_id: row[0] for tag, row in zip(tags, cursor.fetchall())}
+
+    parents = [
+        (ids[tag.temp_id], ids[tag.parent] if tag.parent is not None else tag.parent_id)
+        for tag in tags
+    ]
+    cursor.executemany(
+        "UPDATE tag SET parent = ? WHERE id = ?",
+        [(parent, tag_id) for tag_id, parent in parents if parent is not None],
+    )
+    tag_tree.add_tags(cursor, parents)
+    return ids
@@ -0,0 +1,120 @@
+"""
+Helpers for the tag_closure table, which stores every (ancestor, descendant) pair of the tag
+tree with the distance between them. Each tag is its own ancestor at depth 0.
+
+    subtree of X      -> SELECT descendant FROM tag_closure WHERE ancestor = X
+    ancestors of X    -> SELECT ancestor FROM tag_closure WHERE descendant = X
+
+Every change to tag.parent has to go through these helpers, or the closure goes stale.
+Rows are removed automatically when a tag is deleted (ON DELETE CASCADE).
+"""
+
+# The "root" tag seeded by migration 1 belongs to the admin user, but every user's tree is drawn
+# under it, so the frontend sends it as the parent of a new top-level tag.
+ROOT_TAG_ID = 1
+
+
+def stored_parent(parent: int | None) -> int | None:
+    """The parent to store for a tag put under parent: under the root is top-level (NULL)."""
+    return None if parent == ROOT_TAG_ID else parent
+
+
+def add_tag(cursor, tag_id: int, parent: int | None) -> None:
+    """A new leaf tag: it's its own ancestor, plus every ancestor of its parent one level further."""
+    cursor.execute(
+        "INSERT INTO tag_closure (ancestor, descendant, depth) VALUES (?, ?, 0)",
+        (tag_id, tag_id),
+    )
+    if parent is not None:
+        cursor.execute(
+            """
+            INSERT INTO tag_closure (ancestor, descendant, depth)
+            SELECT ancestor, ?, depth + 1 FROM tag_closure WHERE descendant = ?
+            """,
+            (tag_id, parent),
+        )
+
+
+def subtree(cursor, user_id, tag_id: int) -> list[tuple[int, bool]]:
+    """(id, locked) of the tag and all of its descendants, or [] if the user has no such tag."""
+    cursor.execute(
+        """
+        SELECT t.id, t.locked FROM tag_closure c
+        JOIN tag t ON t.id = c.descendant
+        WHERE c.ancestor = ? AND t.user_id = ?
+        ORDER BY c.depth
+        """,
+        (tag_id, user_id),
+    )
+    rows = cursor.fetchall()
+    if not rows or rows[0][0] != tag_id:
+        return []
+    return [(row[0], bool(row[1])) for row in rows]
+
+
+def move_subtree(cursor, tag_id: int, new_parent: int | None) -> None:
+    """
+    Reparents a tag along with its subtree: the links between the subtree and its old
+    ancestors are removed, then every new ancestor is linked to every tag in the subtree.
+    The caller has to make sure new_parent isn't inside the subtree.
+    """
+    detach_subtree(cursor, tag_id)
+    attach_subtree(cursor, tag_id, new_parent)
+
+
+def detach_subtree(cursor, tag_id: int) -> None:
+    """The first half of move_subtree: the tag becomes a top-level tag, with its subtree."""
+    cursor.execute(
+        """
+        DELETE FROM tag_closure
+        WHERE descendant IN (SELECT descendant FROM tag_closure WHERE ancestor = ?)
+        AND ancestor NOT IN (SELECT descendant FROM tag_closure WHERE ancestor = ?)
+        """,
+        (tag_id, tag_id),
+    )
+    cursor.execute("UPDATE tag SET parent = NULL WHERE id = ?", (tag_id,))
+
+
+def attach_subtree(cursor, tag_id: int, new_parent: int | None) -> None:
+    """The second half of move_subtree, for a tag that is top-level (like after detach_subtree)."""
+    if new_parent is None:
+        return
+    cursor.execute(
+        """
+        INSERT INTO tag_closure (ancestor, descendant, depth)
+        SELECT above.ancestor, below.descendant, above.depth + below.depth + 1
+        FROM tag_closure above, tag_closure below
+        WHERE above.descendant = ? AND below.ancestor = ?
+        """,
+        (new_parent, tag_id),
+    )
+    cursor.execute("UPDATE tag SET parent = ? WHERE id = ?", (new_parent, tag_id))
+
+
+def add_tags(cursor, tags: list[tuple[int, int | None]]) -> None:
+    """
+    add_tag for many new tags at once, as (tag_id, parent) with every parent before its children.
+    The closure rows are worked out in Python (a new tag's ancestors are its parent's plus the
+    parent itself) and written with one executemany, instead of one INSERT ... SELECT per tag.
+    """
+    # (ancestor, depth) pairs of each tag, starting with the tag itself
+    ancestors: dict[int, list[tuple[int, int]]] = {}
+    new_ids = {tag_id for tag_id, _ in tags}
+    for parent in {parent for _, parent in tags if parent not in new_ids}:
+        if parent is None:
+            continue
+        cursor.execute(
+            "SELECT ancestor, depth FROM tag_closure WHERE descendant = ?", (parent,)
+        )
+        ancestors[parent] = cursor.fetchall()
+
+    rows = []
+    for tag_id, parent in tags:
+        above = [(tag_id, 0)]
+        if parent is not None:
+            above += [(ancestor, depth + 1) for ancestor, depth in ancestors[parent]]
+        ancestors[tag_id] = above
+        rows += [(ancestor, tag_id, depth) for ancestor, depth in above]
+    cursor.executemany(
+        "INSERT INTO tag_closure (ancestor, descendant, depth) VALUES (?, ?, ?)", rows
+    )
@@ -0,0 +1,281 @@
+import os
+import sys
+from array import array
+from collections import Counter
+from itertools import compress
+
+from backend.app.services.user_cache import UserCache
+
+"""
+A compact in-memory copy of the columns of a user's library that are sorted, filtered and counted,
+so browsing by popularity, duration or year doesn't go back to SQLite (or build TrackOut objects)
+for every request.
+
+Each column is a stdlib array (one machine number per track, no Python object per value),
+all in the same order: position i in every array is the same track. Text columns are interned:
+every distinct artist and album is stored once, and the tracks hold its number.
+- ids, duration_ms, popularity, year (0 when unknown), explicit, album
+- artists: a track can have several, so artist_start[i]:artist_start[i + 1] is the slice of
+  artist_ids that belongs to track i (and artist_owner maps each entry back to its track)
+Tracks are stored newest first, so sorting on another column keeps that order between ties.
+
+An index is built from one query the first time a user asks for it, and every write to the user's
+tracks invalidates it (see services/user_cache.py). Indexes are kept for the most recently used
+users, up to TRACK_INDEX_MAX_BYTES in total (64 MiB by default, 0 turns caching off, and every
+request builds its own). 10k tracks take roughly 400 KB, depending on how many distinct
+artists and albums there are. GET /track/index/stats reports the numbers of the caller's own index,
+and /metrics the totals of the cache.
+
+A value too big (or small) for its array, like a popularity of 200 from a client that doesn't know
+Spotify's are 0 to 100, is stored as the closest one that fits. The filters only go that far anyway.
+"""
+
+TRACK_INDEX_MAX_BYTES = int(os.environ.get("TRACK_INDEX_MAX_BYTES", str(64 << 20)))
+
+SORT_COLUMNS = ("added_at", "popularity", "duration_ms", "year")
+FACETS = ("artist", "album", "year", "explicit")
+
+
+def limits(typecode: str) -> tuple[int, int]:
+    """The smallest and largest number an array of this (signed integer) typecode holds."""
+    bits = array(typecode).itemsize * 8
+    return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+
+
+DURATION_LIMITS = limits("i")
+POPULARITY_LIMITS = limits("b")
+
+
+class TrackIndex:
+    def __init__(self, rows):
+        self.ids = array("q")
+        self.duration_ms = array("i")
+        self.popularity = array("b")
+        self.year = array("h")
+        self.explicit = array("b")
+        self.album = array("i")
+        self.artist_start = array("i", [0])
+        self.artist_ids = array("i")
+        self.artist_owner = array("i")
+        self.artist_names: list[str] = []
+        self.album_names: list[str] = []
+
+        artist_numbers: dict[str, int] = {}
+        album_numbers: dict[str, int] = {}
+        for (
+            track_id,
+            duration_ms,
+            popularity,
+            release_date,
+            explicit,
+            artists,
+            album_id,
+            album,
+        ) in rows:
+            self.ids.append(track_id)
+            self.duration_ms.append(
+                min(max(duration_ms, DURATION_LIMITS[0]), DURATION_LIMITS[1])
+            )
+            self.popularity.append(
+                min(max(popularity, POPULARITY_LIMITS[0]), POPULARITY_LIMITS[1])
+            )
+            # 4 ASCII digits always fit in the "h" array
+            year = release_date[:4]
+            self.year.append(int(year) if year.isascii() and year.isdigit() else 0)
+            self.explicit.append(1 if explicit else 0)
+
+            number = album_numbers.get(album_id)
+            if number is None:
+                number = album_numbers[album_id] = len(self.album_names)
+                self.album_names.append(album)
+            self.album.append(number)
+
+            for artist in artists.split(", ") if artists else ():
+                number = artist_numbers.get(artist)
+                if number is None:
+                    number = artist_numbers[artist] = len(self.artist_names)
+                    self.artist_names.append(artist)
+                self.artist_ids.append(number)
+                self.artist_owner.append(len(self.ids) - 1)
+            self.artist_start.append(len(self.artist_ids))
+
+        self._artist_numbers = artist_numbers
+        self._album_numbers = album_numbers
+        self.album_ids = list(album_numbers)
+        self.nbytes = self._measure()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _measure(self) -> int:
+        columns = (
+            self.ids,
+            self.duration_ms,
+            self.popularity,
+            self.year,
+            self.explicit,
+            self.album,
+            self.artist_start,
+            self.artist_ids,
+            self.artist_owner,
+        )
+        size = sum(column.itemsize * len(column) for column in columns)
+        # the interned strings, each counted once, plus the lists and dicts that find them
+        strings = self.artist_names + self.album_names + self.album_ids
+        size += sum(sys.getsizeof(string) for string in strings)
+        for container in (
+            self.artist_names,
+            self.album_names,
+            self.album_ids,
+            self._artist_numbers,
+            self._album_numbers,
+        ):
+            size += sys.getsizeof(container)
+        return size
+
+    def select(
+        self,
+        ranges: dict[str, tuple[int | None, int | None]],
+        explicit: bool | None = None,
+        artist: str | None = None,
+        album_id: str | None = None,
+    ) -> list[int]:
+        """
+        Positions of the tracks matching every filter, newest first.
+        ranges maps a column (duration_ms, popularity, year) to inclusive (low, high) bounds.
+        """
+        positions = range(len(self.ids))
+        for name, (low, high) in ranges.items():
+            column = getattr(self, name)
+            if low is not None and high is not None:
+                positions = [i for i in positions if low <= column[i] <= high]
+            elif low is not None:
+                positions = [i for i in positions if column[i] >= low]
+            elif high is not None:
+                positions = [i for i in positions if column[i] <= high]
+        if explicit is not None:
+            flag = 1 if explicit else 0
+            positions = [i for i in positions if self.explicit[i] == flag]
+        if album_id is not None:
+            number = self._album_numbers.get(album_id)
+            positions = [i for i in positions if self.album[i] == number]
+        if artist is not None:
+            number = self._artist_numbers.get(artist)
+            start, ids = self.artist_start, self.artist_ids
+            positions = [i for i in positions if number in ids[start[i] : start[i + 1]]]
+        return list(positions)
+
+    def sort(self, positions: list[int], sort_by: str, descending: bool) -> list[int]:
+        if sort_by == "added_at":
+            return positions[::-1] if not descending else positions
+        column = getattr(self, sort_by)
+        # sorted() is stable, also with reverse=True, so ties stay newest first
+        return sorted(positions, key=column.__getitem__, reverse=descending)
+
+    def facets(self, positions: list[int], names: list[str], limit: int) -> dict:
+        """The most common values among the positions, as [{"value", "count"}] per facet."""
+        # a byte per track saying whether it's selected, so the counting below runs in
+        # compress() and Counter instead of a Python loop
+        selected = bytearray(len(self.ids))
+        for i in positions:
+            selected[i] = 1
+
+        result = {}
+        for name in names:
+            if name == "artist":
+                owners = map(selected.__getitem__, self.artist_owner)
+                counts = Counter(compress(self.artist_ids, owners))
+                result[name] = [
+                    {"value": self.artist_names[value], "count": count}
+                    for value, count in counts.most_common(limit)
+                ]
+            elif name == "album":
+                counts = Counter(compress(self.album, selected))
+                result[name] = [
+                    {
+                        "value": self.album_names[value],
+                        "album_id": self.album_ids[value],
+                        "count": count,
+                    }
+                    for value, count in counts.most_common(limit)
+                ]
+            else:
+                counts = Counter(compress(getattr(self, name), selected))
+                result[name] = [
+                    {
+                        "value": bool(value) if name == "explicit" else value,
+                        "count": count,
+                    }
+                    for value, count in counts.most_common(limit)
+                ]
+        return result
+
+
+def build_index(cursor, user_id) -> TrackIndex:
+    cursor.execute(
+        """
+        SELECT
+            t.id, t.duration_ms, t.popularity, t.release_date, t.explicit, t.artists,
+            COALESCE(al.spotify_id, ''), COALESCE(al.name, '')
+        FROM track t
+        LEFT JOIN album al ON al.id = t.album_ref
+        WHERE t.user_id = ?
+        ORDER BY t.added_at DESC, t.id DESC
+        """,
+        (user_id,),
+    )
+    return TrackIndex(cursor)
+
+
+indexes = UserCache(
+    max_users=1024,
+    max_bytes=TRACK_INDEX_MAX_BYTES,
+    weigh=lambda index: index.nbytes,
+)
+
+
+def get_index(cursor, user_id) -> TrackIndex:
+    cached = indexes.get(user_id)
+    if cached is not None:
+        return cached[1]
+    token = indexes.start_build(user_id)
+    index = build_index(cursor, user_id)
+    if TRACK_INDEX_MAX_BYTES:
+        indexes.put(user_id, index, token)
+    return index
+
+
+def invalidate(user_id) -> None:
+    """Called after every committed write to the user's tracks."""
+    indexes.invalidate(user_id)
+
+
+def stats(cursor, user_id) -> dict:
+    """The size of the user's index (built if it isn't cached), and the cache's limit."""
+    index = get_index(cursor, user_id)
+    return {
+        "tracks": len(index),
+        "bytes": index.nbytes,
+        "bytes_per_10k_tracks": (
+            round(index.nbytes * 10_000 / len(index)) if len(index) else None
+        ),
+        "max_bytes": TRACK_INDEX_MAX_BYTES,
+    }
+
+
+def cache_gauges() -> list[tuple]:
+    """The totals of the cache for /metrics, see metrics.gauges."""
+    cached = indexes.stats()
+    return [
+        ("track_index_users", "Users with a cached track index.", cached["users"]),
+        (
+            "track_index_bytes",
+            "Memory taken by the cached track indexes.",
+            cached["bytes"],
+        ),
+        (
+            "track_index_tracks",
+            "Tracks in the cached track indexes.",
+            sum(len(index) for index in indexes.values()),
+        ),
+    ]
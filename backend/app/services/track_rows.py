@@ -0,0 +1,92 @@
+from backend.app.models.web.track import TrackOut
+from backend.app.services.albums_artists import album_details
+
+"""
+Reading tracks for the API: the columns read from the track table, and the JSON sent for them.
+The routers that send tracks (routers/web/track.py and catalog.py) share these.
+"""
+
+TRACK_FIELDS = (
+    "id",
+    "user_id",
+    "name",
+    "artists",
+    "album_ref",
+    "duration_ms",
+    "explicit",
+    "popularity",
+    "track_number",
+    "release_date",
+    "added_at",
+    "spotify_id",
+)
+
+TRACK_SELECT = f"SELECT {', '.join(TRACK_FIELDS)} FROM track"
+
+"""
+The track lists are sent as plain dicts built from the rows, in a FastJSONResponse
+(see services/fast_json.py), instead of a TrackOut per row. The dicts have the same keys as TrackOut.
+
+fields=name,artists (on /tracks, /filter, /search and /index) only sends those keys of each track
+(see parse_fields in routers/web/track.py).
+The album is in its own table (see services/albums_artists.py), and it isn't read at all when
+none of album, album_id and image is asked for.
+"""
+
+TRACK_OUT_FIELDS = tuple(TrackOut.model_fields)
+ALBUM_FIELDS = {"album", "album_id", "image"}
+
+
+def rows_to_json(rows, albums: dict, fields=TRACK_OUT_FIELDS) -> list[dict]:
+    """Dicts for TRACK_SELECT rows, albums is album_details() for their album_ref."""
+    tracks = []
+    for row in rows:
+        album_id, album_name, image = albums.get(row[4]) or ("", "", None)
+        track = {
+            "user_id": row[1],
+            "name": row[2],
+            "artists": row[3],
+            "album": album_name,
+            "album_id": album_id,
+            "duration_ms": row[5],
+            "explicit": bool(row[6]),
+            "popularity": row[7],
+            "track_number": row[8],
+            "release_date": row[9],
+            "added_at": row[10],
+            # stored as '' when the track had none
+            "image": image or None,
+            "spotify_id": row[11],
+            "id": row[0],
+        }
+        if fields is not TRACK_OUT_FIELDS:
+            track = {name: track[name] for name in fields}
+        tracks.append(track)
+    return tracks
+
+
+def albums_for(cursor, rows, fields=TRACK_OUT_FIELDS) -> dict:
+    """
+    The albums of the rows (one more query, instead of joining on every query),
+    or nothing when the fields don't include any album field.
+    """
+    if ALBUM_FIELDS.isdisjoint(fields):
+        return {}
+    return album_details(cursor, [row[4] for row in rows])
+
+
+def tracks_json(cursor, rows, fields=TRACK_OUT_FIELDS) -> list[dict]:
+    return rows_to_json(rows, albums_for(cursor, rows, fields), fields)
+
+
+def tracks_by_id(cursor, track_ids: list[int], fields=TRACK_OUT_FIELDS) -> list[dict]:
+    """The tracks with these ids, in the same order."""
+    if not track_ids:
+        return []
+    cursor.execute(
+        TRACK_SELECT + f" WHERE id IN ({', '.join('?' for _ in track_ids)})",
+        track_ids,
+    )
+    rows = {row[0]: row for row in cursor.fetchall()}
+    rows = [rows[track_id] for track_id in track_ids if track_id in rows]
+    return tracks_json(cursor, rows, fields)
@@ -0,0 +1,56 @@
+import re
+
+"""
+Full-text search over the user's tracks, with the track_fts index (an SQLite FTS5 table,
+see migration_7_track_fts and migration_9_track_fts_owner in database.py) instead of a
+LIKE '%...%' scan of every row.
+
+The search box text isn't passed to FTS5 as is, its query syntax (AND, NEAR, quotes, column:...)
+would turn typos into errors. It's split into words, and every word becomes a prefix term:
+"beat hel" finds "Here Comes the Sun" by "The Beatles" on "Help!".
+A track has to match every word, in any of the three columns.
+The index holds every user's tracks, so the query also matches the owner column (u<user_id>):
+FTS5 only returns the user's own tracks, and only those are joined to the track table.
+
+Results are ranked with bm25, where a match in the name counts more than one in the artists,
+which counts more than one in the album.
+"""
+
+# bm25 weights for the name, artists, album and owner columns (the owner is no match at all)
+COLUMN_WEIGHTS = (10.0, 5.0, 2.0, 0.0)
+MAX_TERMS = 16
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+# t.user_id is already matched by the owner column, it's checked again as a safeguard
+SEARCH = f"""
+    SELECT {{select}} FROM track_fts
+    JOIN track t ON t.id = track_fts.rowid
+    WHERE track_fts MATCH ? AND t.user_id = ?
+    ORDER BY bm25(track_fts, {", ".join(map(str, COLUMN_WEIGHTS))}), t.id
+    LIMIT ? OFFSET ?
+"""
+
+
+def match_query(text: str, user_id) -> str | None:
+    """The FTS5 query for what was typed, or None when there is nothing to search for."""
+    words = WORD.findall(text)[:MAX_TERMS]
+    if not words:
+        return None
+    # quoted, so a word like "and" or "near" is just a word
+    terms = " ".join(f'"{word}"*' for word in words)
+    return f"owner:u{int(user_id)} AND {{name artists album}}: ({terms})"
+
+
+def search(
+    cursor, user_id, text: str, select: str, limit: int, offset: int
+) -> list[tuple]:
+    """
+    Rows of `select` (columns of the track table, aliased t) for the best matches,
+    best first. Returns up to limit + 1 rows, the extra one tells whether there's another page.
+    """
+    query = match_query(text, user_id)
+    if query is None:
+        return []
+    cursor.execute(SEARCH.format(select=select), (query, user_id, limit + 1, offset))
+    return cursor.fetchall()
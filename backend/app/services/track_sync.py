@@ -0,0 +1,362 @@
+import itertools
+from datetime import datetime, timedelta
+
+from backend.app.models.web.track import TrackIn
+from backend.app.services import catalogs, library_stats, track_index
+from backend.app.services.albums_artists import set_track_artists, upsert_albums
+
+"""
+The sync engine compares the tracks sent by the client with the tracks already stored,
+and only writes the difference. A saved track is identified by (user_id, added_at),
+the same key as the UNIQUE constraint on the track table.
+
+- a key that isn't stored yet is inserted
+- a stored key whose columns changed is updated in place, so it keeps its id
+  (and every track_tag row pointing at it)
+- a stored key that isn't in the library anymore is deleted
+
+Albums and artists live in their own tables (see services/albums_artists.py), they're written
+first, and the track rows only hold the album's id.
+
+Every write is done with executemany, and the caller decides when to commit,
+so a whole sync runs in one transaction.
+"""
+
+# the columns a client can set, in the order used by every query below
+TRACK_COLUMNS = (
+    "added_at",
+    "name",
+    "artists",
+    "album_ref",
+    "duration_ms",
+    "explicit",
+    "popularity",
+    "track_number",
+    "release_date",
+    "spotify_id",
+)
+
+ARTISTS = TRACK_COLUMNS.index("artists")
+ALBUM_REF = TRACK_COLUMNS.index("album_ref")
+
+INSERT_TRACK = f"""
+    INSERT INTO track (user_id, {", ".join(TRACK_COLUMNS)})
+    VALUES (?, {", ".join("?" for _ in TRACK_COLUMNS)})
+"""
+
+UPDATE_TRACK = f"""
+    UPDATE track SET {", ".join(f"{column} = ?" for column in TRACK_COLUMNS[1:])}
+    WHERE id = ?
+"""
+
+# SQLite allows 32766 parameters per statement, stay well below it
+IN_BATCH_SIZE = 500
+
+
+def track_values(track: TrackIn, album_ref: int) -> tuple:
+    """The TRACK_COLUMNS values of a track, in the same types SQLite returns them."""
+    return (
+        track.added_at,
+        track.name,
+        track.artists,
+        album_ref,
+        track.duration_ms,
+        int(track.explicit),
+        track.popularity,
+        track.track_number,
+        track.release_date,
+        track.spotify_id,
+    )
+
+
+def incoming_values(cursor, tracks: list[TrackIn], counts: dict) -> tuple[dict, set]:
+    """
+    Maps added_at -> TRACK_COLUMNS values, after writing the tracks' albums.
+    Also returns the album_refs whose name or image the write changed.
+    """
+    album_refs, changed_albums = upsert_albums(cursor, tracks)
+    counts["albums_updated"] += len(changed_albums)
+    incoming = {
+        track.added_at: track_values(track, album_refs[track.album_id])
+        for track in tracks
+    }
+    return incoming, changed_albums
+
+
+def empty_counts() -> dict:
+    return {
+        "inserted": 0,
+        "updated": 0,
+        "deleted": 0,
+        "unchanged": 0,
+        "albums_updated": 0,
+    }
+
+
+def stored_tracks(cursor, user_id, added_at: list[str] | None = None) -> dict:
+    """
+    Maps added_at -> (id, values) for the user's stored tracks.
+    With added_at given, only those keys are read (in batches), otherwise the whole library.
+    """
+    select = f"SELECT id, {', '.join(TRACK_COLUMNS)} FROM track WHERE user_id = ?"
+    stored = {}
+    if added_at is None:
+        cursor.execute(select, (user_id,))
+        for row in cursor:
+            stored[row[1]] = (row[0], tuple(row[1:]))
+        return stored
+
+    for i in range(0, len(added_at), IN_BATCH_SIZE):
+        batch = added_at[i : i + IN_BATCH_SIZE]
+        cursor.execute(
+            select + f" AND added_at IN ({', '.join('?' for _ in batch)})",
+            (user_id, *batch),
+        )
+        for row in cursor:
+            stored[row[1]] = (row[0], tuple(row[1:]))
+    return stored
+
+
+def upsert_tracks(cursor, user_id, tracks: list[TrackIn], counts: dict) -> None:
+    """
+    Inserts new tracks and updates changed ones, leaving unchanged rows untouched.
+    Only the stored rows with the same keys are read, so this works chunk by chunk.
+    """
+    incoming, changed_albums = incoming_values(cursor, tracks, counts)
+    stored = stored_tracks(cursor, user_id, list(incoming))
+    apply_diff(cursor, user_id, incoming, stored, counts, changed_albums)
+
+
+def apply_diff(
+    cursor, user_id, incoming: dict, stored: dict, counts: dict, changed_albums=()
+) -> None:
+    """
+    Writes the difference between the incoming and the stored tracks. A track whose row is the
+    same but whose album was just renamed or got a new cover (changed_albums) counts as updated.
+    """
+    inserts = []
+    updates = []
+    changed_artists = []
+    album_updates = 0
+    for key, values in incoming.items():
+        existing = stored.get(key)
+        if existing is None:
+            inserts.append((user_id, *values))
+        elif existing[1] != values:
+            updates.append((*values[1:], existing[0]))
+            if existing[1][ARTISTS] != values[ARTISTS]:
+                changed_artists.append((existing[0], values[ARTISTS]))
+        elif values[ALBUM_REF] in changed_albums:
+            album_updates += 1
+        else:
+            counts["unchanged"] += 1
+
+    if inserts:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM track")
+        last_id = cursor.fetchone()[0]
+        cursor.executemany(INSERT_TRACK, inserts)
+        cursor.execute(
+            "SELECT id, artists FROM track WHERE id > ? AND user_id = ?",
+            (last_id, user_id),
+        )
+        set_track_artists(cursor, cursor.fetchall(), replace=False)
+        # new tracks can belong in the user's catalogs (removed ones leave with their rows)
+        catalogs.refresh(cursor, user_id, after_track_id=last_id)
+    if updates:
+        cursor.executemany(UPDATE_TRACK, updates)
+        set_track_artists(cursor, changed_artists, replace=True)
+    counts["inserted"] += len(inserts)
+    counts["updated"] += len(updates) + album_updates
+
+
+def delete_tracks(cursor, track_ids: list[int]) -> int:
+    """Deletes tracks by id, along with the rows that reference them."""
+    rows = [(track_id,) for track_id in track_ids]
+    cursor.executemany("DELETE FROM track_tag WHERE track_id = ?", rows)
+    cursor.executemany("DELETE FROM track_artist WHERE track_id = ?", rows)
+    cursor.executemany("DELETE FROM catalog_track_log WHERE track_id = ?", rows)
+    cursor.executemany("DELETE FROM track WHERE id = ?", rows)
+    return len(rows)
+
+
+def sync_library(cursor, user_id, tracks: list[TrackIn]) -> dict:
+    """
+    Full sync: the tracks given are the user's whole library.
+    Reads the stored library once, then writes only what changed.
+    """
+    counts = empty_counts()
+    incoming, changed_albums = incoming_values(cursor, tracks, counts)
+    stored = stored_tracks(cursor, user_id)
+
+    apply_diff(cursor, user_id, incoming, stored, counts, changed_albums)
+
+    removed = [track_id for key, (track_id, _) in stored.items() if key not in incoming]
+    counts["deleted"] = delete_tracks(cursor, removed)
+    return counts
+
+
+"""
+Streaming syncs see the library one chunk at a time, so they can't diff against the whole
+stored library. Instead, the key of every track seen is written to a temporary table,
+and once the stream ends the stored tracks that weren't seen are deleted.
+Memory use depends on the chunk size, not the size of the library.
+
+Each sync gets its own id in the table, because the writes of several syncs can be interleaved
+on the same connection (the writer connection in backend/async_database.py).
+Other writes can run between the chunks too, like POST /track/ adding a track the stream
+will never contain. So only the tracks that were already stored when the sync started
+(up to the last track id at that point, kept in sync_start) can be deleted.
+The caller runs delete_unseen in a BEGIN IMMEDIATE transaction, so the tracks it picks are the
+ones it deletes.
+"""
+
+sync_ids = itertools.count(1)
+
+
+def start_seen_keys(cursor) -> int:
+    """Returns the id to pass to the other seen key functions."""
+    cursor.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS sync_seen (
+            sync_id INTEGER,
+            added_at TEXT,
+            PRIMARY KEY (sync_id, added_at)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS sync_start (
+            sync_id INTEGER PRIMARY KEY,
+            last_track_id INTEGER NOT NULL
+        )
+        """
+    )
+    sync_id = next(sync_ids)
+    cursor.execute(
+        "INSERT INTO sync_start SELECT ?, COALESCE(MAX(id), 0) FROM track", (sync_id,)
+    )
+    return sync_id
+
+
+def mark_seen(cursor, sync_id: int, added_at: list[str]) -> None:
+    cursor.executemany(
+        "INSERT OR IGNORE INTO sync_seen (sync_id, added_at) VALUES (?, ?)",
+        [(sync_id, key) for key in added_at],
+    )
+
+
+def delete_unseen(cursor, user_id, sync_id: int) -> int:
+    cursor.execute(
+        """
+        SELECT id FROM track
+        WHERE user_id = ?
+            AND id <= (SELECT last_track_id FROM sync_start WHERE sync_id = ?)
+            AND added_at NOT IN (SELECT added_at FROM sync_seen WHERE sync_id = ?)
+        """,
+        (user_id, sync_id, sync_id),
+    )
+    return delete_tracks(cursor, [row[0] for row in cursor.fetchall()])
+
+
+def end_seen_keys(cursor, sync_id: int) -> None:
+    cursor.execute("DELETE FROM sync_seen WHERE sync_id = ?", (sync_id,))
+    cursor.execute("DELETE FROM sync_start WHERE sync_id = ?", (sync_id,))
+
+
+"""
+Incremental syncs. Spotify lists saved tracks newest first, so most syncs only need the few tracks
+at the head of the list. sync_state keeps, per user:
+- watermark: the newest added_at stored, a delta sync only has to send tracks newer than it
+- last_full_sync: a delta sync can't see removed tracks, so a full sync is due every
+  FULL_SYNC_INTERVAL (or sooner, when the library size doesn't add up)
+- skipped_items: the library size Spotify reported at the last full sync, minus the tracks stored.
+  Spotify counts local files and unavailable tracks, which aren't stored, and saves that share an
+  added_at are stored once. Those don't change between syncs, so as long as nothing was removed,
+  Spotify's size minus the stored tracks stays the same (see library_matches)
+"""
+
+FULL_SYNC_INTERVAL = timedelta(days=7)
+
+
+def sync_state(cursor, user_id) -> dict:
+    cursor.execute(
+        """
+        SELECT watermark, last_sync, last_full_sync, skipped_items
+        FROM sync_state WHERE user_id = ?
+        """,
+        (user_id,),
+    )
+    row = cursor.fetchone() or (None, None, None, None)
+    cursor.execute("SELECT COUNT(*) FROM track WHERE user_id = ?", (user_id,))
+    track_count = cursor.fetchone()[0]
+
+    full_sync_due = row[2] is None or (
+        datetime.fromisoformat(row[2]) + FULL_SYNC_INTERVAL < datetime.utcnow()
+    )
+    return {
+        "watermark": row[0],
+        "last_sync": row[1],
+        "last_full_sync": row[2],
+        "skipped_items": row[3],
+        "track_count": track_count,
+        "full_sync_due": full_sync_due,
+    }
+
+
+def library_matches(state: dict, total: int) -> bool:
+    """
+    Whether the library size Spotify reports (total) adds up with the stored tracks, meaning
+    nothing was removed since the last full sync. False when that sync didn't know the size.
+    Adding a local file also makes it False, which only costs a full sync.
+    """
+    skipped = state["skipped_items"]
+    return skipped is not None and total - state["track_count"] == skipped
+
+
+def record_sync(cursor, user_id, full: bool, total: int | None = None) -> None:
+    """
+    Moves the watermark to the newest stored track, and stamps the sync time.
+    A full sync also records skipped_items, from the library size Spotify reported (total).
+    """
+    now = datetime.utcnow().isoformat(sep=" ", timespec="seconds")
+    cursor.execute(
+        """
+        INSERT INTO sync_state (user_id, watermark, last_sync, last_full_sync, skipped_items)
+        SELECT ?, MAX(added_at), ?, ?, ? - COUNT(*) FROM track WHERE user_id = ?
+        ON CONFLICT(user_id) DO UPDATE SET
+            watermark = excluded.watermark,
+            last_sync = excluded.last_sync,
+            last_full_sync = COALESCE(excluded.last_full_sync, last_full_sync),
+            skipped_items = CASE WHEN excluded.last_full_sync IS NULL
+                THEN skipped_items ELSE excluded.skipped_items END
+        """,
+        (user_id, now, now if full else None, total if full else None, user_id),
+    )
+
+
+def prune_to_keys(cursor, user_id, added_at: list[str]) -> int:
+    """
+    Removal check: given just the added_at keys of the whole library (much smaller than the
+    tracks themselves), deletes the stored tracks that aren't in it anymore.
+    """
+    sync_id = start_seen_keys(cursor)
+    try:
+        mark_seen(cursor, sync_id, added_at)
+        return delete_unseen(cursor, user_id, sync_id)
+    finally:
+        end_seen_keys(cursor, sync_id)
+
+
+def tracks_changed(user_id, albums_changed: bool = False) -> None:
+    """
+    Drops what's cached about the user's tracks, called after every committed track write.
+    albums_changed: the write renamed an album or gave it a new cover. Albums are shared, and
+    other users' cached indexes and stats hold the old name too, so every user's are dropped.
+    """
+    if albums_changed:
+        track_index.indexes.invalidate_all()
+        library_stats.stats_cache.invalidate_all()
+        return
+    track_index.invalidate(user_id)
+    library_stats.invalidate(user_id)
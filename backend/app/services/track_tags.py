@@ -0,0 +1,88 @@
+"""
+Applying and removing tags on many tracks at once.
+The track ids are loaded into a temporary table with one executemany, and then each tag is
+applied with a single INSERT ... SELECT over that table. The UNIQUE (track_id, tag_id) index
+makes a tag that's already on a track a no-op, so sending the same request twice is safe.
+Tracks that don't belong to the user are skipped by the join with the track table.
+
+The caller commits, so a whole request is one transaction.
+"""
+
+
+class UnknownTagsError(Exception):
+    def __init__(self, tag_ids: list[int]):
+        super().__init__(f"Tags not found: {tag_ids}")
+        self.tag_ids = tag_ids
+
+
+def check_tags(cursor, user_id, tag_ids: list[int]) -> None:
+    cursor.execute(
+        f"""
+        SELECT id FROM tag
+        WHERE user_id = ? AND id IN ({", ".join("?" for _ in tag_ids)})
+        """,
+        (user_id, *tag_ids),
+    )
+    found = {row[0] for row in cursor.fetchall()}
+    missing = [tag_id for tag_id in tag_ids if tag_id not in found]
+    if missing:
+        raise UnknownTagsError(missing)
+
+
+def load_track_ids(cursor, track_ids: list[int]) -> None:
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS bulk_track (id INTEGER PRIMARY KEY)"
+    )
+    cursor.execute("DELETE FROM bulk_track")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO bulk_track (id) VALUES (?)",
+        [(track_id,) for track_id in track_ids],
+    )
+
+
+def apply_tags(cursor, user_id, track_ids: list[int], tag_ids: list[int]) -> dict:
+    """Returns {tag_id: number of tracks that newly got the tag}."""
+    tag_ids = list(dict.fromkeys(tag_ids))
+    if not tag_ids:
+        return {}
+    check_tags(cursor, user_id, tag_ids)
+    load_track_ids(cursor, track_ids)
+
+    applied = {}
+    for tag_id in tag_ids:
+        # "WHERE true" is how SQLite tells the SELECT apart from the ON CONFLICT clause
+        cursor.execute(
+            """
+            INSERT INTO track_tag (track_id, tag_id, is_tagged)
+            SELECT b.id, ?, TRUE FROM bulk_track b
+            JOIN track t ON t.id = b.id AND t.user_id = ?
+            WHERE true
+            ON CONFLICT(track_id, tag_id) DO NOTHING
+            """,
+            (tag_id, user_id),
+        )
+        applied[tag_id] = cursor.rowcount
+    cursor.execute("DELETE FROM bulk_track")
+    return applied
+
+
+def remove_tags(cursor, user_id, track_ids: list[int], tag_ids: list[int]) -> dict:
+    """Returns {tag_id: number of tracks the tag was removed from}."""
+    tag_ids = list(dict.fromkeys(tag_ids))
+    if not tag_ids:
+        return {}
+    check_tags(cursor, user_id, tag_ids)
+    load_track_ids(cursor, track_ids)
+
+    removed = {}
+    for tag_id in tag_ids:
+        cursor.execute(
+            """
+            DELETE FROM track_tag
+            WHERE tag_id = ? AND track_id IN (SELECT id FROM bulk_track)
+            """,
+            (tag_id,),
+        )
+        removed[tag_id] = cursor.rowcount
+    cursor.execute("DELETE FROM bulk_track")
+    return removed
@@ -0,0 +1,125 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+"""
+A small in-process cache with one entry per user, for results that are expensive to build
+and only change when the user writes something (like the tag tree).
+
+- the write paths call invalidate(user_id) after committing, so the next read rebuilds the entry
+- only the most recently used max_users entries are kept (LRU), and with max_bytes and a
+  weigh(value) function, only as many as fit in max_bytes
+- every entry gets a new version string when it's built, which works as an HTTP ETag:
+  it starts with a random id for this process, so a restarted server never reuses one
+
+Reads go like this:
+
+    token = cache.start_build(user_id)
+    value = build_from_database()
+    version = cache.put(user_id, value, token)
+
+If the user was invalidated while the value was being built, put() doesn't store it,
+so a write can never be hidden by a value read just before it.
+
+The cache lives in one server process. With several worker processes each one has its own,
+and invalidations only reach the process that handled the write.
+"""
+
+BOOT_ID = os.urandom(4).hex()
+
+
+class UserCache:
+    def __init__(self, max_users: int = 256, max_bytes: int | None = None, weigh=None):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._weigh = weigh
+        self._entries: OrderedDict = OrderedDict()
+        self._sizes: dict = {}
+        self._bytes = 0
+        self._counter = itertools.count(1)
+        # when each user was last invalidated, bounded like the entries;
+        # users that fell out count as invalidated at _forgotten
+        self._invalidated: OrderedDict = OrderedDict()
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> tuple[str, object] | None:
+        """(version, value) for the user, or None when it has to be built."""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def start_build(self, user_id) -> int:
+        with self._lock:
+            return next(self._counter)
+
+    def put(self, user_id, value, token: int) -> str:
+        """Stores the value built since start_build() and returns its version."""
+        key = str(user_id)
+        with self._lock:
+            version = f"{BOOT_ID}-{next(self._counter)}"
+            if self._invalidated.get(key, self._forgotten) > token:
+                return version
+            size = self._weigh(value) if self._weigh else 0
+            if self.max_bytes is not None and size > self.max_bytes:
+                return version
+            self._remove(key)
+            self._entries[key] = (version, value)
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._entries) > self.max_users or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+            return version
+
+    def invalidate(self, user_id) -> None:
+        key = str(user_id)
+        with self._lock:
+            self._remove(key)
+            self._invalidated[key] = next(self._counter)
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_users * 4:
+                _, stamp = self._invalidated.popitem(last=False)
+                self._forgotten = max(self._forgotten, stamp)
+
+    def invalidate_all(self) -> None:
+        """invalidate() for every user, for writes to data that all users share."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            self._invalidated.clear()
+            self._forgotten = next(self._counter)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def values(self) -> list:
+        with self._lock:
+            return [value for _, value in self._entries.values()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._entries), "bytes": self._bytes}
+
+    def _remove(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._bytes -= self._sizes.pop(key)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header names this ETag (a version from put(), quoted)."""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or any(
+        value.removeprefix("W/") == etag for value in candidates
+    )
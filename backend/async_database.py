@@ -0,0 +1,116 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backend import database
+
+"""
+Async access to the database, so an async endpoint never waits on SQLite itself.
+The sqlite3 module blocks the thread that calls it, and in an async endpoint that thread is the
+event loop, which would stall every other request until the query is done.
+
+- await db.read(fn, *args) runs fn(conn, *args) on a reader thread, with a pooled connection.
+  Reads run in parallel (up to the pool size), and thanks to WAL they don't wait for writes.
+- await db.write(fn, *args) queues fn(conn, *args) for the single writer thread, which has its own
+  connection. SQLite allows one writer at a time anyway, so writes wait their turn in the queue
+  instead of fighting over the file lock. If fn leaves a transaction open it's committed,
+  and if fn raises it's rolled back.
+- db.write_blocking(fn, *args) is the same for code that runs on a thread (background jobs).
+
+fn is a plain function that uses the connection like any other code in the app,
+for example run_sync(conn, user_id, tracks, ...) in routers/web/track.py.
+"""
+
+
+class Writer:
+    """One thread and one connection that run every write, in the order they were queued."""
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="db-writer", daemon=True
+                )
+                self._thread.start()
+            self._queue.put((fn, args, future))
+        return future
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join()
+
+    def _run(self) -> None:
+        conn = None
+        conn_path = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                # reopened if the app was pointed at another database (database.configure_pool)
+                if conn is None or conn_path != database.DATABASE_PATH:
+                    if conn is not None:
+                        conn.close()
+                    conn_path = database.DATABASE_PATH
+                    conn = database.get_connection(conn_path)
+                try:
+                    result = fn(conn, *args)
+                    if conn.in_transaction:
+                        conn.commit()
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    raise
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        if conn is not None:
+            conn.close()
+
+
+class AsyncDatabase:
+    def __init__(self, readers: int = database.DATABASE_POOL_SIZE):
+        self.writer = Writer()
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers, thread_name_prefix="db-reader"
+        )
+
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._read, fn, args)
+
+    async def write(self, fn, *args):
+        return await asyncio.wrap_future(self.writer.submit(fn, *args))
+
+    def write_blocking(self, fn, *args):
+        return self.writer.submit(fn, *args).result()
+
+    def close(self) -> None:
+        self.writer.close()
+
+    @staticmethod
+    def _read(fn, args):
+        with database.pool.connection() as conn:
+            return fn(conn, *args)
+
+
+db = AsyncDatabase()
@@ -1,8 +1,16 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
 from jose import JWTError, jwt
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
 
+from backend.async_database import db
+
 SECRET_KEY = "your-secret-key"  # Hardcoded temporarily
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
@@ -33,18 +41,118 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 The header of a request contains the token, extracted by HTTPBearer.
 The token is decoded with the same key and algorithm.
 If the token is valid, the user_id is returned.
+
+Checking the signature costs more than most queries the app runs, and a client paging through its
+tracks sends the same token every time. So verified tokens are remembered (by their SHA-256 hash,
+the tokens themselves aren't kept) along with the user_id, and a token that's been seen is only
+checked for expiry. An entry is kept until the token expires, but at most TOKEN_CACHE_TTL seconds,
+and only the TOKEN_CACHE_SIZE most recently used tokens are kept. Tokens that fail are never cached.
 """
 
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_TTL = 300
+
+
+class TokenCache:
+    def __init__(
+        self, max_tokens: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL
+    ):
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self._entries: OrderedDict[bytes, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes):
+        """The user_id of a cached token that hasn't expired, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, valid_until = entry
+            if time.time() >= valid_until:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user_id
+
+    def put(self, key: bytes, user_id, expires_at: float) -> None:
+        if not self.max_tokens:
+            return
+        with self._lock:
+            self._entries[key] = (user_id, min(expires_at, time.time() + self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_tokens:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def verify_token(token: str):
+    """The user_id in a valid token, raises a 401 HTTPException otherwise."""
+    key = hashlib.sha256(token.encode()).digest()
+    user_id = token_cache.get(key)
+    if user_id is not None:
+        return user_id
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> str:
-    token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-        return user_id
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    user_id = payload.get("user_id")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    # jwt.decode already rejects expired tokens, the cache has to stop at exp too
+    expires_at = payload.get("exp")
+    token_cache.put(key, user_id, float(expires_at) if expires_at else float("inf"))
+    return user_id
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> str:
+    return verify_token(credentials.credentials)
+
+
+"""
+The user of the current request, for endpoints that need the user's row and not just the id.
+FastAPI runs a dependency once per request, so every use of Depends(get_user_context) in one
+request (in the endpoint and in other dependencies) gets the same UserContext, and the row is
+read at most once:
+
+    async def endpoint(user: UserContext = Depends(get_user_context)):
+        row = await user.row()
+"""
+
+
+class UserContext:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._row: dict | None = None
+        self._loaded = False
+
+    async def row(self) -> dict | None:
+        """The user's row as a dict (id, spotify_id, date_created), or None if there's no such user."""
+        if not self._loaded:
+            self._row = await db.read(self._read)
+            self._loaded = True
+        return self._row
+
+    def _read(self, conn) -> dict | None:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, spotify_id, date_created FROM user WHERE id = ?",
+            (self.user_id,),
+        )
+        user = cursor.fetchone()
+        if user is None:
+            return None
+        return {"id": user[0], "spotify_id": user[1], "date_created": user[2]}
+
+
+def get_user_context(user_id=Depends(get_current_user)) -> UserContext:
+    return UserContext(user_id)
@@ -1,23 +1,148 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+
+from backend import metrics
 
 """
 EXPLANATION:
 This app uses a SQLite database to store user data, tracks, tags, and catalogs.
 SQLite is easy to use, requiring minimal setup (with no server), sufficient for this app.
 This file contains the functions used to work with the database.
+
+Opening a connection and setting it up costs more than most of the queries the app runs,
+so connections are kept in a pool and reused between requests. Routers don't use them
+directly: db.read runs a query on a pooled connection (see async_database.py).
+
+The database file and pool size can be set with the DATABASE_PATH and DATABASE_POOL_SIZE
+environment variables.
 """
 
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "database.sqlite3")
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = 5000
+
 
-def get_connection():
-    conn = sqlite3.connect("database.sqlite3")
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Settings applied once per connection:
+    - WAL lets readers keep reading while a sync is writing, instead of locking the whole file
+    - synchronous=NORMAL is safe with WAL and skips an fsync on every commit
+    - cache_size (negative means KiB) and mmap_size keep the hot pages of the library in memory
+    - busy_timeout makes a connection wait for a lock instead of failing right away
+    """
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -20000")
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 
-def create_tables():
-    conn = get_connection()
-    cursor = conn.cursor()
+def get_connection(path: str | None = None) -> sqlite3.Connection:
+    """A new connection that isn't part of the pool, for startup and scripts."""
+    conn = sqlite3.connect(
+        path or DATABASE_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        # pooled connections are handed from thread to thread, but only one request uses them at a time
+        check_same_thread=False,
+        # times every statement, see metrics.py
+        factory=metrics.TimedConnection if metrics.ENABLED else sqlite3.Connection,
+    )
+    return configure_connection(conn)
+
+
+class ConnectionPool:
+    """
+    Keeps up to `size` open connections. Connections are only opened when needed,
+    and when all of them are in use, acquire() waits for one to be released.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float | None = 30) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return get_connection(self.path)
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No database connection available")
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        # never hand out a connection in the middle of someone else's transaction
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
 
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+pool = ConnectionPool(DATABASE_PATH, DATABASE_POOL_SIZE)
+
+
+def configure_pool(path: str | None = None, size: int | None = None) -> ConnectionPool:
+    """Points the app at another database file or pool size (used by scripts and benchmarks)."""
+    global pool, DATABASE_PATH
+    pool.close()
+    if path is not None:
+        DATABASE_PATH = path
+    pool = ConnectionPool(DATABASE_PATH, size or DATABASE_POOL_SIZE)
+    return pool
+
+
+"""
+MIGRATIONS:
+The schema is built by a list of migrations, applied in order. The number of migrations
+already applied is stored in the database itself (PRAGMA user_version), so on startup only
+the new ones run, and an up-to-date database costs a single PRAGMA read.
+
+To change the schema, add a new migration function to the end of MIGRATIONS.
+Never edit or reorder one that has already shipped.
+"""
+
+
+def migration_1_base_tables(cursor):
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS user (
@@ -151,5 +276,488 @@ def create_tables():
         """
     )
 
-    conn.commit()
-    conn.close()
+
+def migration_2_indexes(cursor):
+    """
+    Indexes for the ways the routers read each table. track already has the UNIQUE
+    (user_id, added_at) index; SQLite keeps the rowid (track.id) at the end of every index,
+    so these also serve the (column, id) ordering used by keyset pagination.
+    """
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_track_user_name ON track(user_id, name)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_track_user_spotify ON track(user_id, spotify_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tag_user_parent ON tag(user_id, parent)"
+    )
+    # the recursive descendants CTE walks parent -> children
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tag_parent_user ON tag(parent, user_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_track_tag_track ON track_tag(track_id, tag_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_track_tag_tag ON track_tag(tag_id, track_id)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_catalog_user ON catalog(user_id)")
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_catalog_track_log_next
+        ON catalog_track_log(catalog_id, completed, catalog_index)
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_track_log_track ON catalog_track_log(track_id)"
+    )
+    for table in ("catalog_track_filter", "catalog_tag_filter"):
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_catalog ON {table}(catalog_id)"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_tag ON {table}(tag_id)")
+
+
+def migration_3_unique_track_tag(cursor):
+    """A track can only have a tag once, which makes applying a tag twice a no-op."""
+    cursor.execute(
+        """
+        DELETE FROM track_tag WHERE id NOT IN (
+            SELECT MIN(id) FROM track_tag GROUP BY track_id, tag_id
+        )
+        """
+    )
+    # the unique index replaces the plain (track_id, tag_id) one
+    cursor.execute("DROP INDEX IF EXISTS idx_track_tag_track")
+    cursor.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_track_tag_unique
+        ON track_tag(track_id, tag_id)
+        """
+    )
+
+
+def migration_4_tag_closure(cursor):
+    """
+    tag_closure has one row for every (ancestor, descendant) pair in the tag tree,
+    including each tag with itself at depth 0. Finding a subtree is then a single
+    index lookup on ancestor instead of a recursive walk. It's kept up to date by the
+    tag router (see services/tag_tree.py).
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tag_closure (
+            ancestor INTEGER NOT NULL,
+            descendant INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor, descendant),
+            FOREIGN KEY (ancestor) REFERENCES tag(id) ON DELETE CASCADE,
+            FOREIGN KEY (descendant) REFERENCES tag(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_tag_closure_descendant
+        ON tag_closure(descendant, depth)
+        """
+    )
+    # the depth limit only guards against a parent cycle someone made by hand
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO tag_closure (ancestor, descendant, depth)
+        WITH RECURSIVE pairs(ancestor, descendant, depth) AS (
+            SELECT id, id, 0 FROM tag
+            UNION ALL
+            SELECT p.ancestor, t.id, p.depth + 1
+            FROM tag t
+            JOIN pairs p ON t.parent = p.descendant
+            WHERE p.depth < 1000
+        )
+        SELECT ancestor, descendant, depth FROM pairs
+        """
+    )
+
+
+def migration_5_catalog_track_log_unique(cursor):
+    """A track is in a catalog's log at most once, so refreshing can't add it twice."""
+    cursor.execute(
+        """
+        DELETE FROM catalog_track_log WHERE id NOT IN (
+            SELECT MIN(id) FROM catalog_track_log GROUP BY catalog_id, track_id
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_catalog_track_log_unique
+        ON catalog_track_log(catalog_id, track_id)
+        """
+    )
+
+
+def migration_6_sync_state(cursor):
+    """Per-user sync bookkeeping for incremental syncs (see services/track_sync.py)."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            user_id INTEGER PRIMARY KEY,
+            watermark TEXT,
+            last_sync TIMESTAMP,
+            last_full_sync TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(id)
+        )
+        """
+    )
+
+
+def migration_7_track_fts(cursor):
+    """
+    Full-text index over track name, artists and album (see services/track_search.py).
+    It's an external content table: the text stays in the track table, and track_fts only holds
+    the index, kept up to date by the triggers below in the same transaction as the write.
+    prefix='2 3' adds indexes for 2 and 3 letter prefixes, so search-as-you-type stays fast.
+    """
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS track_fts USING fts5(
+            name, artists, album,
+            content = 'track',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS track_fts_insert AFTER INSERT ON track BEGIN
+            INSERT INTO track_fts (rowid, name, artists, album)
+            VALUES (new.id, new.name, new.artists, new.album);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS track_fts_delete AFTER DELETE ON track BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album)
+            VALUES ('delete', old.id, old.name, old.artists, old.album);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS track_fts_update
+        AFTER UPDATE OF name, artists, album ON track BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album)
+            VALUES ('delete', old.id, old.name, old.artists, old.album);
+            INSERT INTO track_fts (rowid, name, artists, album)
+            VALUES (new.id, new.name, new.artists, new.album);
+        END
+        """
+    )
+    # index the tracks that are already stored
+    cursor.execute("INSERT INTO track_fts (track_fts) VALUES ('rebuild')")
+
+
+def migration_8_album_artist_tables(cursor):
+    """
+    Albums and artists get their own tables, instead of being repeated on every track:
+    - album: one row per Spotify album (name and cover image), tracks point at it with album_ref.
+      The album, album_id and image columns are removed from track.
+    - artist and track_artist: one row per artist name, and which artists are on which track
+      (position keeps their order). track.artists stays, as the text shown and searched.
+    Albums and artists are shared by every user, they're the same Spotify data for everyone.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS album (
+            id INTEGER PRIMARY KEY,
+            spotify_id TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            image TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS artist (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS track_artist (
+            track_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            artist_id INTEGER NOT NULL,
+            PRIMARY KEY (track_id, position),
+            FOREIGN KEY (track_id) REFERENCES track(id),
+            FOREIGN KEY (artist_id) REFERENCES artist(id)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_track_artist_artist ON track_artist(artist_id, track_id)"
+    )
+
+    # move the album columns out of track
+    cursor.execute(
+        "ALTER TABLE track ADD COLUMN album_ref INTEGER REFERENCES album(id)"
+    )
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO album (spotify_id, name, image)
+        SELECT album_id, MAX(album), MAX(image) FROM track GROUP BY album_id
+        """
+    )
+    cursor.execute(
+        "UPDATE track SET album_ref = (SELECT id FROM album WHERE spotify_id = track.album_id)"
+    )
+    # idx_track_album finds an album's tracks (when it's renamed), idx_track_user_album counts
+    # a user's tracks per album without reading the tracks themselves
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_track_album ON track(album_ref)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_track_user_album ON track(user_id, album_ref)"
+    )
+
+    # split the existing artists text into artist and track_artist rows
+    cursor.execute(
+        """
+        CREATE TEMP TABLE migration_artist_split AS
+        WITH RECURSIVE artist_split (track_id, position, rest, artist) AS (
+            SELECT id, -1, artists || ', ', NULL FROM track
+            UNION ALL
+            SELECT
+                track_id,
+                position + 1,
+                substr(rest, instr(rest, ', ') + 2),
+                substr(rest, 1, instr(rest, ', ') - 1)
+            FROM artist_split WHERE rest <> ''
+        )
+        SELECT track_id, position, artist FROM artist_split WHERE position >= 0
+        """
+    )
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO artist (name)
+        SELECT DISTINCT artist FROM migration_artist_split
+        """
+    )
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO track_artist (track_id, position, artist_id)
+        SELECT s.track_id, s.position, a.id
+        FROM migration_artist_split s JOIN artist a ON a.name = s.artist
+        """
+    )
+    cursor.execute("DROP TABLE temp.migration_artist_split")
+
+    # the search index now reads the album name through a view
+    for trigger in ("track_fts_insert", "track_fts_delete", "track_fts_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS track_fts")
+    for column in ("album", "album_id", "image"):
+        cursor.execute(f"ALTER TABLE track DROP COLUMN {column}")
+
+    cursor.execute(
+        """
+        CREATE VIEW IF NOT EXISTS track_text AS
+        SELECT t.id, t.name, t.artists, COALESCE(al.name, '') AS album
+        FROM track t LEFT JOIN album al ON al.id = t.album_ref
+        """
+    )
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS track_fts USING fts5(
+            name, artists, album,
+            content = 'track_text',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """
+    )
+    album_name = "COALESCE((SELECT name FROM album WHERE id = {}.album_ref), '')"
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS track_fts_insert AFTER INSERT ON track BEGIN
+            INSERT INTO track_fts (rowid, name, artists, album)
+            VALUES (new.id, new.name, new.artists, {album_name.format("new")});
+        END
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS track_fts_delete AFTER DELETE ON track BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album)
+            VALUES ('delete', old.id, old.name, old.artists, {album_name.format("old")});
+        END
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS track_fts_update
+        AFTER UPDATE OF name, artists, album_ref ON track BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album)
+            VALUES ('delete', old.id, old.name, old.artists, {album_name.format("old")});
+            INSERT INTO track_fts (rowid, name, artists, album)
+            VALUES (new.id, new.name, new.artists, {album_name.format("new")});
+        END
+        """
+    )
+    # a renamed album changes the indexed text of all of its tracks
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS track_fts_album_rename
+        AFTER UPDATE OF name ON album BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album)
+            SELECT 'delete', id, name, artists, old.name FROM track WHERE album_ref = new.id;
+            INSERT INTO track_fts (rowid, name, artists, album)
+            SELECT id, name, artists, new.name FROM track WHERE album_ref = new.id;
+        END
+        """
+    )
+    cursor.execute("INSERT INTO track_fts (track_fts) VALUES ('rebuild')")
+
+
+def migration_9_track_fts_owner(cursor):
+    """
+    The search index gets an owner column, the token 'u' || user_id of the track's user, so a
+    search matches owner:u<user_id> inside FTS5 and only reads the user's own matches, instead of
+    every user's matches being joined to track and then dropped by the user_id check.
+    FTS5 can't add a column, so the index, its view and its triggers are made again.
+    """
+    for trigger in (
+        "track_fts_insert",
+        "track_fts_delete",
+        "track_fts_update",
+        "track_fts_album_rename",
+    ):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS track_fts")
+    cursor.execute("DROP VIEW IF EXISTS track_text")
+
+    cursor.execute(
+        """
+        CREATE VIEW track_text AS
+        SELECT t.id, t.name, t.artists, COALESCE(al.name, '') AS album, 'u' || t.user_id AS owner
+        FROM track t LEFT JOIN album al ON al.id = t.album_ref
+        """
+    )
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE track_fts USING fts5(
+            name, artists, album, owner,
+            content = 'track_text',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """
+    )
+    # the indexed values of the new or old track row
+    row = (
+        "{0}.id, {0}.name, {0}.artists, "
+        "COALESCE((SELECT name FROM album WHERE id = {0}.album_ref), ''), 'u' || {0}.user_id"
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER track_fts_insert AFTER INSERT ON track BEGIN
+            INSERT INTO track_fts (rowid, name, artists, album, owner)
+            VALUES ({row.format("new")});
+        END
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER track_fts_delete AFTER DELETE ON track BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album, owner)
+            VALUES ('delete', {row.format("old")});
+        END
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER track_fts_update
+        AFTER UPDATE OF name, artists, album_ref, user_id ON track BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album, owner)
+            VALUES ('delete', {row.format("old")});
+            INSERT INTO track_fts (rowid, name, artists, album, owner)
+            VALUES ({row.format("new")});
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER track_fts_album_rename
+        AFTER UPDATE OF name ON album BEGIN
+            INSERT INTO track_fts (track_fts, rowid, name, artists, album, owner)
+            SELECT 'delete', id, name, artists, old.name, 'u' || user_id
+            FROM track WHERE album_ref = new.id;
+            INSERT INTO track_fts (rowid, name, artists, album, owner)
+            SELECT id, name, artists, new.name, 'u' || user_id
+            FROM track WHERE album_ref = new.id;
+        END
+        """
+    )
+    cursor.execute("INSERT INTO track_fts (track_fts) VALUES ('rebuild')")
+
+
+def migration_10_sync_state_skipped_items(cursor):
+    """
+    How many of the items Spotify counts in the library aren't stored as tracks (local files,
+    unavailable tracks, saves sharing an added_at), as of the last full sync that knew the
+    library size. See library_matches in services/track_sync.py.
+    """
+    cursor.execute("ALTER TABLE sync_state ADD COLUMN skipped_items INTEGER")
+
+
+MIGRATIONS = [
+    migration_1_base_tables,
+    migration_2_indexes,
+    migration_3_unique_track_tag,
+    migration_4_tag_closure,
+    migration_5_catalog_track_log_unique,
+    migration_6_sync_state,
+    migration_7_track_fts,
+    migration_8_album_artist_tables,
+    migration_9_track_fts_owner,
+    migration_10_sync_state_skipped_items,
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn) -> int:
+    """Applies the migrations the database hasn't seen yet, each in its own transaction."""
+    cursor = conn.cursor()
+    while schema_version(conn) < len(MIGRATIONS):
+        # IMMEDIATE takes the write lock first, so two servers starting at once
+        # can't both apply the same migration
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                break
+            MIGRATIONS[version](cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+def create_tables():
+    conn = get_connection()
+    try:
+        run_migrations(conn)
+    finally:
+        conn.close()
@@ -1,8 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
+from backend import database, metrics
+from backend.async_database import db
 from backend.database import create_tables
-from backend.app.routers.web import user, tag, track
+from backend.app.routers.web import user, tag, track, catalog, job
+from backend.app.services import track_index
 
 
 """
@@ -21,14 +25,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 """
 Routers are used to organize the API endpoints.
 In theory, you can include all API endpoints (or routes) in one file. It'd be long.
 """
-app.include_router(user.router, prefix="/user")
-app.include_router(tag.router, prefix="/tag")
-app.include_router(track.router, prefix="/track")
+ROUTERS = (
+    (user.router, "/user"),
+    (tag.router, "/tag"),
+    (track.router, "/track"),
+    (catalog.router, "/catalog"),
+    (job.router, "/jobs"),
+)
+for router, prefix in ROUTERS:
+    app.include_router(router, prefix=prefix)
+    # a route only knows its path within its router, the metrics are by full path
+    for route in router.routes:
+        metrics.route_paths[id(route)] = prefix + route.path
 
 
 @app.on_event("startup")
@@ -36,6 +51,47 @@ def startup():
     create_tables()
 
 
+@app.on_event("shutdown")
+def shutdown():
+    db.close()
+    database.pool.close()
+
+
 @app.get("/")
 def root():
     return {"message": "Backend is working!"}
+
+
+"""
+Request and SQL timings in the Prometheus text format, see metrics.py.
+"""
+
+metrics.gauges.append(
+    lambda: [
+        (
+            "db_writer_queue_depth",
+            "Writes waiting for the database writer thread.",
+            db.writer.pending(),
+        ),
+        (
+            "db_pool_open_connections",
+            "Connections the pool has opened.",
+            database.pool._opened,
+        ),
+    ]
+)
+metrics.gauges.append(track_index.cache_gauges)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+if metrics.SLOW_QUERIES_ENDPOINT:
+
+    @app.get("/metrics/slow-queries")
+    def get_slow_queries():
+        return list(metrics.slow_queries)
@@ -0,0 +1,366 @@
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+"""
+Built-in instrumentation, so it's possible to see where a request's time goes.
+Everything is kept in memory in this process and served by GET /metrics in the Prometheus text
+format (see main.py). Set METRICS=0 to turn all of it off.
+
+- MetricsMiddleware times every request, by method, route (the path template, like
+  /tag/{tag_id}, so ids don't make a new series each) and status code.
+- Every connection from database.get_connection is a TimedConnection, whose cursors time each
+  statement (from execute() until its last row is fetched) by statement type
+  (SELECT, INSERT, ...) and count the rows fetched.
+- Statements slower than SLOW_QUERY_MS are logged with their EXPLAIN QUERY PLAN to the
+  "backend.sql" logger, and the last SLOW_QUERY_LOG_SIZE of them are kept in slow_queries.
+  The statements are SQL from the code, but they show the schema, so they're only served by
+  GET /metrics/slow-queries when METRICS_SLOW_QUERIES=1 is set.
+
+The numbers are histograms with fixed buckets, so recording one is a bisect and two additions.
+The overhead is a few microseconds per request and per statement.
+"""
+
+ENABLED = os.environ.get("METRICS", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = 100
+SLOW_QUERIES_ENDPOINT = os.environ.get("METRICS_SLOW_QUERIES", "0") == "1"
+# rows are read ITER_BATCH_SIZE at a time when a cursor is iterated, so iteration can be timed
+ITER_BATCH_SIZE = 256
+
+REQUEST_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+QUERY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    1,
+)
+
+logger = logging.getLogger("backend.sql")
+
+
+class Histogram:
+    """A Prometheus histogram: how many observations fell in each bucket, per set of labels."""
+
+    def __init__(self, name: str, help: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [count in each bucket (the last one is +Inf), sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._series.items()
+            ]
+        for labels, counts, total in sorted(series):
+            label_text = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                bucket_labels = (
+                    f"{label_text[:-1]},{le}}}" if label_text else f"{{{le}}}"
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, labels: tuple, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(
+                f"{self.name}{format_labels(self.label_names, labels)} {value}"
+            )
+        return lines
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = (f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to the end of its response.",
+    ("method", "route", "status"),
+    REQUEST_BUCKETS,
+)
+query_seconds = Histogram(
+    "sqlite_query_duration_seconds",
+    "Time of an SQL statement, from execute() until its last row was fetched.",
+    ("statement",),
+    QUERY_BUCKETS,
+)
+rows_fetched = Counter(
+    "sqlite_rows_fetched_total", "Rows fetched from SQL statements.", ("statement",)
+)
+slow_queries_total = Counter(
+    "sqlite_slow_queries_total",
+    f"Statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms).",
+    ("statement",),
+)
+slow_queries: deque = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+# id of a route -> its full path, for routes in routers included with a prefix (filled in by main.py)
+route_paths: dict = {}
+
+# extra lines for /metrics, added by other modules: functions returning [(name, help, value)]
+gauges: list = []
+
+
+def render() -> str:
+    lines = []
+    for metric in (request_seconds, query_seconds, rows_fetched, slow_queries_total):
+        lines += metric.render()
+    for gauge in gauges:
+        for name, help, value in gauge():
+            lines += [
+                f"# HELP {name} {help}",
+                f"# TYPE {name} gauge",
+                f"{name} {value}",
+            ]
+    return "\n".join(lines) + "\n"
+
+
+"""
+The connection and cursor classes. A statement is recorded when it's done: when its rows run out,
+when the cursor runs another statement, or when the cursor is closed.
+"""
+
+
+def statement_type(sql: str) -> str:
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+class TimedCursor(sqlite3.Cursor):
+    _sql: str | None = None
+    _params = None
+    _elapsed = 0.0
+    _rows = 0
+
+    def execute(self, sql, parameters=(), /):
+        self._finish()
+        self._sql, self._params, self._rows = sql, parameters, 0
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+
+    def executemany(self, sql, seq_of_parameters, /):
+        self._finish()
+        if isinstance(seq_of_parameters, (list, tuple)):
+            # the first set of parameters, for EXPLAIN QUERY PLAN if it's slow
+            params = seq_of_parameters[0] if seq_of_parameters else None
+        else:
+            params = None
+        self._sql, self._params, self._rows = sql, params, 0
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+            self._finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        # in batches, so the time is measured per batch instead of per row
+        while True:
+            rows = self.fetchmany(ITER_BATCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    # statements read with a single fetchone() are recorded when the cursor goes away.
+    # That can be on any thread, in the middle of anything the connection is doing,
+    # so a slow one is recorded without its plan instead of running EXPLAIN from here.
+    def __del__(self):
+        self._finish(explain=False)
+
+    def _finish(self, explain: bool = True) -> None:
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        kind = statement_type(sql)
+        query_seconds.observe((kind,), self._elapsed)
+        if self._rows:
+            rows_fetched.add((kind,), self._rows)
+        if self._elapsed * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(
+                self.connection if explain else None,
+                kind,
+                sql,
+                self._params,
+                self._elapsed,
+            )
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute() makes its cursor without calling cursor(), so it's redone here
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def log_slow_query(conn, kind: str, sql: str, params, elapsed: float) -> None:
+    """Records a slow statement, with its plan when conn is given to run EXPLAIN on."""
+    plan = None
+    if (
+        conn is not None
+        and kind in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+        and params is not None
+    ):
+        try:
+            # a plain cursor, so the EXPLAIN isn't timed itself
+            cursor = sqlite3.Connection.cursor(conn)
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[3] for row in cursor.fetchall()]
+            cursor.close()
+        except sqlite3.Error:
+            pass
+
+    slow_queries_total.add((kind,))
+    entry = {
+        "at": time.time(),
+        "ms": round(elapsed * 1000, 2),
+        "sql": " ".join(sql.split()),
+        "plan": plan,
+    }
+    slow_queries.append(entry)
+    logger.warning(
+        "slow query (%.1f ms): %s\n  plan: %s",
+        entry["ms"],
+        entry["sql"],
+        "; ".join(plan) if plan else "unavailable",
+    )
+
+
+class MetricsMiddleware:
+    """ASGI middleware that adds each HTTP request to request_seconds."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            # the router puts the matched route in the scope
+            route = scope.get("route")
+            path = route_paths.get(id(route)) or getattr(route, "path", "unmatched")
+            request_seconds.observe(
+                (scope["method"], path, status),
+                time.perf_counter() - start,
+            )
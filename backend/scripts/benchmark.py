@@ -0,0 +1,404 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from backend import database
+from backend.app.services.tag_hierarchy import hierarchy_cache
+from backend.app.services import tag_tree
+from backend.auth import create_access_token
+from backend.main import app
+
+"""
+Benchmarks the backend's hot paths, so a change can be measured instead of guessed at.
+
+It creates a fresh database in a temporary directory, generates synthetic users, and sends
+requests to the FastAPI app in this process (with TestClient, so no server or network is needed):
+- sync_tracks: the first sync of a whole library, a sync where nothing changed and one where 1% did
+- get_tracks: walking the library with cursor pages, pages at random offsets (start/end),
+  and the whole library at once
+- get_tags_hierarchy: built from the database (cold), from the cache (warm), and a 304
+- delete_tag: deleting single leaf tags, and whole subtrees
+The tag scenarios run on two trees of the same size, a deep one (long chains of tags)
+and a wide one (every tag has many children).
+
+For every scenario it reports the number of requests, throughput, p50/p99/max latency and the
+process's peak RSS so far (which includes the generated libraries themselves), as JSON. Save the output of two commits and compare them:
+    python -m backend.scripts.benchmark --output before.json
+    (change something)
+    python -m backend.scripts.benchmark --compare before.json
+
+Run from the repository root. --sizes sets the library sizes (1k to 200k tracks work, bigger ones
+take a while and need memory for the generated library), see --help for the rest.
+Setup (generating and inserting data) isn't timed.
+"""
+
+DEFAULT_SIZES = [1_000, 10_000, 50_000]
+DEFAULT_TAGS = 2_000
+DEEP_CHAIN_LENGTH = 50
+WIDE_FANOUT = 40
+# enough for a wide tree to have a child of the root with children of its own
+MIN_TAGS = WIDE_FANOUT + 2
+PAGE_SIZE = 100
+MAX_PAGES = 200
+
+
+def generate_tracks(count: int, user_id: int, seed: int = 0) -> list[dict]:
+    """A library of TrackIn dicts: albums of ~10 tracks, artists on ~5 tracks, newest first."""
+    rng = random.Random(seed)
+    first_save = datetime(2015, 1, 1, tzinfo=timezone.utc)
+    albums = max(count // 10, 1)
+    artists = max(count // 5, 2)
+    tracks = []
+    for index in range(count):
+        album = rng.randrange(albums)
+        names = rng.sample(range(artists), rng.choice((1, 1, 1, 2)))
+        added_at = first_save + timedelta(hours=index)
+        tracks.append(
+            {
+                "user_id": user_id,
+                "name": f"Track {index} {rng.randrange(10**6)}",
+                "artists": ", ".join(f"Artist {artist}" for artist in names),
+                "album": f"Album {album}",
+                "album_id": f"album{album:08d}",
+                "duration_ms": rng.randrange(60_000, 420_000),
+                "explicit": rng.random() < 0.2,
+                "popularity": rng.randrange(101),
+                "track_number": rng.randrange(1, 15),
+                "release_date": f"{1960 + album % 65}-01-01",
+                "added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "image": f"https://example.com/album/{album}.jpg",
+                "spotify_id": f"fake{index:010d}",
+            }
+        )
+    return tracks[::-1]
+
+
+def tree_parents(count: int, shape: str) -> list[int | None]:
+    """
+    The parent (as a position in the list) of each of count tags, parents before children.
+    deep: chains of DEEP_CHAIN_LENGTH tags. wide: every tag has WIDE_FANOUT children.
+    """
+    if shape == "deep":
+        return [None if i % DEEP_CHAIN_LENGTH == 0 else i - 1 for i in range(count)]
+    return [None] + [(i - 1) // WIDE_FANOUT for i in range(1, count)]
+
+
+def create_user(conn, name: str) -> int:
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO user (spotify_id) VALUES (?)", (name,))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def create_tag_tree(conn, user_id: int, count: int, shape: str, seed: int = 0):
+    """
+    Inserts the tags (and tags 5 random tracks with each of them).
+    Returns (ids of leaf tags, ids of tags to delete whole subtrees of). The subtrees are the
+    chains of a deep tree, and the children of the root of a wide one, the ones with children.
+    A subtree always has children, so no tag is in both lists (deleting one can't make the
+    other 404), and deleting leaves first leaves the subtrees in place.
+    """
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM track WHERE user_id = ?", (user_id,))
+    track_ids = [row[0] for row in cursor.fetchall()]
+    parents = tree_parents(count, shape)
+    ids: list[int] = []
+    cursor.execute("BEGIN")
+    for i, parent in enumerate(parents):
+        parent_id = None if parent is None else ids[parent]
+        cursor.execute(
+            "INSERT INTO tag (user_id, name, type, parent, locked) VALUES (?, ?, ?, ?, 0)",
+            (user_id, f"{shape} {i}", "genre", parent_id),
+        )
+        ids.append(cursor.lastrowid)
+        tag_tree.add_tag(cursor, ids[-1], parent_id)
+        cursor.executemany(
+            "INSERT OR IGNORE INTO track_tag (track_id, tag_id) VALUES (?, ?)",
+            [(track_id, ids[-1]) for track_id in rng.sample(track_ids, 5)],
+        )
+    conn.commit()
+    has_children = {parent for parent in parents if parent is not None}
+    leaves = [ids[i] for i in range(count) if i not in has_children]
+    top = None if shape == "deep" else 0
+    subtrees = [
+        ids[i]
+        for i, parent in enumerate(parents)
+        if parent == top and i in has_children
+    ]
+    return leaves, subtrees
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def run(results: list, scenario: str, calls, before=None, **info) -> dict:
+    """
+    Times each call (a function sending one request) and adds a result.
+    before, if given, runs untimed before every call (like dropping a cache).
+    """
+    latencies = []
+    for call in calls:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        response = call()
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f"{scenario}: {response.status_code} {response.text[:200]}"
+            )
+
+    latencies.sort()
+    total = sum(latencies)
+    result = {
+        "scenario": scenario,
+        **info,
+        "requests": len(latencies),
+        "seconds": round(total, 4),
+        "throughput_rps": round(len(latencies) / total, 1) if total else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    results.append(result)
+    print(
+        f"{scenario:<32} {json.dumps(info):<34} "
+        f"p50 {result['p50_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms  "
+        f"{result['throughput_rps']:>8} req/s  rss {result['peak_rss_mb']} MB",
+        file=sys.stderr,
+    )
+    return result
+
+
+def bench_tracks(client, conn, results: list, size: int, repeat: int, seed: int):
+    user_id = create_user(conn, f"bench-tracks-{size}")
+    headers = {
+        "Authorization": "Bearer " + create_access_token({"user_id": user_id}),
+        "Content-Type": "application/json",
+    }
+    tracks = generate_tracks(size, user_id, seed)
+    # encoded up front, so the timings don't include the client's JSON encoding
+    body = json.dumps(tracks).encode()
+    sync = lambda content: lambda: client.post(
+        "/track/sync-tracks", content=content, headers=headers
+    )
+
+    info = {"tracks": size}
+    run(results, "sync_tracks initial", [sync(body)], **info)
+    run(results, "sync_tracks unchanged", [sync(body)] * repeat, **info)
+
+    rng = random.Random(seed)
+    changed = {}
+
+    def change_tracks():
+        for track in rng.sample(tracks, max(size // 100, 1)):
+            track["popularity"] = (track["popularity"] + 1) % 101
+        changed["body"] = json.dumps(tracks).encode()
+
+    run(
+        results,
+        "sync_tracks 1% changed",
+        [lambda: sync(changed["body"])()] * repeat,
+        before=change_tracks,
+        **info,
+    )
+    del body, changed, tracks
+
+    # cursor pages, each request depends on the one before
+    state = {"cursor": None}
+
+    def next_page():
+        params = {"limit": PAGE_SIZE}
+        if state["cursor"]:
+            params["cursor"] = state["cursor"]
+        response = client.get("/track/tracks", params=params, headers=headers)
+        state["cursor"] = response.json()["next_cursor"]
+        return response
+
+    pages = min(math.ceil(size / PAGE_SIZE), MAX_PAGES)
+    run(results, "get_tracks cursor pages", [next_page] * pages, **info)
+
+    starts = [rng.randrange(size) for _ in range(pages)]
+    run(
+        results,
+        "get_tracks offset pages",
+        [
+            lambda start=start: client.get(
+                "/track/tracks",
+                params={"start": start, "end": start + PAGE_SIZE, "sort_by": "name"},
+                headers=headers,
+            )
+            for start in starts
+        ],
+        **info,
+    )
+    run(
+        results,
+        "get_tracks whole library",
+        [lambda: client.get("/track/tracks", headers=headers)] * repeat,
+        **info,
+    )
+
+
+def bench_tags(client, conn, results: list, shape: str, tags: int, repeat: int):
+    user_id = create_user(conn, f"bench-tags-{shape}")
+    headers = {"Authorization": "Bearer " + create_access_token({"user_id": user_id})}
+    # a small library for the tags to be applied to
+    tracks = generate_tracks(1_000, user_id)
+    response = client.post("/track/sync-tracks", json=tracks, headers=headers)
+    response.raise_for_status()
+    leaves, subtrees = create_tag_tree(conn, user_id, tags, shape)
+
+    info = {"tags": tags, "shape": shape}
+    hierarchy = lambda: client.get("/tag/tags_hierarchy", headers=headers)
+    run(
+        results,
+        "get_tags_hierarchy cold",
+        [hierarchy] * repeat,
+        before=lambda: hierarchy_cache.invalidate(str(user_id)),
+        **info,
+    )
+    run(results, "get_tags_hierarchy warm", [hierarchy] * repeat, **info)
+    etag = hierarchy().headers["ETag"]
+    run(
+        results,
+        "get_tags_hierarchy 304",
+        [
+            lambda: client.get(
+                "/tag/tags_hierarchy", headers={**headers, "If-None-Match": etag}
+            )
+        ]
+        * repeat,
+        **info,
+    )
+
+    delete = lambda tag_id: lambda: client.delete(f"/tag/{tag_id}", headers=headers)
+    run(
+        results,
+        "delete_tag leaf",
+        [delete(tag_id) for tag_id in leaves[:repeat]],
+        **info,
+    )
+    run(
+        results,
+        "delete_tag subtree",
+        [delete(tag_id) for tag_id in subtrees[:repeat]],
+        **info,
+    )
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline_path: str) -> None:
+    """Prints how each p50/p99 changed against a saved run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(result):
+        return tuple(
+            result.get(name) for name in ("scenario", "tracks", "tags", "shape")
+        )
+
+    old = {key(result): result for result in baseline["results"]}
+    print(f"\ncompared with {baseline['meta'].get('commit')}:", file=sys.stderr)
+    for result in results:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        changes = "  ".join(
+            f"{name} {before[name]:.2f} -> {result[name]:.2f} ms "
+            f"({(result[name] / before[name] - 1) * 100 if before[name] else 0:+.0f}%)"
+            for name in ("p50_ms", "p99_ms")
+        )
+        label = " ".join(str(part) for part in key(result) if part is not None)
+        print(f"{label:<44} {changes}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the backend's hot paths.")
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_SIZES,
+        help="library sizes in tracks, comma separated (default 1000,10000,50000)",
+    )
+    parser.add_argument("--tags", type=int, default=DEFAULT_TAGS)
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="requests per repeated scenario"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="a previous --output to compare with")
+    args = parser.parse_args()
+    if args.tags < MIN_TAGS:
+        parser.error(f"--tags has to be at least {MIN_TAGS}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.configure_pool(os.path.join(directory, "benchmark.sqlite3"))
+        results: list = []
+        with TestClient(app) as client:
+            conn = database.get_connection()
+            try:
+                for size in args.sizes:
+                    bench_tracks(client, conn, results, size, args.repeat, args.seed)
+                for shape in ("deep", "wide"):
+                    bench_tags(client, conn, results, shape, args.tags, args.repeat)
+            finally:
+                conn.close()
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+from backend.app.services import library_backup, library_stats, track_search
+from backend.database import get_connection, run_migrations
+
+"""
+Checks that the queries the routers run are served by an index.
+It builds an empty database with every migration applied, runs EXPLAIN QUERY PLAN on each
+query below, and fails if SQLite would read a whole table ("SCAN <table>" without an index).
+Scans of CTEs, virtual tables and temporary b-trees don't count, as they only touch rows
+already found.
+
+Run from the repository root:
+    python -m backend.scripts.check_query_plans
+
+When a router gets a new query, add it here.
+"""
+
+# names (and aliases) of CTEs and subqueries in the queries below, which are allowed to be scanned
+CTE_NAMES = {"top"}
+
+QUERIES = {
+    "track: get_tracks by added_at": (
+        "SELECT * FROM track WHERE user_id = ? ORDER BY added_at DESC, id DESC LIMIT ?",
+        (1, 10),
+    ),
+    "track: get_tracks by name": (
+        "SELECT * FROM track WHERE user_id = ? ORDER BY name ASC, id ASC LIMIT ?",
+        (1, 10),
+    ),
+    "track: get_tracks next page by added_at": (
+        """
+        SELECT * FROM track WHERE user_id = ? AND (added_at, id) < (?, ?)
+        ORDER BY added_at DESC, id DESC LIMIT ?
+        """,
+        (1, "", 0, 10),
+    ),
+    "track: get_tracks next page by name": (
+        """
+        SELECT * FROM track WHERE user_id = ? AND (name, id) > (?, ?)
+        ORDER BY name ASC, id ASC LIMIT ?
+        """,
+        (1, "", 0, 10),
+    ),
+    "track: search": (
+        track_search.SEARCH.format(select="t.id"),
+        (track_search.match_query("a", 1), 1, 10, 0),
+    ),
+    "track: sync stored library": ("SELECT * FROM track WHERE user_id = ?", (1,)),
+    "track: sync stored keys": (
+        "SELECT * FROM track WHERE user_id = ? AND added_at IN (?, ?)",
+        (1, "", ""),
+    ),
+    "track: sync album ids": (
+        "SELECT spotify_id, id FROM album WHERE spotify_id IN (?, ?)",
+        ("", ""),
+    ),
+    "track: sync artist ids": (
+        "SELECT name, id FROM artist WHERE name IN (?, ?)",
+        ("", ""),
+    ),
+    "track: sync new tracks' artists": (
+        "SELECT id, artists FROM track WHERE id > ? AND user_id = ?",
+        (0, 1),
+    ),
+    "track: albums of a page": (
+        "SELECT id, spotify_id, name, image FROM album WHERE id IN (?, ?)",
+        (1, 2),
+    ),
+    "track: sync delete track_artist": (
+        "DELETE FROM track_artist WHERE track_id = ?",
+        (1,),
+    ),
+    "track: sync delete track_tag": ("DELETE FROM track_tag WHERE track_id = ?", (1,)),
+    "track: sync delete catalog_track_log": (
+        "DELETE FROM catalog_track_log WHERE track_id = ?",
+        (1,),
+    ),
+    "tag: get_tags": (
+        "SELECT id, name, type, parent, locked FROM tag WHERE user_id = ?",
+        (1,),
+    ),
+    "tag: get_tag": (
+        "SELECT id, name, type, locked FROM tag WHERE user_id = ? AND id = ?",
+        (1, 1),
+    ),
+    "tag: subtree from closure": (
+        """
+        SELECT t.id, t.locked FROM tag_closure c
+        JOIN tag t ON t.id = c.descendant
+        WHERE c.ancestor = ? AND t.user_id = ?
+        ORDER BY c.depth
+        """,
+        (1, 1),
+    ),
+    "tag: add to closure": (
+        "SELECT ancestor, depth + 1 FROM tag_closure WHERE descendant = ?",
+        (1,),
+    ),
+    "tag: import new ids": (
+        "SELECT id FROM tag WHERE id > ? AND user_id = ? ORDER BY id",
+        (0, 1),
+    ),
+    "tag: ancestors of a parent": (
+        "SELECT ancestor, depth FROM tag_closure WHERE descendant = ?",
+        (1,),
+    ),
+    "tag: move, the user's tree": (
+        "SELECT id, parent, locked FROM tag WHERE user_id = ?",
+        (1,),
+    ),
+    "tag: copy subtrees": (
+        """
+        SELECT c.ancestor, t.id, t.name, t.type, t.parent, t.locked FROM tag_closure c
+        JOIN tag t ON t.id = c.descendant
+        WHERE c.ancestor IN (?, ?) AND t.user_id = ?
+        ORDER BY c.ancestor, c.depth
+        """,
+        (1, 2, 1),
+    ),
+    "tag: copy track_tag": (
+        "SELECT track_id, ?, is_tagged FROM track_tag WHERE tag_id = ?",
+        (2, 1),
+    ),
+    "tag: tags_hierarchy": (
+        """
+        SELECT t.id, MAX(c.depth) AS depth FROM tag t
+        JOIN tag_closure c ON c.descendant = t.id
+        WHERE t.user_id = ? GROUP BY t.id ORDER BY depth, t.id
+        """,
+        (1,),
+    ),
+    "track: filter by tag expression": (
+        """
+        SELECT * FROM track WHERE user_id = ? AND id IN (
+            SELECT tt.track_id FROM tag_closure c
+            JOIN track_tag tt ON tt.tag_id = c.descendant
+            WHERE c.ancestor IN (?, ?)
+        ) ORDER BY added_at DESC, id DESC LIMIT ?
+        """,
+        (1, 1, 2, 10),
+    ),
+    "tag: tracks with a tag": (
+        "SELECT track_id FROM track_tag WHERE tag_id = ?",
+        (1,),
+    ),
+    "catalog: next uncompleted track": (
+        """
+        SELECT track_id FROM catalog_track_log
+        WHERE catalog_id = ? AND completed = 0 ORDER BY catalog_index LIMIT 1
+        """,
+        (1,),
+    ),
+    "stats: top artists": (
+        library_stats.ARTIST_COUNTS,
+        {"user_id": 1, "top": 10},
+    ),
+    "stats: top albums": (library_stats.ALBUM_COUNTS, {"user_id": 1, "top": 10}),
+    "stats: release years": (library_stats.YEAR_COUNTS, {"user_id": 1}),
+    "stats: tag counts": (library_stats.TAG_COUNTS, {"user_id": 1}),
+    "user: export tags": (library_backup.EXPORT_TAGS, (1,)),
+    "user: export tracks": (library_backup.EXPORT_TRACKS, (1,)),
+    "user: current": (
+        "SELECT id, spotify_id, date_created FROM user WHERE id = ?",
+        (1,),
+    ),
+    "user: login": ("SELECT id FROM user WHERE spotify_id = ?", ("",)),
+}
+
+
+def full_scans(conn: sqlite3.Connection, sql: str, params) -> list[str]:
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    scans = []
+    for _, _, _, detail in plan:
+        words = detail.split()
+        if (
+            words[:1] == ["SCAN"]
+            and len(words) > 1
+            and words[1] not in CTE_NAMES
+            and "USING" not in words
+            and "VIRTUAL" not in words
+        ):
+            scans.append(detail)
+    return scans
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        conn = get_connection(os.path.join(directory, "plans.sqlite3"))
+        run_migrations(conn)
+        failed = 0
+        for name, (sql, params) in QUERIES.items():
+            scans = full_scans(conn, sql, params)
+            if scans:
+                failed += 1
+                print(f"FULL SCAN  {name}: {'; '.join(scans)}")
+            else:
+                print(f"ok         {name}")
+        conn.close()
+
+    print(f"\n{len(QUERIES) - failed}/{len(QUERIES)} queries use an index")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
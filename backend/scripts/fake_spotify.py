@@ -0,0 +1,96 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+"""
+A local stand-in for the part of the Spotify Web API the backend uses (GET /v1/me/tracks),
+for testing the server-side sync without a Spotify account or rate limits.
+
+Run it next to the backend and point the backend at it:
+    uvicorn backend.scripts.fake_spotify:app --port 8001
+    SPOTIFY_API_BASE=http://localhost:8001/v1 uvicorn backend.main:app
+
+Settings (environment variables):
+    FAKE_SPOTIFY_TRACKS       size of the generated library (default 1000)
+    FAKE_SPOTIFY_SEED         seed for the generated library (default 0)
+    FAKE_SPOTIFY_RATE_LIMIT   answer every Nth request with 429 and Retry-After: 1 (default 0, off)
+
+Any bearer token is accepted. POST /v1/fake/save adds new tracks at the head of the library,
+like saving songs in the Spotify app, to try incremental syncs.
+"""
+
+TRACK_COUNT = int(os.environ.get("FAKE_SPOTIFY_TRACKS", "1000"))
+SEED = int(os.environ.get("FAKE_SPOTIFY_SEED", "0"))
+RATE_LIMIT_EVERY = int(os.environ.get("FAKE_SPOTIFY_RATE_LIMIT", "0"))
+
+FIRST_SAVE = datetime(2015, 1, 1)
+
+app = FastAPI()
+
+
+def generate_item(index: int, rng: random.Random) -> dict:
+    album = rng.randrange(max(TRACK_COUNT // 10, 1))
+    artists = rng.sample(range(max(TRACK_COUNT // 5, 2)), rng.choice((1, 1, 1, 2)))
+    # index 0 is the oldest save, one save an hour after that
+    added_at = FIRST_SAVE + timedelta(hours=index)
+    return {
+        "added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "track": {
+            "id": f"fake{index:010d}",
+            "name": f"Track {index}",
+            "artists": [{"name": f"Artist {artist}"} for artist in artists],
+            "album": {
+                "id": f"album{album:08d}",
+                "name": f"Album {album}",
+                "release_date": f"{1960 + album % 65}-01-01",
+                "images": [{"url": f"https://example.com/album/{album}.jpg"}],
+            },
+            "duration_ms": rng.randrange(60_000, 420_000),
+            "explicit": rng.random() < 0.2,
+            "popularity": rng.randrange(101),
+            "track_number": rng.randrange(1, 15),
+        },
+    }
+
+
+rng = random.Random(SEED)
+# newest first, like Spotify
+library = [generate_item(index, rng) for index in range(TRACK_COUNT)][::-1]
+request_count = 0
+
+
+@app.get("/v1/me/tracks")
+def saved_tracks(
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0),
+    authorization: str | None = Header(None),
+):
+    global request_count
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="No token provided")
+
+    request_count += 1
+    if RATE_LIMIT_EVERY and request_count % RATE_LIMIT_EVERY == 0:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": "1"},
+            content={"error": {"status": 429, "message": "API rate limit exceeded"}},
+        )
+
+    return {
+        "href": f"/v1/me/tracks?offset={offset}&limit={limit}",
+        "items": library[offset : offset + limit],
+        "limit": limit,
+        "offset": offset,
+        "total": len(library),
+    }
+
+
+@app.post("/v1/fake/save")
+def save_tracks(count: int = Query(1, ge=1, le=1000)):
+    start = len(library)
+    library[:0] = [generate_item(start + i, rng) for i in range(count)][::-1]
+    return {"total": len(library)}
@@ -0,0 +1,88 @@
+import argparse
+import sys
+import time
+
+from backend import database
+from backend.app.services.library_backup import (
+    LibraryImport,
+    LibraryImportError,
+    export_library,
+)
+
+"""
+Exports a user's library to a file, or imports one, straight on the database file,
+in the same format as GET /user/export and POST /user/import (see services/library_backup.py).
+Useful for backups, and for moving a library to another server.
+
+Run from the repository root:
+    python -m backend.scripts.library export USER_ID library.ndjson.gz
+    python -m backend.scripts.library import USER_ID library.ndjson.gz
+
+"-" as the file is stdout or stdin. --database picks the database file (the default is the
+app's, DATABASE_PATH). The user has to exist: on a new server, log in once before importing.
+While the app is running it's safe to run this next to it, the writes just wait for each other.
+"""
+
+READ_SIZE = 1 << 16
+
+
+def export_to(conn, user_id: int, path: str) -> int:
+    out = sys.stdout.buffer if path == "-" else open(path, "wb")
+    size = 0
+    try:
+        for data in export_library(conn, user_id):
+            out.write(data)
+            size += len(data)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return size
+
+
+def import_from(conn, user_id: int, path: str) -> dict:
+    importer = LibraryImport(user_id)
+    source = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while data := source.read(READ_SIZE):
+            for batch in importer.feed(data):
+                importer.write(conn, batch)
+        for batch in importer.finish():
+            importer.write(conn, batch)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    return importer.counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export or import a user's library.")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("file", help='the .ndjson.gz file, or "-" for stdout/stdin')
+    parser.add_argument("--database", default=database.DATABASE_PATH)
+    args = parser.parse_args()
+
+    conn = database.get_connection(args.database)
+    try:
+        database.run_migrations(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM user WHERE id = ?", (args.user_id,))
+        if cursor.fetchone() is None:
+            sys.exit(f"No user with id {args.user_id}")
+
+        start = time.perf_counter()
+        if args.command == "export":
+            size = export_to(conn, args.user_id, args.file)
+            result = f"wrote {size / 1e6:.1f} MB"
+        else:
+            try:
+                result = import_from(conn, args.user_id, args.file)
+            except LibraryImportError as e:
+                sys.exit(f"Import stopped: {e}")
+    finally:
+        conn.close()
+    print(f"{result} in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
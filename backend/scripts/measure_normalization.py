@@ -0,0 +1,194 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from backend.app.services import library_stats
+from backend.database import MIGRATIONS, get_connection
+
+"""
+Measures what migration 8 (the album, artist and track_artist tables) does to a big library:
+the database size and the time of the queries the track endpoints run most, before and after.
+
+It builds a synthetic library of TRACKS tracks (spread over ALBUMS albums by ARTISTS artists,
+with Spotify-like ids and image URLs) on the schema as it was before migration 8, measures,
+applies migration 8, VACUUMs so both sizes are of a compacted file, and measures again.
+
+Run from the repository root:
+    python -m backend.scripts.measure_normalization [--tracks N]
+"""
+
+TRACKS = 100_000
+ALBUMS = 8_000
+ARTISTS = 3_000
+REPEATS = 20
+
+# both sides read the same row: the track with its album's Spotify id, name and image.
+# artists is the text column on both sides, like the track endpoints send it (track_rows.py)
+COLUMNS = """
+    {t}id, {t}user_id, {t}added_at, {t}name, {t}artists, {album_id}, {album}, {image},
+    {t}duration_ms, {t}explicit, {t}popularity, {t}track_number, {t}release_date, {t}spotify_id
+"""
+BEFORE_COLUMNS = COLUMNS.format(t="", album_id="album_id", album="album", image="image")
+AFTER_COLUMNS = COLUMNS.format(
+    t="t.", album_id="al.spotify_id", album="al.name", image="al.image"
+)
+
+BEFORE = {
+    "get_tracks page (50)": f"""
+        SELECT {BEFORE_COLUMNS} FROM track WHERE user_id = 1
+        ORDER BY added_at DESC, id DESC LIMIT 50
+    """,
+    "full library read": f"SELECT {BEFORE_COLUMNS} FROM track WHERE user_id = 1",
+    "top artists": """
+        SELECT artists, COUNT(*) AS tracks FROM track WHERE user_id = 1
+        GROUP BY artists ORDER BY tracks DESC LIMIT 10
+    """,
+    "top albums": """
+        SELECT album_id, album, COUNT(*) AS tracks FROM track WHERE user_id = 1
+        GROUP BY album_id ORDER BY tracks DESC LIMIT 10
+    """,
+}
+
+AFTER = {
+    "get_tracks page (50)": f"""
+        SELECT {AFTER_COLUMNS} FROM (
+            SELECT * FROM track WHERE user_id = 1 ORDER BY added_at DESC, id DESC LIMIT 50
+        ) t LEFT JOIN album al ON al.id = t.album_ref
+    """,
+    "full library read": f"""
+        SELECT {AFTER_COLUMNS} FROM track t
+        LEFT JOIN album al ON al.id = t.album_ref
+        WHERE t.user_id = 1
+    """,
+    "top artists": library_stats.ARTIST_COUNTS.replace(":user_id", "1").replace(
+        ":top", "10"
+    ),
+    "top albums": library_stats.ALBUM_COUNTS.replace(":user_id", "1").replace(
+        ":top", "10"
+    ),
+}
+
+
+def spotify_id(rng) -> str:
+    return "".join(rng.choices("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJ", k=22))
+
+
+def fill(conn, tracks: int) -> None:
+    rng = random.Random(0)
+    artists = [f"Artist {spotify_id(rng)[:8]}" for _ in range(ARTISTS)]
+    albums = [
+        (
+            spotify_id(rng),
+            f"Album {spotify_id(rng)[:10]}",
+            f"https://i.scdn.co/image/ab67616d0000b273{spotify_id(rng)}",
+            ", ".join(rng.sample(artists, rng.choice((1, 1, 1, 2, 3)))),
+            f"{rng.randint(1960, 2024)}-{rng.randint(1, 12):02d}-01",
+        )
+        for _ in range(ALBUMS)
+    ]
+    conn.execute("INSERT OR IGNORE INTO user (id, spotify_id) VALUES (1, 'me')")
+    rows = []
+    for i in range(tracks):
+        album_id, album, image, artists_text, release_date = rng.choice(albums)
+        rows.append(
+            (
+                1,
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1.5e9 + i * 600)),
+                f"Song {spotify_id(rng)[:12]}",
+                artists_text,
+                album,
+                album_id,
+                rng.randint(60_000, 400_000),
+                rng.random() < 0.2,
+                rng.randint(0, 100),
+                rng.randint(1, 15),
+                release_date,
+                image,
+                spotify_id(rng),
+            )
+        )
+    conn.executemany(
+        """
+        INSERT INTO track (
+            user_id, added_at, name, artists, album, album_id, duration_ms, explicit,
+            popularity, track_number, release_date, image, spotify_id
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    conn.commit()
+
+
+def size(conn) -> int:
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def timings(conn, queries: dict) -> dict:
+    """The median time of each query in milliseconds, fetching every row."""
+    result = {}
+    for name, sql in queries.items():
+        conn.execute(sql).fetchall()  # warm the page cache
+        times = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            times.append(time.perf_counter() - start)
+        result[name] = sorted(times)[len(times) // 2] * 1000
+    return result
+
+
+def migrate(conn, migrations) -> None:
+    cursor = conn.cursor()
+    for migration in migrations:
+        cursor.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {version + 1}")
+        conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure migration 8 on a synthetic library."
+    )
+    parser.add_argument("--tracks", type=int, default=TRACKS)
+    args = parser.parse_args()
+    tracks = args.tracks
+    with tempfile.TemporaryDirectory() as directory:
+        conn = get_connection(os.path.join(directory, "measure.sqlite3"))
+        migrate(conn, MIGRATIONS[:7])
+        fill(conn, tracks)
+        conn.execute("VACUUM")
+        size_before = size(conn)
+        before = timings(conn, BEFORE)
+        rows_before = {name: conn.execute(BEFORE[name]).fetchall() for name in BEFORE}
+
+        start = time.perf_counter()
+        migrate(conn, MIGRATIONS[7:8])
+        migration_s = time.perf_counter() - start
+        conn.execute("VACUUM")
+        size_after = size(conn)
+        after = timings(conn, AFTER)
+        for name in ("get_tracks page (50)", "full library read"):
+            # the same rows on both sides, or the timings aren't comparable
+            if sorted(rows_before[name]) != sorted(conn.execute(AFTER[name])):
+                raise SystemExit(f"{name}: the queries don't return the same rows")
+        conn.close()
+
+    print(f"{tracks} tracks, {ALBUMS} albums, {ARTISTS} artists")
+    print(f"migration 8 took {migration_s:.1f} s")
+    print(f"{'':24} {'before':>10} {'after':>10}")
+    print(
+        f"{'database size (MB)':24} {size_before / 1e6:10.1f} {size_after / 1e6:10.1f}"
+    )
+    for name in BEFORE:
+        print(f"{name + ' (ms)':24} {before[name]:10.2f} {after[name]:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
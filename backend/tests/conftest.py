@@ -0,0 +1,92 @@
+import itertools
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import auth, database
+from backend.app.services.tag_hierarchy import hierarchy_cache
+from backend.app.services import library_stats, track_index
+from backend.main import app
+
+"""
+Shared fixtures for the backend tests. Run from the repository root:
+    python -m pytest backend/tests
+
+Every test gets its own database file (migrated like on startup) and empty caches,
+so tests don't see each other's users, tags or tracks.
+"""
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.sqlite3")
+    database.configure_pool(path)
+    clear_caches()
+    database.create_tables()
+    return path
+
+
+@pytest.fixture
+def client(db_path):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = database.get_connection(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def make_user(conn):
+    """make_user() adds a user and returns (user_id, headers with their token)."""
+
+    numbers = itertools.count(1)
+
+    def make_user():
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO user (spotify_id) VALUES (?)", (f"test-user-{next(numbers)}",)
+        )
+        conn.commit()
+        return cursor.lastrowid, headers(cursor.lastrowid)
+
+    return make_user
+
+
+def clear_caches() -> None:
+    for cache in (
+        hierarchy_cache,
+        track_index.indexes,
+        library_stats.stats_cache,
+        auth.token_cache,
+    ):
+        cache.clear()
+
+
+def headers(user_id) -> dict:
+    token = auth.create_access_token({"user_id": user_id})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def track(i: int, user_id: int = 1, **fields) -> dict:
+    """A TrackIn body for the i-th test track, every field can be overridden."""
+    body = {
+        "user_id": user_id,
+        "name": f"song {i:04d}",
+        "artists": f"artist {i % 7}",
+        "album": f"album {i % 5}",
+        "album_id": f"album-{i % 5}",
+        "duration_ms": 1000 * i,
+        "explicit": bool(i % 2),
+        "popularity": i % 100,
+        "track_number": i % 12,
+        "release_date": f"{1990 + i % 30}-01-01",
+        "added_at": f"2024-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}Z",
+        "image": f"https://img/{i % 5}",
+        "spotify_id": f"spotify-{i}",
+    }
+    body.update(fields)
+    return body
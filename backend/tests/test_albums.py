@@ -0,0 +1,51 @@
+from conftest import track
+
+"""
+The album table is shared by every user, see services/albums_artists.py.
+"""
+
+
+def sync(client, headers, tracks):
+    response = client.post("/track/sync-tracks", json=tracks, headers=headers)
+    assert response.is_success
+    return response
+
+
+def stored(client, headers) -> list[dict]:
+    return client.get("/track/tracks?limit=100", headers=headers).json()["tracks"]
+
+
+def test_resync_updates_the_album_name_and_cover(client, make_user):
+    alice_id, alice = make_user()
+    bob_id, bob = make_user()
+    sync(client, alice, [track(1, alice_id, image=None)])
+    sync(client, bob, [track(1, bob_id, image=None)])
+    # cache bob's index, which holds the album's name
+    assert client.get("/track/index", headers=bob).is_success
+
+    renamed = track(1, alice_id, album="Renamed album", image="https://new")
+    counts = sync(client, alice, [renamed]).json()
+    assert (counts["updated"], counts["unchanged"]) == (1, 0)
+    assert counts["albums_updated"] == 1
+
+    for headers in (alice, bob):
+        [stored_track] = stored(client, headers)
+        assert stored_track["album"] == "Renamed album"
+        assert stored_track["image"] == "https://new"
+    index = client.get("/track/index?facets=album", headers=bob).json()
+    assert [album["value"] for album in index["facets"]["album"]] == ["Renamed album"]
+
+    counts = sync(client, alice, [renamed]).json()
+    assert (counts["updated"], counts["unchanged"], counts["albums_updated"]) == (
+        0,
+        1,
+        0,
+    )
+
+
+def test_missing_image_reads_back_as_none(client, make_user):
+    user_id, headers = make_user()
+    sync(client, headers, [track(0, user_id, album_id="no-cover", image=None)])
+
+    [stored_track] = stored(client, headers)
+    assert stored_track["image"] is None
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+import pytest
+
+from backend import database
+from backend.async_database import AsyncDatabase
+
+"""
+db.read and db.write from async_database.py.
+"""
+
+
+@pytest.fixture
+def adb(db_path):
+    adb = AsyncDatabase(readers=2)
+    yield adb
+    adb.close()
+
+
+def count_users(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM user").fetchone()[0]
+
+
+def test_write_commits_what_fn_left_open(adb):
+    def insert(conn, name):
+        conn.execute("INSERT INTO user (spotify_id) VALUES (?)", (name,))
+
+    before = asyncio.run(adb.read(count_users))
+    asyncio.run(adb.write(insert, "new-user"))
+    assert asyncio.run(adb.read(count_users)) == before + 1
+
+
+def test_write_that_raises_is_rolled_back(adb):
+    def insert_then_fail(conn):
+        conn.execute("INSERT INTO user (spotify_id) VALUES ('half-done')")
+        raise ValueError("boom")
+
+    before = asyncio.run(adb.read(count_users))
+    with pytest.raises(ValueError):
+        asyncio.run(adb.write(insert_then_fail))
+    assert asyncio.run(adb.read(count_users)) == before
+    # the writer keeps going after a failed write
+    assert adb.write_blocking(count_users) == before
+
+
+def test_writes_run_on_one_thread_and_reads_in_parallel(adb):
+    writers = {adb.write_blocking(lambda conn: threading.get_ident()) for _ in range(3)}
+    assert len(writers) == 1
+
+    both_reading = threading.Barrier(2, timeout=5)
+
+    def read(conn):
+        # only passes when the two reads are running at the same time
+        both_reading.wait()
+        return count_users(conn)
+
+    async def two_reads():
+        return await asyncio.gather(adb.read(read), adb.read(read))
+
+    first, second = asyncio.run(two_reads())
+    assert first == second
+
+
+def test_writer_follows_configure_pool(adb, tmp_path):
+    adb.write_blocking(lambda conn: None)
+    other = str(tmp_path / "other.sqlite3")
+    database.configure_pool(other)
+    path = adb.write_blocking(
+        lambda conn: conn.execute("PRAGMA database_list").fetchone()[2]
+    )
+    assert path == other
@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from backend import auth
+from conftest import headers
+
+"""
+Token verification and its cache, and the per-request user context, see auth.py.
+"""
+
+
+def test_verified_token_is_cached(db_path, monkeypatch):
+    token = auth.create_access_token({"user_id": 7})
+    assert auth.verify_token(token) == 7
+
+    def decode(*args, **kwargs):
+        raise AssertionError("a cached token isn't decoded again")
+
+    monkeypatch.setattr(auth.jwt, "decode", decode)
+    assert auth.verify_token(token) == 7
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "not-a-jwt",
+        auth.create_access_token({"user_id": 7}, timedelta(seconds=-1)),
+        auth.create_access_token({"name": "no user_id"}),
+    ],
+)
+def test_bad_tokens_are_401_and_not_cached(db_path, token):
+    for _ in range(2):
+        with pytest.raises(HTTPException) as error:
+            auth.verify_token(token)
+        assert error.value.status_code == 401
+    assert not auth.token_cache._entries
+
+
+def test_cache_stops_at_the_token_expiry():
+    cache = auth.TokenCache(max_tokens=2, ttl=60)
+    cache.put(b"a", 1, time.time() - 1)
+    assert cache.get(b"a") is None
+
+    cache.put(b"a", 1, float("inf"))
+    cache.put(b"b", 2, float("inf"))
+    cache.get(b"a")
+    cache.put(b"c", 3, float("inf"))
+    # b was the least recently used
+    assert (cache.get(b"a"), cache.get(b"b"), cache.get(b"c")) == (1, None, 3)
+
+
+def test_current_user(client, make_user):
+    user_id, user_headers = make_user()
+    response = client.get("/user/current", headers=user_headers)
+    assert response.json()["user"]["id"] == user_id
+
+    assert client.get("/user/current", headers=headers(12345)).status_code == 404
+    assert client.get("/user/current").status_code in (401, 403)
+    response = client.get("/user/current", headers={"Authorization": "Bearer x"})
+    assert response.status_code == 401
@@ -0,0 +1,28 @@
+import pytest
+
+from backend.scripts import benchmark
+
+"""
+The setup code of scripts/benchmark.py, which has to leave every scenario something to work on.
+"""
+
+
+@pytest.mark.parametrize("shape", ["deep", "wide"])
+@pytest.mark.parametrize("tags", [benchmark.MIN_TAGS, 200])
+def test_tag_scenarios_run_at_small_sizes(client, conn, shape, tags):
+    results = []
+    benchmark.bench_tags(client, conn, results, shape, tags, repeat=20)
+
+    requests = {result["scenario"]: result["requests"] for result in results}
+    assert requests["delete_tag leaf"] >= 1
+    assert requests["delete_tag subtree"] >= 1
+
+
+@pytest.mark.parametrize("shape", ["deep", "wide"])
+def test_leaves_and_subtrees_dont_overlap(client, conn, make_user, shape):
+    user_id, headers = make_user()
+    tracks = benchmark.generate_tracks(10, user_id)
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+    leaves, subtrees = benchmark.create_tag_tree(conn, user_id, 200, shape)
+    assert leaves and subtrees
+    assert not set(leaves) & set(subtrees)
@@ -0,0 +1,136 @@
+from conftest import track
+
+"""
+The catalog endpoints and how catalogs follow track and tag changes, see services/catalogs.py.
+"""
+
+
+def make_library(client, user_id, headers) -> tuple[list[int], dict[str, int]]:
+    """Tracks 0-3 (newest last): 0 and 1 tagged Punk (under Rock), 2 tagged Live."""
+    tracks = [track(i, user_id) for i in range(4)]
+    client.post("/track/sync-tracks", json=tracks, headers=headers)
+    page = client.get("/track/tracks?limit=10&sort_by=name&order=asc", headers=headers)
+    track_ids = [t["id"] for t in page.json()["tracks"]]
+
+    def tag(name, parent=None):
+        body = {"name": name, "type": "genre", "parent": parent}
+        return client.post("/tag/", json=body, headers=headers).json()["id"]
+
+    tags = {"Rock": tag("Rock")}
+    tags["Punk"] = tag("Punk", tags["Rock"])
+    tags["Live"] = tag("Live")
+    for name, indexes in [("Punk", [0, 1]), ("Live", [2])]:
+        body = {"track_ids": [track_ids[i] for i in indexes], "tag_ids": [tags[name]]}
+        client.post("/tag/bulk-apply", json=body, headers=headers)
+    return track_ids, tags
+
+
+def create_catalog(client, headers, **filters) -> dict:
+    body = {"name": "To tag", **filters}
+    response = client.post("/catalog/", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def work_through(client, headers, catalog_id) -> list[str]:
+    """Names of the catalog's tracks in order, completing each one."""
+    names = []
+    while True:
+        entry = client.get(f"/catalog/{catalog_id}/next", headers=headers).json()
+        if entry["track"] is None:
+            return names
+        names.append(entry["track"]["name"])
+        track_id = entry["track"]["id"]
+        client.post(
+            f"/catalog/{catalog_id}/tracks/{track_id}/complete", headers=headers
+        )
+
+
+def test_filters_use_tag_subtrees(client, make_user):
+    user_id, headers = make_user()
+    _, tags = make_library(client, user_id, headers)
+
+    everything = create_catalog(client, headers)
+    assert everything["track_count"] == 4
+
+    rock = create_catalog(
+        client, headers, track_filters=[{"tag_id": tags["Rock"], "rule": "include"}]
+    )
+    assert work_through(client, headers, rock["id"]) == ["song 0001", "song 0000"]
+
+    not_live = create_catalog(
+        client, headers, track_filters=[{"tag_id": tags["Live"], "rule": "exclude"}]
+    )
+    assert work_through(client, headers, not_live["id"]) == [
+        "song 0003",
+        "song 0001",
+        "song 0000",
+    ]
+    [listed] = [
+        c
+        for c in client.get("/catalog/catalogs", headers=headers).json()
+        if c["id"] == not_live["id"]
+    ]
+    assert (listed["track_count"], listed["completed_count"]) == (3, 3)
+
+
+def test_catalog_follows_tagging_and_keeps_progress(client, make_user):
+    user_id, headers = make_user()
+    track_ids, tags = make_library(client, user_id, headers)
+    catalog = create_catalog(
+        client, headers, track_filters=[{"tag_id": tags["Rock"], "rule": "include"}]
+    )
+    catalog_id = catalog["id"]
+    client.post(
+        f"/catalog/{catalog_id}/tracks/{track_ids[1]}/complete", headers=headers
+    )
+
+    body = {"track_ids": [track_ids[3]], "tag_ids": [tags["Punk"]]}
+    client.post("/tag/bulk-apply", json=body, headers=headers)
+    body = {"track_ids": [track_ids[0]], "tag_ids": [tags["Punk"]]}
+    client.post("/tag/bulk-remove", json=body, headers=headers)
+
+    # song 0001 is still completed, song 0003 was appended
+    assert work_through(client, headers, catalog_id) == ["song 0003"]
+
+    rebuilt = client.post(f"/catalog/{catalog_id}/materialize", headers=headers)
+    assert (rebuilt.json()["track_count"], rebuilt.json()["completed_count"]) == (2, 0)
+
+
+def test_deleting_a_filter_tag(client, make_user):
+    user_id, headers = make_user()
+    _, tags = make_library(client, user_id, headers)
+    catalog = create_catalog(
+        client,
+        headers,
+        track_filters=[{"tag_id": tags["Punk"], "rule": "include"}],
+        tag_ids=[tags["Live"]],
+    )
+
+    # Rock's subtree holds the catalog's only include filter
+    response = client.delete(f"/tag/{tags['Rock']}", headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["catalog_ids"] == [catalog["id"]]
+    [listed] = client.get("/catalog/catalogs", headers=headers).json()
+    assert listed["track_filters"] == [{"tag_id": tags["Punk"], "rule": "include"}]
+    assert listed["track_count"] == 2
+
+    # a tag the catalog is only for can go
+    assert client.delete(f"/tag/{tags['Live']}", headers=headers).is_success
+    [listed] = client.get("/catalog/catalogs", headers=headers).json()
+    assert listed["tag_ids"] == []
+    assert listed["track_count"] == 2
+
+
+def test_catalogs_are_per_user(client, make_user):
+    user_id, alice = make_user()
+    _, bob = make_user()
+    _, tags = make_library(client, user_id, alice)
+    catalog = create_catalog(client, alice)
+
+    body = {"name": "x", "track_filters": [{"tag_id": tags["Rock"]}]}
+    assert client.post("/catalog/", json=body, headers=bob).status_code == 404
+    assert client.get(f"/catalog/{catalog['id']}/next", headers=bob).status_code == 404
+    assert client.delete(f"/catalog/{catalog['id']}", headers=bob).status_code == 404
+    assert client.delete(f"/catalog/{catalog['id']}", headers=alice).status_code == 200
+    assert client.get("/catalog/catalogs", headers=alice).json() == []
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+from backend import database
+
+"""
+The connection pool in database.py.
+"""
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = database.ConnectionPool(str(tmp_path / "pool.sqlite3"), size=2)
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused_and_configured(pool):
+    with pool.connection() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        assert conn.execute("PRAGMA foreign_keys").fetchone() == (1,)
+    with pool.connection() as conn:
+        assert conn is first
+    assert pool._opened == 1
+
+
+def test_release_rolls_back_an_open_transaction(pool):
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+        assert conn.in_transaction
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+
+
+def test_acquire_waits_for_a_release(pool):
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+
+    threading.Timer(0.05, pool.release, (second,)).start()
+    assert pool.acquire(timeout=5) is second
+    assert pool._opened == 2
+    pool.release(first)
+    pool.release(second)
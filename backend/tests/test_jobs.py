@@ -0,0 +1,127 @@
+import threading
+import time
+
+from backend.app.routers.web import track as track_router
+from backend.app.services.jobs import JobQueue
+from conftest import track
+
+"""
+Background jobs (background=true on the slow endpoints), see services/jobs.py.
+"""
+
+
+def wait_for(client, headers, job_id) -> dict:
+    for _ in range(500):
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} didn't finish")
+
+
+def test_background_sync(client, make_user):
+    user_id, headers = make_user()
+    tracks = [track(i, user_id) for i in range(5)]
+    response = client.post(
+        "/track/sync-tracks?background=true", json=tracks, headers=headers
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.headers["location"] == f"/jobs/{job_id}"
+
+    job = wait_for(client, headers, job_id)
+    assert job["status"] == "done"
+    assert job["result"]["inserted"] == 5
+    assert job["progress"] == {"stage": "writing", "tracks": 5}
+    assert [j["id"] for j in client.get("/jobs/", headers=headers).json()] == [job_id]
+
+
+def test_failed_job_keeps_the_error(client, make_user):
+    _, headers = make_user()
+    body = {"track_ids": [1], "tag_ids": [12345]}
+    response = client.post(
+        "/tag/bulk-apply?background=true", json=body, headers=headers
+    )
+
+    job = wait_for(client, headers, response.json()["job_id"])
+    assert job["status"] == "failed"
+    assert job["error"]["tag_ids"] == [12345]
+
+
+def test_jobs_are_per_user(client, make_user):
+    user_id, alice = make_user()
+    _, bob = make_user()
+    response = client.post(
+        "/track/sync-tracks?background=true", json=[track(0, user_id)], headers=alice
+    )
+    job_id = response.json()["job_id"]
+    wait_for(client, alice, job_id)
+
+    assert client.get(f"/jobs/{job_id}", headers=bob).status_code == 404
+    assert client.get("/jobs/", headers=bob).json() == []
+
+
+def test_requests_while_running_coalesce_into_one_job():
+    jobs = JobQueue(workers=2)
+    release = threading.Event()
+    ran = []
+
+    def run(name):
+        def run(job):
+            release.wait(5)
+            ran.append(name)
+            return name
+
+        return run
+
+    first = jobs.submit("sync", 1, run("first"), coalesce_key="sync-1")
+    while first.status != "running":
+        time.sleep(0.001)
+    second = jobs.submit("sync", 1, run("second"), coalesce_key="sync-1")
+    third = jobs.submit("sync", 1, run("third"), coalesce_key="sync-1")
+    assert third is second
+    assert second.coalesced == 1
+
+    release.set()
+    while second.status != "done":
+        time.sleep(0.001)
+    assert ran == ["first", "third"]
+    assert (first.result, second.result) == ("first", "third")
+
+
+def test_different_syncs_dont_coalesce(client, make_user, monkeypatch):
+    user_id, headers = make_user()
+    release = threading.Event()
+
+    def run_sync(conn, user_id, tracks, mode, total, job=None):
+        release.wait(5)
+        return {"synced": len(tracks)}
+
+    async def run_spotify_sync(user_id, access_token, full, job=None):
+        return {"mode": "full"}
+
+    monkeypatch.setattr(track_router, "run_sync", run_sync)
+    monkeypatch.setattr(track_router, "run_spotify_sync", run_spotify_sync)
+
+    def sync_tracks(tracks) -> str:
+        response = client.post(
+            "/track/sync-tracks?background=true", json=tracks, headers=headers
+        )
+        return response.json()["job_id"]
+
+    running = sync_tracks([track(0, user_id)])
+    while client.get(f"/jobs/{running}", headers=headers).json()["status"] != "running":
+        time.sleep(0.001)
+    pending = sync_tracks([track(0, user_id), track(1, user_id)])
+    response = client.post(
+        "/track/sync-spotify?background=true",
+        json={"access_token": "token"},
+        headers=headers,
+    )
+    spotify_job = response.json()["job_id"]
+
+    # the Spotify sync neither replaced the pending track sync nor waited for it
+    assert spotify_job != pending
+    assert wait_for(client, headers, spotify_job)["result"] == {"mode": "full"}
+    release.set()
+    assert wait_for(client, headers, pending)["result"] == {"synced": 2}
@@ -0,0 +1,144 @@
+import gzip
+import json
+
+from backend import database
+from backend.app.services import tag_tree
+from conftest import track
+
+"""
+GET /user/export and POST /user/import, see services/library_backup.py.
+"""
+
+
+def export(client, headers) -> bytes:
+    response = client.get("/user/export", headers=headers)
+    assert response.status_code == 200
+    return response.content
+
+
+def records(data: bytes) -> list[dict]:
+    return [json.loads(line) for line in gzip.decompress(data).splitlines()]
+
+
+def library(client, headers) -> tuple[dict, dict]:
+    """({tag name: parent name}, {track name: tag names}) of the user's library."""
+    tags, tracks = {}, {}
+    by_id = {}
+    for record in records(export(client, headers)):
+        if record["kind"] == "tag":
+            by_id[record["id"]] = record["name"]
+            tags[record["name"]] = by_id.get(record["parent"])
+        elif record["kind"] == "track":
+            tracks[record["name"]] = sorted(by_id[t] for t in record.get("tags", []))
+    return tags, tracks
+
+
+def make_library(client, conn, user_id, headers):
+    """A few tags, one of them made the way the tag form used to: under the root tag."""
+    tracks = [track(i, user_id) for i in range(5)]
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO tag (user_id, name, type, parent) VALUES (?, 'Old', 'genre', ?)",
+        (user_id, tag_tree.ROOT_TAG_ID),
+    )
+    old = cursor.lastrowid
+    tag_tree.add_tag(cursor, old, tag_tree.ROOT_TAG_ID)
+    conn.commit()
+
+    rock = client.post(
+        "/tag/", json={"name": "Rock", "type": "genre", "parent": 1}, headers=headers
+    ).json()["id"]
+    punk = client.post(
+        "/tag/", json={"name": "Punk", "type": "genre", "parent": rock}, headers=headers
+    ).json()["id"]
+    client.post(
+        "/tag/", json={"name": "Child", "type": "genre", "parent": old}, headers=headers
+    )
+
+    track_ids = [
+        t["id"]
+        for t in client.get("/track/tracks?limit=10", headers=headers).json()["tracks"]
+    ]
+    body = {"track_ids": track_ids[:2], "tag_ids": [punk, old]}
+    assert client.post("/tag/bulk-apply", json=body, headers=headers).is_success
+
+
+def test_export_round_trip_with_tags_under_root(client, conn, make_user):
+    alice_id, alice = make_user()
+    _, bob = make_user()
+    make_library(client, conn, alice_id, alice)
+
+    data = export(client, alice)
+    tags = {r["name"]: r for r in records(data) if r["kind"] == "tag"}
+    assert tags["Old"]["parent"] is None
+    assert tags["Rock"]["parent"] is None
+
+    response = client.post("/user/import", content=data, headers=bob)
+    assert response.status_code == 200, response.text
+    assert response.json()["tags_created"] == 4
+    assert library(client, bob) == library(client, alice)
+
+    # a second import merges into what's there
+    response = client.post("/user/import", content=data, headers=bob)
+    assert response.json()["tags_created"] == 0
+    assert library(client, bob) == library(client, alice)
+
+
+def test_export_gives_the_connection_back_before_the_download(client, conn, make_user):
+    user_id, headers = make_user()
+    make_library(client, conn, user_id, headers)
+
+    with client.stream("GET", "/user/export", headers=headers) as response:
+        assert response.status_code == 200
+        # nothing read yet, like a client that stalls or goes away
+        assert database.pool._idle.qsize() == database.pool._opened
+        data = response.read()
+    assert int(response.headers["content-length"]) == len(data)
+    assert records(data)[0]["kind"] == "meta"
+
+
+def test_import_parent_outside_the_file_is_top_level(client, make_user):
+    _, headers = make_user()
+    lines = [
+        {"kind": "meta", "format": "spotify-toolbox-library", "version": 1},
+        {"kind": "tag", "id": 2, "name": "Rock", "type": "genre", "parent": 1},
+        {"kind": "tag", "id": 3, "name": "Punk", "type": "genre", "parent": 2},
+    ]
+    data = "\n".join(map(json.dumps, lines)).encode()
+
+    response = client.post("/user/import", content=data, headers=headers)
+    assert response.status_code == 200, response.text
+    assert library(client, headers)[0] == {"Rock": None, "Punk": "Rock"}
+
+
+def test_import_child_before_parent_is_400(client, make_user):
+    _, headers = make_user()
+    lines = [
+        {"kind": "meta", "format": "spotify-toolbox-library", "version": 1},
+        {"kind": "tag", "id": 3, "name": "Punk", "type": "genre", "parent": 2},
+        {"kind": "tag", "id": 2, "name": "Rock", "type": "genre", "parent": None},
+    ]
+    data = "\n".join(map(json.dumps, lines)).encode()
+
+    response = client.post("/user/import", content=data, headers=headers)
+    assert response.status_code == 400
+
+
+def test_import_refreshes_the_cached_tag_tree(client, conn, make_user):
+    alice_id, alice = make_user()
+    _, bob = make_user()
+    make_library(client, conn, alice_id, alice)
+    before = client.get("/tag/tags_hierarchy", headers=bob)
+    assert before.json()["children"] == []
+
+    client.post("/user/import", content=export(client, alice), headers=bob)
+    after = client.get(
+        "/tag/tags_hierarchy",
+        headers={**bob, "If-None-Match": before.headers["etag"]},
+    )
+    assert after.status_code == 200
+    assert len(after.json()["children"]) == 2
+    count = client.get("/track/tracks/count", headers=bob).json()
+    assert count["total_count"] == 5
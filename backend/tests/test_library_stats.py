@@ -0,0 +1,55 @@
+from conftest import track
+
+"""
+GET /track/stats and /track/tracks/count, and the ETags of the cached responses.
+"""
+
+
+def test_stats_of_the_library(client, make_user):
+    user_id, headers = make_user()
+    tracks = [track(i, user_id, explicit=i < 3) for i in range(10)]
+    tracks[0]["release_date"] = "²⁰⁰⁰"
+    client.post("/track/sync-tracks", json=tracks, headers=headers)
+    rock = client.post(
+        "/tag/", json={"name": "Rock", "type": "genre"}, headers=headers
+    ).json()["id"]
+    track_ids = [
+        t["id"]
+        for t in client.get("/track/tracks?limit=10", headers=headers).json()["tracks"]
+    ]
+    client.post(
+        "/tag/bulk-apply",
+        json={"track_ids": track_ids[:4], "tag_ids": [rock]},
+        headers=headers,
+    )
+
+    stats = client.get("/track/stats", headers=headers).json()
+    assert stats["total_count"] == 10
+    assert stats["total_duration_ms"] == sum(t["duration_ms"] for t in tracks)
+    assert stats["explicit_ratio"] == 0.3
+    assert sum(year["tracks"] for year in stats["release_years"]) == 10
+    assert {"year": None, "tracks": 1} in stats["release_years"]
+    assert stats["tags"] == [{"id": rock, "name": "Rock", "direct": 4, "total": 4}]
+    assert client.get("/track/tracks/count", headers=headers).json() == {
+        "total_count": 10
+    }
+
+
+def test_etag_until_the_next_write(client, make_user):
+    user_id, headers = make_user()
+    client.post("/track/sync-tracks", json=[track(0, user_id)], headers=headers)
+
+    for path in ("/track/stats", "/tag/tags_hierarchy"):
+        etag = client.get(path, headers=headers).headers["ETag"]
+        again = client.get(path, headers={**headers, "If-None-Match": etag})
+        assert again.status_code == 304
+
+    etag = client.get("/track/stats", headers=headers).headers["ETag"]
+    client.post(
+        "/track/sync-tracks",
+        json=[track(0, user_id), track(1, user_id)],
+        headers=headers,
+    )
+    response = client.get("/track/stats", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["total_count"] == 2
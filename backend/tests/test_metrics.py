@@ -0,0 +1,51 @@
+import gc
+
+import pytest
+
+from backend import metrics
+
+"""
+The SQL timing in metrics.py. These need METRICS on (the default), so the connections are timed.
+"""
+
+pytestmark = pytest.mark.skipif(not metrics.ENABLED, reason="METRICS=0")
+
+
+@pytest.fixture
+def every_query_is_slow(monkeypatch):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0)
+    metrics.slow_queries.clear()
+
+
+def test_slow_query_is_logged_with_its_plan(conn, every_query_is_slow):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM tag WHERE id = ?", (1,))
+    cursor.fetchall()
+
+    [entry] = metrics.slow_queries
+    assert entry["sql"] == "SELECT id FROM tag WHERE id = ?"
+    assert entry["plan"]
+
+
+def test_cursor_collected_mid_statement_doesnt_explain(conn, every_query_is_slow):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM tag WHERE id = ?", (1,))
+    cursor.fetchone()
+    del cursor
+    gc.collect()
+
+    [entry] = metrics.slow_queries
+    assert entry["plan"] is None
+
+
+def test_counters_are_served(client):
+    client.get("/")
+    text = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/"' in text
+    assert "sqlite_query_duration_seconds" in text
+    assert "track_index_users" in text
+
+
+def test_slow_query_log_is_off_by_default(client):
+    assert not metrics.SLOW_QUERIES_ENDPOINT
+    assert client.get("/metrics/slow-queries").status_code == 404
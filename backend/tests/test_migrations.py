@@ -0,0 +1,119 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import database
+from backend.main import app
+from conftest import clear_caches, headers
+
+"""
+Upgrading a database made by the original create_tables() (before MIGRATIONS existed):
+it has the base tables with data in them, and PRAGMA user_version is still 0.
+"""
+
+
+def make_baseline_database(path: str) -> None:
+    conn = database.get_connection(path)
+    cursor = conn.cursor()
+    # migration 1 is the original create_tables(), the baseline never set user_version
+    database.migration_1_base_tables(cursor)
+    cursor.execute("INSERT INTO user (id, spotify_id) VALUES (2, 'old-user')")
+    for i, name in enumerate(["Come Together", "Something", "Help!"]):
+        album = ("Help!", "help", "img-h") if i == 2 else ("Abbey Road", "ab", "img-a")
+        cursor.execute(
+            """
+            INSERT INTO track (id, user_id, added_at, name, artists, album, album_id, image,
+                duration_ms, explicit, popularity, track_number, release_date, spotify_id)
+            VALUES (?, 2, ?, ?, 'The Beatles, Billy Preston', ?, ?, ?, 1, 0, 50, 1, '1969', ?)
+            """,
+            (i + 1, f"2020-01-0{i + 1}T00:00:00Z", name, *album, f"sp-{i}"),
+        )
+    # the tag form sent the root (id 1) as the parent of a top-level tag
+    cursor.execute(
+        "INSERT INTO tag (id, user_id, name, type, parent) VALUES (2, 2, 'Rock', 'genre', 1)"
+    )
+    cursor.execute(
+        "INSERT INTO tag (id, user_id, name, type, parent) VALUES (3, 2, 'Blues', 'genre', 2)"
+    )
+    # the same tag applied twice, and a catalog that logged a track twice
+    for track_id, tag_id in [(1, 3), (1, 3), (3, 2)]:
+        cursor.execute(
+            "INSERT INTO track_tag (track_id, tag_id, is_tagged) VALUES (?, ?, 1)",
+            (track_id, tag_id),
+        )
+    cursor.execute("INSERT INTO catalog (id, user_id, name) VALUES (1, 2, 'Mix')")
+    for index, track_id in enumerate([1, 1, 2]):
+        cursor.execute(
+            """
+            INSERT INTO catalog_track_log (catalog_id, track_id, catalog_index)
+            VALUES (1, ?, ?)
+            """,
+            (track_id, index),
+        )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def baseline_client(tmp_path):
+    path = str(tmp_path / "baseline.sqlite3")
+    make_baseline_database(path)
+    database.configure_pool(path)
+    clear_caches()
+    # startup runs the migrations
+    with TestClient(app) as client:
+        yield client, path
+
+
+def test_baseline_database_is_migrated(baseline_client):
+    client, path = baseline_client
+    conn = database.get_connection(path)
+    cursor = conn.cursor()
+    assert database.schema_version(conn) == len(database.MIGRATIONS)
+
+    cursor.execute("SELECT COUNT(*) FROM track_tag")
+    assert cursor.fetchone()[0] == 2
+    cursor.execute("SELECT COUNT(*) FROM catalog_track_log")
+    assert cursor.fetchone()[0] == 2
+    cursor.execute("SELECT spotify_id, name, image FROM album ORDER BY spotify_id")
+    assert cursor.fetchall() == [
+        ("ab", "Abbey Road", "img-a"),
+        ("help", "Help!", "img-h"),
+    ]
+    cursor.execute("SELECT name FROM artist ORDER BY name")
+    assert cursor.fetchall() == [("Billy Preston",), ("The Beatles",)]
+    cursor.execute(
+        "SELECT depth FROM tag_closure WHERE ancestor = 2 AND descendant = 3"
+    )
+    assert cursor.fetchall() == [(1,)]
+    conn.close()
+
+    user = headers(2)
+    tracks = client.get(
+        "/track/tracks?limit=10&sort_by=name&order=asc", headers=user
+    ).json()
+    assert [(t["name"], t["album"], t["image"]) for t in tracks["tracks"]] == [
+        ("Come Together", "Abbey Road", "img-a"),
+        ("Help!", "Help!", "img-h"),
+        ("Something", "Abbey Road", "img-a"),
+    ]
+
+    search = client.get("/track/search", params={"q": "abbey"}, headers=user).json()
+    assert sorted(t["name"] for t in search["tracks"]) == ["Come Together", "Something"]
+
+    # Rock matches its own track and the one tagged with Blues under it
+    response = client.get("/track/filter", params={"expr": "rock"}, headers=user)
+    assert sorted(t["name"] for t in response.json()["tracks"]) == [
+        "Come Together",
+        "Help!",
+    ]
+
+    tree = client.get("/tag/tags_hierarchy", headers=user).json()
+    [rock] = tree["children"]
+    assert (rock["name"], [c["name"] for c in rock["children"]]) == ("Rock", ["Blues"])
+
+
+def test_migrating_twice_is_a_no_op(baseline_client):
+    _, path = baseline_client
+    conn = database.get_connection(path)
+    assert database.run_migrations(conn) == len(database.MIGRATIONS)
+    conn.close()
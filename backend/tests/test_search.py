@@ -0,0 +1,85 @@
+from backend import database
+from backend.app.services import track_search
+from conftest import track
+
+"""
+GET /track/search and the track_fts index, see services/track_search.py.
+"""
+
+
+def search(client, headers, q) -> list[str]:
+    response = client.get("/track/search", params={"q": q}, headers=headers)
+    assert response.status_code == 200
+    return [t["name"] for t in response.json()["tracks"]]
+
+
+def sync(client, headers, tracks):
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+
+
+def test_prefix_words_in_any_column(client, make_user):
+    user_id, headers = make_user()
+    sync(
+        client,
+        headers,
+        [
+            track(0, user_id, name="Here Comes the Sun", artists="The Beatles"),
+            track(1, user_id, name="Help!", artists="The Beatles"),
+            track(2, user_id, name="Sunday Bloody Sunday", artists="U2"),
+        ],
+    )
+
+    assert search(client, headers, "beat sun") == ["Here Comes the Sun"]
+    assert search(client, headers, "near and") == []
+    assert sorted(search(client, headers, "sun")) == [
+        "Here Comes the Sun",
+        "Sunday Bloody Sunday",
+    ]
+
+
+def test_only_the_users_own_tracks_are_matched(client, conn, make_user):
+    alice_id, alice = make_user()
+    bob_id, bob = make_user()
+    sync(client, alice, [track(i, alice_id, name=f"blue {i}") for i in range(3)])
+    sync(client, bob, [track(i, bob_id, name=f"blue {i}") for i in range(50)])
+
+    assert len(search(client, alice, "blue")) == 3
+    # the index itself returns only alice's rows, bob's matches are never joined
+    query = track_search.match_query("blue", alice_id)
+    cursor = conn.execute(
+        "SELECT COUNT(*) FROM track_fts WHERE track_fts MATCH ?", (query,)
+    )
+    assert cursor.fetchone()[0] == 3
+
+
+def test_index_follows_renames_and_deletes(client, make_user):
+    user_id, headers = make_user()
+    sync(client, headers, [track(0, user_id, name="old name"), track(1, user_id)])
+    sync(client, headers, [track(0, user_id, name="new name")])
+
+    assert search(client, headers, "old") == []
+    assert search(client, headers, "new") == ["new name"]
+    assert search(client, headers, "song") == []
+
+
+def test_migration_9_indexes_existing_tracks(tmp_path):
+    conn = database.get_connection(str(tmp_path / "old.sqlite3"))
+    cursor = conn.cursor()
+    for version, migration in enumerate(database.MIGRATIONS[:8]):
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {version + 1}")
+    cursor.execute("INSERT INTO user (id, spotify_id) VALUES (2, 'someone')")
+    cursor.execute(
+        """
+        INSERT INTO track (user_id, added_at, name, artists, duration_ms, explicit,
+            popularity, track_number, release_date, spotify_id)
+        VALUES (2, '2024', 'Blackbird', 'The Beatles', 1, 0, 1, 1, '1968', 'x')
+        """
+    )
+    conn.commit()
+
+    assert database.run_migrations(conn) == len(database.MIGRATIONS)
+    rows = track_search.search(cursor, 2, "black beat", "t.name", 10, 0)
+    assert rows == [("Blackbird",)]
+    assert track_search.search(cursor, 1, "black", "t.name", 10, 0) == []
+    conn.close()
@@ -0,0 +1,58 @@
+import json
+
+from backend.app.models.web.track import TrackOut
+from backend.app.services import fast_json
+from conftest import track
+
+"""
+The track lists are built as dicts from the rows, see services/track_rows.py and fast_json.py.
+"""
+
+
+def sync(client, headers, tracks):
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+
+
+def test_dicts_match_track_out(client, make_user):
+    user_id, headers = make_user()
+    sync(client, headers, [track(0, user_id), track(1, user_id, image="")])
+
+    tracks = client.get("/track/tracks?sort_by=name&order=asc", headers=headers).json()
+    for sent in tracks:
+        assert list(sent) == list(TrackOut.model_fields)
+        assert TrackOut(**sent).model_dump() == sent
+    assert tracks[0]["image"] == "https://img/0"
+    assert tracks[1]["image"] is None
+
+
+def test_fields_only_sends_those_keys(client, make_user):
+    user_id, headers = make_user()
+    sync(client, headers, [track(0, user_id)])
+
+    response = client.get(
+        "/track/tracks?limit=5&fields=name, album,name", headers=headers
+    )
+    assert response.json()["tracks"] == [{"name": "song 0000", "album": "album 0"}]
+    response = client.get("/track/tracks?limit=5&fields=name,nope", headers=headers)
+    assert response.status_code == 400
+
+
+def test_long_lists_are_streamed_in_chunks(client, make_user, monkeypatch):
+    user_id, headers = make_user()
+    sync(client, headers, [track(i, user_id) for i in range(7)])
+    monkeypatch.setattr(fast_json, "STREAM_THRESHOLD", 2)
+
+    response = client.get("/track/tracks?sort_by=name&order=asc", headers=headers)
+    assert "content-length" not in response.headers
+    names = [t["name"] for t in json.loads(response.content)]
+    assert names == [f"song {i:04d}" for i in range(7)]
+
+
+def test_chunks_join_into_one_array():
+    def encode(rows, chunk_size):
+        chunks = fast_json.iter_json_list(rows, lambda chunk: chunk, chunk_size)
+        return b"".join(chunks)
+
+    assert encode([], 3) == b"[]"
+    assert json.loads(encode(list(range(7)), 3)) == list(range(7))
+    assert json.loads(encode([{"a": 1}], 3)) == [{"a": 1}]
@@ -0,0 +1,129 @@
+import pytest
+
+from backend.app.routers.web import track as track_router
+from backend.app.services.spotify_library import page_tracks
+from conftest import track
+
+"""
+POST /track/sync-spotify, with the Spotify API replaced by a list of saved tracks.
+"""
+
+PAGE_SIZE = 3
+
+
+def saved_item(body: dict) -> dict:
+    """A /v1/me/tracks item for a track() body."""
+    return {
+        "added_at": body["added_at"],
+        "track": {
+            "id": body["spotify_id"],
+            "name": body["name"],
+            "artists": [{"name": name} for name in body["artists"].split(", ")],
+            "album": {
+                "id": body["album_id"],
+                "name": body["album"],
+                "images": [{"url": body["image"]}],
+                "release_date": body["release_date"],
+            },
+            "duration_ms": body["duration_ms"],
+            "explicit": body["explicit"],
+            "popularity": body["popularity"],
+            "track_number": body["track_number"],
+        },
+    }
+
+
+def local_file(added_at: str) -> dict:
+    """A local file in the library: Spotify counts it, but it has no id and isn't stored."""
+    return {
+        "added_at": added_at,
+        "track": {"id": None, "is_local": True, "name": "home recording"},
+    }
+
+
+@pytest.fixture
+def spotify(monkeypatch):
+    """
+    The saved tracks "on Spotify", newest first, as track() bodies or local_file() items.
+    Edit the list to change the library.
+    """
+    saved: list[dict] = []
+
+    async def saved_track_pages(access_token, user_id, stop_at=None, meta=None):
+        items = [t if "track" in t else saved_item(t) for t in saved]
+        if meta is not None:
+            meta["total"] = len(items)
+        for start in range(0, max(len(items), 1), PAGE_SIZE):
+            page = items[start : start + PAGE_SIZE]
+            newer = [t for t in page if stop_at is None or t["added_at"] > stop_at]
+            yield page_tracks(newer, user_id)
+            if len(newer) < len(page):
+                return
+
+    monkeypatch.setattr(track_router, "saved_track_pages", saved_track_pages)
+    return saved
+
+
+def sync(client, headers, **body) -> dict:
+    response = client.post(
+        "/track/sync-spotify", json={"access_token": "token", **body}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_first_sync_is_full(client, make_user, spotify):
+    _, headers = make_user()
+    spotify[:] = [track(i) for i in reversed(range(10))]
+
+    counts = sync(client, headers)
+    assert counts["mode"] == "full"
+    assert (counts["inserted"], counts["received"], counts["pages"]) == (10, 10, 4)
+
+
+def test_delta_only_fetches_new_tracks(client, make_user, spotify):
+    _, headers = make_user()
+    spotify[:] = [track(i) for i in reversed(range(10))]
+    sync(client, headers)
+
+    spotify[:0] = [track(11), track(10)]
+    counts = sync(client, headers)
+    assert counts["mode"] == "delta"
+    assert (counts["inserted"], counts["received"], counts["pages"]) == (2, 2, 1)
+
+
+def test_fallback_reports_only_the_full_pass(client, make_user, spotify):
+    _, headers = make_user()
+    spotify[:] = [track(i) for i in reversed(range(10))]
+    sync(client, headers)
+
+    # two new tracks, and one removed: the delta pass can't see the removal
+    spotify[:0] = [track(11), track(10)]
+    del spotify[5]
+    counts = sync(client, headers)
+    assert counts["mode"] == "full"
+    assert counts["received"] == 11
+    assert counts["pages"] == 4
+    assert counts["deleted"] == 1
+    count = client.get("/track/tracks/count", headers=headers).json()
+    assert count["total_count"] == 11
+
+
+def test_local_files_dont_turn_deltas_into_full_syncs(client, make_user, spotify):
+    _, headers = make_user()
+    spotify[:] = [track(i) for i in reversed(range(10))]
+    spotify.insert(4, local_file(track(5)["added_at"] + "~"))
+    counts = sync(client, headers)
+    assert (counts["mode"], counts["inserted"]) == ("full", 10)
+
+    spotify[:0] = [track(11), track(10)]
+    counts = sync(client, headers)
+    assert counts["mode"] == "delta"
+    assert (counts["inserted"], counts["pages"]) == (2, 1)
+
+    # a removal is still seen
+    del spotify[0]
+    counts = sync(client, headers)
+    assert (counts["mode"], counts["deleted"]) == ("full", 1)
+    sync_state = client.get("/track/sync-state", headers=headers).json()
+    assert (sync_state["track_count"], sync_state["skipped_items"]) == (11, 1)
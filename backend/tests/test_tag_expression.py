@@ -0,0 +1,80 @@
+import pytest
+
+from backend.app.services.tag_expression import ExpressionError, parse
+from conftest import track
+
+"""
+GET /track/filter?expr=..., see services/tag_expression.py.
+"""
+
+
+def test_parse_precedence():
+    assert parse("a OR b and not c") == (
+        "or",
+        ("tag", "a"),
+        ("and", ("tag", "b"), ("not", ("tag", "c"))),
+    )
+    assert parse('("hip hop" or a)') == ("or", ("tag", "hip hop"), ("tag", "a"))
+
+
+@pytest.mark.parametrize("expression", ["", "a AND", "(a", "a)", "a b", "NOT"])
+def test_parse_errors(expression):
+    with pytest.raises(ExpressionError):
+        parse(expression)
+
+
+def make_library(client, user_id, headers) -> dict[str, int]:
+    """Tracks 0-4, tagged: 0 Rock, 1 Punk (under Rock), 2 Punk and Live, 3 Jazz, 4 nothing."""
+    tracks = [track(i, user_id) for i in range(5)]
+    client.post("/track/sync-tracks", json=tracks, headers=headers)
+    page = client.get("/track/tracks?limit=10&sort_by=name&order=asc", headers=headers)
+    track_ids = [t["id"] for t in page.json()["tracks"]]
+
+    def tag(name, parent=None):
+        body = {"name": name, "type": "genre", "parent": parent}
+        return client.post("/tag/", json=body, headers=headers).json()["id"]
+
+    tags = {"Rock": tag("Rock")}
+    tags["Punk"] = tag("Punk", tags["Rock"])
+    tags["Live"] = tag("Live")
+    tags["Jazz"] = tag("Jazz")
+    for name, indexes in [
+        ("Rock", [0]),
+        ("Punk", [1, 2]),
+        ("Live", [2]),
+        ("Jazz", [3]),
+    ]:
+        body = {"track_ids": [track_ids[i] for i in indexes], "tag_ids": [tags[name]]}
+        client.post("/tag/bulk-apply", json=body, headers=headers)
+    return tags
+
+
+def matches(client, headers, expr) -> list[str]:
+    response = client.get(
+        "/track/filter",
+        params={"expr": expr, "sort_by": "name", "order": "asc"},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return [t["name"][-1] for t in response.json()["tracks"]]
+
+
+def test_filter_matches_subtrees(client, make_user):
+    user_id, headers = make_user()
+    make_library(client, user_id, headers)
+
+    assert matches(client, headers, "rock") == ["0", "1", "2"]
+    assert matches(client, headers, "punk") == ["1", "2"]
+    assert matches(client, headers, "rock AND NOT live") == ["0", "1"]
+    assert matches(client, headers, "(punk OR jazz) and not LIVE") == ["1", "3"]
+    assert matches(client, headers, "NOT (rock OR jazz)") == ["4"]
+
+
+def test_unknown_and_other_users_tags_are_400(client, make_user):
+    alice_id, alice = make_user()
+    _, bob = make_user()
+    make_library(client, alice_id, alice)
+
+    response = client.get("/track/filter", params={"expr": "rock"}, headers=bob)
+    assert response.status_code == 400
+    assert "rock" in response.json()["detail"]
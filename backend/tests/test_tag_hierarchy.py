@@ -0,0 +1,71 @@
+from backend.app.services.user_cache import UserCache, etag_matches
+
+"""
+The cached tag tree and its ETag, see GET /tag/tags_hierarchy and services/user_cache.py.
+"""
+
+
+def get_tree(client, headers, etag=None):
+    if etag is not None:
+        headers = {**headers, "If-None-Match": etag}
+    return client.get("/tag/tags_hierarchy", headers=headers)
+
+
+def test_unchanged_tree_is_304(client, make_user):
+    _, headers = make_user()
+    client.post("/tag/", json={"name": "Rock", "type": "genre"}, headers=headers)
+
+    first = get_tree(client, headers)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    again = get_tree(client, headers, etag)
+    assert again.status_code == 304
+    assert again.content == b""
+    assert get_tree(client, headers, f"W/{etag}").status_code == 304
+    assert get_tree(client, headers, '"other", ' + etag).status_code == 304
+    assert get_tree(client, headers, '"other"').status_code == 200
+
+
+def test_tag_writes_change_the_etag(client, make_user):
+    _, headers = make_user()
+    etag = get_tree(client, headers).headers["etag"]
+
+    rock = client.post(
+        "/tag/", json={"name": "Rock", "type": "genre"}, headers=headers
+    ).json()["id"]
+    created = get_tree(client, headers, etag)
+    assert created.status_code == 200
+    assert [t["name"] for t in created.json()["children"]] == ["Rock"]
+
+    assert client.delete(f"/tag/{rock}", headers=headers).status_code == 200
+    deleted = get_tree(client, headers, created.headers["etag"])
+    assert deleted.status_code == 200
+    assert deleted.json()["children"] == []
+
+
+def test_users_have_their_own_tree(client, make_user):
+    _, alice = make_user()
+    _, bob = make_user()
+    client.post("/tag/", json={"name": "Rock", "type": "genre"}, headers=alice)
+    alice_tree = get_tree(client, alice)
+
+    bob_tree = get_tree(client, bob, alice_tree.headers["etag"])
+    assert bob_tree.status_code == 200
+    assert bob_tree.json()["children"] == []
+
+
+def test_build_started_before_an_invalidate_isnt_cached():
+    cache = UserCache(max_users=2)
+    token = cache.start_build("1")
+    cache.invalidate("1")
+    cache.put("1", b"stale", token)
+    assert cache.get("1") is None
+
+
+def test_etag_matches():
+    assert etag_matches("*", '"3"')
+    assert etag_matches('W/"3"', '"3"')
+    assert not etag_matches(None, '"3"')
+    assert not etag_matches('"33"', '"3"')
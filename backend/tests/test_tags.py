@@ -0,0 +1,192 @@
+from conftest import track
+
+"""
+Creating tags and reading the tag tree back.
+"""
+
+
+def create_tag(client, headers, name, parent=1):
+    # the frontend's form sends the shared root (id 1) as the parent of a top-level tag
+    body = {"name": name, "type": "genre", "parent": parent}
+    return client.post("/tag/", json=body, headers=headers)
+
+
+def tree(client, headers) -> dict:
+    """{name: {child name: {...}}} of the user's tag hierarchy."""
+
+    def names(node):
+        return {child["name"]: names(child) for child in node["children"]}
+
+    return names(client.get("/tag/tags_hierarchy", headers=headers).json())
+
+
+def test_user_can_create_tag_under_root(client, make_user):
+    user_id, headers = make_user()
+    assert user_id != 1
+
+    response = create_tag(client, headers, "Rock")
+    assert response.status_code == 200
+    assert response.json()["parent"] is None
+    assert tree(client, headers) == {"Rock": {}}
+
+
+def test_child_tags_nest_under_their_parent(client, make_user):
+    _, headers = make_user()
+    rock = create_tag(client, headers, "Rock").json()["id"]
+    punk = create_tag(client, headers, "Punk", rock).json()["id"]
+    create_tag(client, headers, "Hardcore", punk)
+
+    assert tree(client, headers) == {"Rock": {"Punk": {"Hardcore": {}}}}
+
+
+def test_parent_of_another_user_is_404(client, make_user):
+    _, alice = make_user()
+    _, bob = make_user()
+    rock = create_tag(client, alice, "Rock").json()["id"]
+
+    assert create_tag(client, bob, "Punk", rock).status_code == 404
+    assert tree(client, bob) == {}
+
+
+def test_move_to_root_makes_top_level(client, make_user):
+    _, headers = make_user()
+    rock = create_tag(client, headers, "Rock").json()["id"]
+    punk = create_tag(client, headers, "Punk", rock).json()["id"]
+
+    response = client.post(
+        "/tag/move", json={"moves": [{"tag_id": punk, "parent": 1}]}, headers=headers
+    )
+    assert response.status_code == 200
+    assert tree(client, headers) == {"Rock": {}, "Punk": {}}
+
+
+def test_import_nested_and_flat_tags(client, make_user):
+    _, headers = make_user()
+    rock = create_tag(client, headers, "Rock").json()["id"]
+    body = {
+        "tree": [
+            {
+                "name": "Jazz",
+                "type": "genre",
+                "children": [{"name": "Bebop", "type": "genre"}],
+            }
+        ],
+        "tags": [
+            {"temp_id": "p", "name": "Punk", "type": "genre", "parent_id": rock},
+            {"temp_id": "h", "name": "Hardcore", "type": "genre", "parent": "p"},
+        ],
+        "parent_id": 1,
+    }
+    response = client.post("/tag/import", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["created"] == 4
+    assert set(response.json()["ids"]) == {"0", "0.0", "p", "h"}
+    assert tree(client, headers) == {
+        "Rock": {"Punk": {"Hardcore": {}}},
+        "Jazz": {"Bebop": {}},
+    }
+
+
+def test_import_errors(client, make_user):
+    _, alice = make_user()
+    _, bob = make_user()
+    rock = create_tag(client, alice, "Rock").json()["id"]
+
+    cycle = {
+        "tags": [
+            {"temp_id": "a", "name": "A", "type": "genre", "parent": "b"},
+            {"temp_id": "b", "name": "B", "type": "genre", "parent": "a"},
+        ]
+    }
+    assert client.post("/tag/import", json=cycle, headers=bob).status_code == 400
+    unknown = {"tags": [{"temp_id": "a", "name": "A", "type": "genre", "parent": "x"}]}
+    assert client.post("/tag/import", json=unknown, headers=bob).status_code == 400
+    # someone else's tag as the parent
+    other = {"parent_id": rock, "tree": [{"name": "A", "type": "genre"}]}
+    assert client.post("/tag/import", json=other, headers=bob).status_code == 404
+    assert tree(client, bob) == {}
+
+
+def move(client, headers, *moves):
+    body = {"moves": [{"tag_id": tag_id, "parent": parent} for tag_id, parent in moves]}
+    return client.post("/tag/move", json=body, headers=headers)
+
+
+def test_move_checks_the_whole_batch(client, make_user):
+    _, headers = make_user()
+    rock = create_tag(client, headers, "Rock").json()["id"]
+    punk = create_tag(client, headers, "Punk", rock).json()["id"]
+    jazz = create_tag(client, headers, "Jazz").json()["id"]
+    live = create_tag(client, headers, "Live").json()["id"]
+    body = {"name": "Locked", "type": "genre", "parent": live, "locked": True}
+    client.post("/tag/", json=body, headers=headers)
+
+    # each move is fine on its own, together they make a cycle
+    assert move(client, headers, (rock, jazz), (jazz, punk)).status_code == 400
+    assert move(client, headers, (rock, punk)).status_code == 400
+    # Live has a locked tag under it
+    response = move(client, headers, (live, rock))
+    assert response.status_code == 403
+    assert move(client, headers, (12345, None)).status_code == 404
+    assert tree(client, headers) == {
+        "Rock": {"Punk": {}},
+        "Jazz": {},
+        "Live": {"Locked": {}},
+    }
+
+    assert move(client, headers, (punk, jazz), (rock, punk)).json()["moved"] == 2
+    assert tree(client, headers) == {
+        "Jazz": {"Punk": {"Rock": {}}},
+        "Live": {"Locked": {}},
+    }
+
+
+def test_copy_subtree_with_its_tracks(client, conn, make_user):
+    user_id, headers = make_user()
+    client.post("/track/sync-tracks", json=[track(0, user_id)], headers=headers)
+    [song] = client.get("/track/tracks?limit=5", headers=headers).json()["tracks"]
+    rock = create_tag(client, headers, "Rock").json()["id"]
+    punk = create_tag(client, headers, "Punk", rock).json()["id"]
+    jazz = create_tag(client, headers, "Jazz").json()["id"]
+    body = {"track_ids": [song["id"]], "tag_ids": [punk]}
+    client.post("/tag/bulk-apply", json=body, headers=headers)
+
+    body = {"copies": [{"tag_id": rock, "parent": jazz}, {"tag_id": punk}]}
+    response = client.post("/tag/copy", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert (response.json()["created"], response.json()["track_tags"]) == (3, 2)
+    assert tree(client, headers) == {
+        "Rock": {"Punk": {}},
+        "Jazz": {"Rock": {"Punk": {}}},
+        "Punk": {},
+    }
+    cursor = conn.execute(
+        "SELECT COUNT(*) FROM track_tag WHERE track_id = ?", (song["id"],)
+    )
+    assert cursor.fetchone()[0] == 3
+
+    body = {"copies": [{"tag_id": rock}], "tracks": False}
+    response = client.post("/tag/copy", json=body, headers=headers)
+    assert response.json()["track_tags"] == 0
+
+
+def test_closure_matches_the_parent_links(client, conn, make_user):
+    _, headers = make_user()
+    rock = create_tag(client, headers, "Rock").json()["id"]
+    punk = create_tag(client, headers, "Punk", rock).json()["id"]
+    hardcore = create_tag(client, headers, "Hardcore", punk).json()["id"]
+    jazz = create_tag(client, headers, "Jazz").json()["id"]
+    move(client, headers, (punk, jazz))
+    client.post("/tag/copy", json={"copies": [{"tag_id": jazz}]}, headers=headers)
+    client.delete(f"/tag/{rock}", headers=headers)
+    assert client.delete(f"/tag/{hardcore}", headers=headers).status_code == 200
+
+    closure = conn.execute("SELECT ancestor, descendant, depth FROM tag_closure")
+    parents = dict(conn.execute("SELECT id, parent FROM tag"))
+    expected = set()
+    for tag_id in parents:
+        ancestor, depth = tag_id, 0
+        while ancestor is not None:
+            expected.add((ancestor, tag_id, depth))
+            ancestor, depth = parents[ancestor], depth + 1
+    assert set(closure) == expected
@@ -0,0 +1,64 @@
+from conftest import track
+
+"""
+GET /track/index and /track/index/stats, see services/track_index.py.
+"""
+
+
+def sync(client, headers, tracks):
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+
+
+def test_filters_sorts_and_counts(client, make_user):
+    user_id, headers = make_user()
+    sync(client, headers, [track(i, user_id) for i in range(30)])
+
+    response = client.get(
+        "/track/index?sort_by=popularity&order=desc&min_popularity=10&max_popularity=19"
+        "&explicit=true&facets=year,explicit&fields=name,popularity",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert [t["popularity"] for t in body["tracks"]] == [19, 17, 15, 13, 11]
+    assert body["total"] == 5
+    assert body["facets"]["explicit"] == [{"value": True, "count": 5}]
+
+
+def test_values_outside_the_arrays_range(client, make_user):
+    user_id, headers = make_user()
+    sync(
+        client,
+        headers,
+        [
+            track(0, user_id, popularity=200, duration_ms=5_000_000_000),
+            track(1, user_id, popularity=-300, duration_ms=-1, release_date="²⁰⁰⁰"),
+            track(2, user_id, popularity=50),
+        ],
+    )
+
+    response = client.get(
+        "/track/index?sort_by=popularity&fields=name,popularity,duration_ms",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    # the stored values are sent as they are, only the index's copy is clamped
+    assert [(t["popularity"], t["duration_ms"]) for t in response.json()["tracks"]] == [
+        (200, 5_000_000_000),
+        (50, 2000),
+        (-300, -1),
+    ]
+    by_duration = client.get("/track/index?sort_by=duration_ms", headers=headers)
+    assert by_duration.json()["tracks"][0]["name"] == "song 0000"
+
+
+def test_stats_are_the_callers_own(client, make_user):
+    alice_id, alice = make_user()
+    bob_id, bob = make_user()
+    sync(client, alice, [track(i, alice_id) for i in range(3)])
+    sync(client, bob, [track(i, bob_id) for i in range(40)])
+    client.get("/track/index", headers=bob)
+
+    stats = client.get("/track/index/stats", headers=alice).json()
+    assert stats["tracks"] == 3
+    assert "users" not in stats
@@ -0,0 +1,66 @@
+import base64
+import json
+
+import pytest
+
+from conftest import track
+
+"""
+GET /track/tracks: the start/end slices and the keyset cursor pages.
+"""
+
+
+def make_cursor(*parts) -> str:
+    return base64.urlsafe_b64encode(json.dumps(parts).encode()).decode().rstrip("=")
+
+
+@pytest.fixture
+def library(client, make_user):
+    user_id, headers = make_user()
+    tracks = [track(i, user_id) for i in range(25)]
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+    return headers
+
+
+def test_cursor_pages_cover_every_track_once(client, library):
+    names, cursor = [], None
+    while True:
+        url = "/track/tracks?limit=7&sort_by=name&order=desc"
+        if cursor:
+            url += f"&cursor={cursor}"
+        page = client.get(url, headers=library).json()
+        names += [t["name"] for t in page["tracks"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert names == sorted((f"song {i:04d}" for i in range(25)), reverse=True)
+
+
+def test_start_end_slice(client, library):
+    response = client.get(
+        "/track/tracks?start=3&end=6&sort_by=name&order=asc", headers=library
+    )
+    assert [t["name"] for t in response.json()] == [
+        "song 0003",
+        "song 0004",
+        "song 0005",
+    ]
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        make_cursor("name", "asc", "song"),
+        make_cursor("password", "asc", "song", 1),
+        make_cursor("name", "sideways", "song", 1),
+        make_cursor(["name"], "asc", "song", 1),
+        make_cursor("name", "asc", ["song", "x"], 1),
+        make_cursor("name", "asc", {"a": 1}, 1),
+        make_cursor("name", "asc", "song", "1"),
+        make_cursor("name", "asc", "song", 1.5),
+    ],
+)
+def test_malformed_cursor_is_400(client, library, cursor):
+    response = client.get(f"/track/tracks?cursor={cursor}", headers=library)
+    assert response.status_code == 400
@@ -0,0 +1,142 @@
+import json
+
+from backend.app.models.web.track import TrackIn
+from backend.app.services.track_sync import (
+    delete_unseen,
+    empty_counts,
+    end_seen_keys,
+    mark_seen,
+    start_seen_keys,
+    upsert_tracks,
+)
+from conftest import track
+
+"""
+The sync endpoints (/track/sync-tracks, /sync-tracks/stream, /sync-tracks/removals)
+and the pruning of tracks that are gone from the library, see services/track_sync.py.
+"""
+
+
+def names(client, headers) -> list[str]:
+    tracks = client.get("/track/tracks?limit=100&sort_by=name", headers=headers)
+    return sorted(t["name"] for t in tracks.json()["tracks"])
+
+
+def test_full_sync_diffs_against_the_stored_library(client, make_user):
+    user_id, headers = make_user()
+    first = [track(i, user_id) for i in range(5)]
+    client.post("/track/sync-tracks", json=first, headers=headers)
+
+    second = [track(i, user_id) for i in range(1, 6)]
+    second[0]["name"] = "renamed"
+    counts = client.post("/track/sync-tracks", json=second, headers=headers).json()
+    assert (counts["inserted"], counts["updated"], counts["deleted"]) == (1, 1, 1)
+    assert counts["unchanged"] == 3
+    assert names(client, headers) == sorted(
+        ["renamed", "song 0002", "song 0003", "song 0004", "song 0005"]
+    )
+
+
+def test_stream_sync_prunes_what_it_didnt_see(client, make_user):
+    user_id, headers = make_user()
+    client.post(
+        "/track/sync-tracks",
+        json=[track(i, user_id) for i in range(6)],
+        headers=headers,
+    )
+
+    body = "\n".join(json.dumps(track(i, user_id)) for i in range(2, 6))
+    response = client.post("/track/sync-tracks/stream", content=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["deleted"] == 2
+    assert names(client, headers) == [f"song {i:04d}" for i in range(2, 6)]
+
+
+def test_removals_keep_only_the_keys_sent(client, make_user):
+    user_id, headers = make_user()
+    tracks = [track(i, user_id) for i in range(4)]
+    client.post("/track/sync-tracks", json=tracks, headers=headers)
+
+    keys = [tracks[0]["added_at"], tracks[3]["added_at"]]
+    response = client.post("/track/sync-tracks/removals", json=keys, headers=headers)
+    assert response.json() == {"deleted": 2}
+    assert names(client, headers) == ["song 0000", "song 0003"]
+
+
+def test_tracks_added_during_a_stream_are_not_pruned(conn, make_user):
+    user_id, _ = make_user()
+    cursor = conn.cursor()
+    upsert_tracks(cursor, user_id, [TrackIn(**track(0, user_id))], empty_counts())
+    conn.commit()
+
+    sync_id = start_seen_keys(cursor)
+    mark_seen(cursor, sync_id, [])
+    conn.commit()
+    # a write between two chunks of the stream, like POST /track/
+    upsert_tracks(cursor, user_id, [TrackIn(**track(1, user_id))], empty_counts())
+    conn.commit()
+
+    cursor.execute("BEGIN IMMEDIATE")
+    assert delete_unseen(cursor, user_id, sync_id) == 1
+    end_seen_keys(cursor, sync_id)
+    conn.commit()
+
+    cursor.execute("SELECT name FROM track WHERE user_id = ?", (user_id,))
+    assert cursor.fetchall() == [("song 0001",)]
+
+
+def test_delta_sync_moves_the_watermark(client, make_user):
+    user_id, headers = make_user()
+    state = client.get("/track/sync-state", headers=headers).json()
+    assert (state["watermark"], state["full_sync_due"]) == (None, True)
+
+    # Spotify counts 4 items, one of them a local file that isn't stored
+    client.post(
+        "/track/sync-tracks?total=4",
+        json=[track(i, user_id) for i in range(3)],
+        headers=headers,
+    )
+    state = client.get("/track/sync-state", headers=headers).json()
+    assert state["watermark"] == track(2)["added_at"]
+    assert (state["track_count"], state["full_sync_due"]) == (3, False)
+    assert state["skipped_items"] == 1
+
+    # the new tracks, with the library size Spotify reports: one old track is gone
+    new = [track(i, user_id) for i in range(3, 5)]
+    response = client.post(
+        "/track/sync-tracks?mode=delta&total=5", json=new, headers=headers
+    )
+    counts = response.json()
+    assert (counts["inserted"], counts["deleted"]) == (2, 0)
+    assert counts["reconcile_needed"] is True
+    state = client.get("/track/sync-state", headers=headers).json()
+    assert state["watermark"] == track(4)["added_at"]
+
+    response = client.post(
+        "/track/sync-tracks?mode=delta&total=6", json=[], headers=headers
+    )
+    assert response.json()["reconcile_needed"] is False
+
+
+def test_changed_tracks_keep_their_id_and_tags(client, conn, make_user):
+    user_id, headers = make_user()
+    client.post("/track/sync-tracks", json=[track(0, user_id)], headers=headers)
+    [song] = client.get("/track/tracks?limit=5", headers=headers).json()["tracks"]
+    rock = client.post(
+        "/tag/", json={"name": "Rock", "type": "genre"}, headers=headers
+    ).json()["id"]
+    body = {"track_ids": [song["id"]], "tag_ids": [rock]}
+    client.post("/tag/bulk-apply", json=body, headers=headers)
+
+    renamed = track(0, user_id, name="renamed", popularity=99)
+    counts = client.post("/track/sync-tracks", json=[renamed], headers=headers).json()
+    assert (counts["updated"], counts["inserted"], counts["deleted"]) == (1, 0, 0)
+
+    [after] = client.get("/track/tracks?limit=5", headers=headers).json()["tracks"]
+    assert (after["id"], after["name"], after["popularity"]) == (
+        song["id"],
+        "renamed",
+        99,
+    )
+    cursor = conn.execute("SELECT track_id FROM track_tag WHERE tag_id = ?", (rock,))
+    assert cursor.fetchall() == [(song["id"],)]
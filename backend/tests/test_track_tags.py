@@ -0,0 +1,68 @@
+from conftest import track
+
+"""
+POST /tag/bulk-apply and /tag/bulk-remove, see services/track_tags.py.
+"""
+
+
+def setup_library(client, user_id, headers, count=4) -> tuple[list[int], int, int]:
+    tracks = [track(i, user_id) for i in range(count)]
+    assert client.post("/track/sync-tracks", json=tracks, headers=headers).is_success
+    page = client.get("/track/tracks?limit=100&sort_by=name&order=asc", headers=headers)
+    track_ids = [t["id"] for t in page.json()["tracks"]]
+    rock, jazz = (
+        client.post(
+            "/tag/", json={"name": name, "type": "genre"}, headers=headers
+        ).json()["id"]
+        for name in ("Rock", "Jazz")
+    )
+    return track_ids, rock, jazz
+
+
+def tagged(conn, tag_id) -> int:
+    cursor = conn.execute("SELECT COUNT(*) FROM track_tag WHERE tag_id = ?", (tag_id,))
+    return cursor.fetchone()[0]
+
+
+def test_apply_twice_only_adds_once(client, conn, make_user):
+    user_id, headers = make_user()
+    track_ids, rock, jazz = setup_library(client, user_id, headers)
+
+    body = {"track_ids": track_ids[:3], "tag_ids": [rock, jazz, rock]}
+    response = client.post("/tag/bulk-apply", json=body, headers=headers)
+    assert response.json() == {"applied": {str(rock): 3, str(jazz): 3}, "total": 6}
+
+    body = {"track_ids": track_ids, "tag_ids": [rock]}
+    response = client.post("/tag/bulk-apply", json=body, headers=headers)
+    assert response.json()["total"] == 1
+    assert (tagged(conn, rock), tagged(conn, jazz)) == (4, 3)
+
+
+def test_remove(client, conn, make_user):
+    user_id, headers = make_user()
+    track_ids, rock, jazz = setup_library(client, user_id, headers)
+    body = {"track_ids": track_ids, "tag_ids": [rock, jazz]}
+    client.post("/tag/bulk-apply", json=body, headers=headers)
+
+    body = {"track_ids": track_ids[:2], "tag_ids": [rock]}
+    response = client.post("/tag/bulk-remove", json=body, headers=headers)
+    assert response.json() == {"removed": {str(rock): 2}, "total": 2}
+    assert (tagged(conn, rock), tagged(conn, jazz)) == (2, 4)
+
+
+def test_other_users_tracks_and_tags_are_left_alone(client, conn, make_user):
+    alice_id, alice = make_user()
+    bob_id, bob = make_user()
+    alice_tracks, alice_rock, _ = setup_library(client, alice_id, alice)
+    bob_tracks, bob_rock, _ = setup_library(client, bob_id, bob)
+
+    body = {"track_ids": bob_tracks, "tag_ids": [alice_rock]}
+    response = client.post("/tag/bulk-apply", json=body, headers=alice)
+    assert response.json()["total"] == 0
+
+    body = {"track_ids": alice_tracks, "tag_ids": [alice_rock, bob_rock]}
+    response = client.post("/tag/bulk-apply", json=body, headers=alice)
+    assert response.status_code == 404
+    assert response.json()["detail"]["tag_ids"] == [bob_rock]
+    # the whole request is one transaction, so alice_rock wasn't applied either
+    assert tagged(conn, alice_rock) == 0
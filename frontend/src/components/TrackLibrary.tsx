@@ -1,5 +1,5 @@
 import React, { useState } from "react";
-import { syncTracks } from "../lib/apis/web";
+import { syncTracksFromSpotify } from "../lib/apis/web";
 import TrackList from "./TrackList";
 
 const TrackLibrary: React.FC = () => {
@@ -8,7 +8,7 @@ const TrackLibrary: React.FC = () => {
     <div>
       <button
         onClick={async () => {
-          await syncTracks();
+          await syncTracksFromSpotify();
           setRefreshSignal((prev) => prev + 1);
         }}
       >
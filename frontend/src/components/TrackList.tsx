@@ -1,7 +1,7 @@
 import React, { useEffect, useState, useRef, useCallback } from "react";
 import { FixedSizeList as List } from "react-window";
 import type { ListOnItemsRenderedProps } from "react-window";
-import { getTracks } from "../lib/apis/web/index";
+import { getTracksPage } from "../lib/apis/web/index";
 
 const PAGE_SIZE = 20;
 
@@ -14,7 +14,7 @@ const TrackList: React.FC<TrackListProps> = ({ refreshSignal = 0 }) => {
   const [isLoading, setIsLoading] = useState(false);
   const [hasMore, setHasMore] = useState(true);
 
-  const startRef = useRef(0);
+  const cursorRef = useRef<string | null>(null);
   const isLoadingRef = useRef(false);
   const hasMoreRef = useRef(true);
 
@@ -27,14 +27,11 @@ const TrackList: React.FC<TrackListProps> = ({ refreshSignal = 0 }) => {
     setIsLoading(true);
 
     try {
-      const newTracks = await getTracks(
-        startRef.current,
-        startRef.current + PAGE_SIZE
-      );
-      setTracks((prev) => [...prev, ...newTracks]);
-      startRef.current += PAGE_SIZE;
+      const page = await getTracksPage(PAGE_SIZE, cursorRef.current);
+      setTracks((prev) => [...prev, ...page.tracks]);
+      cursorRef.current = page.next_cursor;
 
-      if (newTracks.length < PAGE_SIZE) {
+      if (!page.next_cursor) {
         hasMoreRef.current = false;
         setHasMore(false);
       }
@@ -49,7 +46,7 @@ const TrackList: React.FC<TrackListProps> = ({ refreshSignal = 0 }) => {
     // Reset all state and ref values
     setTracks([]);
     setHasMore(true);
-    startRef.current = 0;
+    cursorRef.current = null;
     hasMoreRef.current = true;
     // isLoadingRef.current does not need to be reset since it will be false after the previous fetch completes.
 
@@ -35,6 +35,43 @@ export async function getAllSavedTracks(): Promise<any[]> {
   return allTracks;
 }
 
+// Saved tracks newer than `since` (an added_at), newest first, plus the library size.
+// Spotify lists saved tracks newest first, so this stops at the first older track.
+export async function getSavedTracksSince(
+  since: string
+): Promise<{ items: any[]; total: number }> {
+  const token = localStorage.getItem("spotify_access_token");
+  if (!token) throw new Error("Access token not found.");
+
+  let items: any[] = [];
+  let offset = 0;
+  let total = 0;
+  const limit = 50;
+
+  while (true) {
+    const res = await fetch(
+      `https://api.spotify.com/v1/me/tracks?limit=${limit}&offset=${offset}`,
+      {
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
+      }
+    );
+    if (!res.ok) {
+      const error = await res.json();
+      throw new Error(`Failed to fetch tracks: ${error.error.message}`);
+    }
+    const data = await res.json();
+    total = data.total;
+    const newer = data.items.filter((item: any) => item.added_at > since);
+    items = items.concat(newer);
+    if (newer.length < data.items.length || data.items.length === 0) break;
+    offset += limit;
+  }
+
+  return { items, total };
+}
+
 export async function isTokenExpired() {
   const spotify_token = localStorage.getItem("spotify_access_token");
   if (!spotify_token) {
@@ -1,5 +1,5 @@
 import { transformTrackList } from "../spotify/transform";
-import { getAllSavedTracks } from "../spotify";
+import { getAllSavedTracks, getSavedTracksSince } from "../spotify";
 
 export async function getCurrentUser(): Promise<any> {
   const token = localStorage.getItem("app_access_token");
@@ -51,24 +51,76 @@ export async function getTagsHierarchy(): Promise<any[]> {
   return data;
 }
 
-export async function syncTracks() {
+export async function getSyncState(): Promise<any> {
+  const token = localStorage.getItem("app_access_token");
+  if (!token) throw new Error("App access token not found.");
+  const res = await fetch("http://localhost:8000/track/sync-state", {
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+  });
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(`Failed to fetch sync state: ${error.error}`);
+  }
+  return await res.json();
+}
+
+async function uploadTracks(tracks: any[], query: string = "") {
   const app_token = localStorage.getItem("app_access_token");
   if (!app_token) throw new Error("You must log in to the app first.");
 
+  const res = await fetch(`http://localhost:8000/track/sync-tracks${query}`, {
+    method: "POST",
+    headers: {
+      Authorization: `Bearer ${app_token}`,
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify(tracks),
+  });
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(`Failed to sync tracks: ${error.error}`);
+  }
+
+  return await res.json();
+}
+
+// Only uploads the tracks saved since the last sync, unless a full sync is due
+// or the library size shows that tracks were removed.
+export async function syncTracks() {
+  const state = await getSyncState();
+
+  if (!state.full_sync_due && state.watermark) {
+    const { items, total } = await getSavedTracksSince(state.watermark);
+    const newTracks = await transformTrackList(items);
+    const data = await uploadTracks(newTracks, `?mode=delta&total=${total}`);
+    if (!data.reconcile_needed && !data.full_sync_due) return data;
+  }
+
   let savedTracks = await getAllSavedTracks();
   let savedTracksObjects = await transformTrackList(savedTracks);
+  return await uploadTracks(savedTracksObjects);
+}
 
-  const res = await fetch("http://localhost:8000/track/sync-tracks", {
+// The backend fetches the saved tracks from Spotify itself, only new ones unless full is true
+export async function syncTracksFromSpotify(full: boolean = false) {
+  const app_token = localStorage.getItem("app_access_token");
+  if (!app_token) throw new Error("You must log in to the app first.");
+  const spotify_token = localStorage.getItem("spotify_access_token");
+  if (!spotify_token) throw new Error("Access token not found.");
+
+  const res = await fetch("http://localhost:8000/track/sync-spotify", {
     method: "POST",
     headers: {
       Authorization: `Bearer ${app_token}`,
       "Content-Type": "application/json",
     },
-    body: JSON.stringify(savedTracksObjects),
+    body: JSON.stringify({ access_token: spotify_token, full }),
   });
   if (!res.ok) {
     const error = await res.json();
-    throw new Error(`Failed to sync tracks: ${error.error}`);
+    throw new Error(`Failed to sync tracks: ${error.detail?.error || error.error}`);
   }
 
   const data = await res.json();
@@ -100,6 +152,80 @@ export async function getTracks(
   return data;
 }
 
+export async function getTracksPage(
+  limit: number = 50,
+  cursor: string | null = null,
+  sort_by: string = "added_at",
+  order: "asc" | "desc" = "desc"
+): Promise<{ tracks: any[]; next_cursor: string | null }> {
+  const token = localStorage.getItem("app_access_token");
+  if (!token) throw new Error("App access token not found.");
+  const params = new URLSearchParams({
+    limit: String(limit),
+    sort_by,
+    order,
+  });
+  if (cursor) params.set("cursor", cursor);
+  const res = await fetch(`http://localhost:8000/track/tracks?${params}`, {
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+  });
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(`Failed to fetch tracks: ${error.error}`);
+  }
+
+  const data = await res.json();
+  return data;
+}
+
+export async function searchTracks(
+  q: string,
+  limit: number = 20,
+  offset: number = 0
+): Promise<{ tracks: any[]; next_offset: number | null }> {
+  const token = localStorage.getItem("app_access_token");
+  if (!token) throw new Error("App access token not found.");
+  const params = new URLSearchParams({
+    q,
+    limit: String(limit),
+    offset: String(offset),
+  });
+  const res = await fetch(`http://localhost:8000/track/search?${params}`, {
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+  });
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(`Failed to search tracks: ${error.error}`);
+  }
+
+  return await res.json();
+}
+
+export async function browseTracks(
+  filters: Record<string, string | number | boolean> = {}
+): Promise<{ total: number; tracks: any[]; facets: Record<string, any[]> }> {
+  const token = localStorage.getItem("app_access_token");
+  if (!token) throw new Error("App access token not found.");
+  const params = new URLSearchParams(
+    Object.entries(filters).map(([key, value]) => [key, String(value)])
+  );
+  const res = await fetch(`http://localhost:8000/track/index?${params}`, {
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+  });
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(`Failed to browse tracks: ${error.error}`);
+  }
+
+  return await res.json();
+}
+
 export async function addTag(tag: any): Promise<any> {
   const app_token = localStorage.getItem("app_access_token");
   if (!app_token) throw new Error("You must log in to the app first.");